@@ -0,0 +1,76 @@
+'''
+Micro-benchmark for attribute extraction from single XMI element lines.
+
+Compares the previous per-attribute regex approach (one regex per
+getAttributeValue call, as XMI.getMentions used to do for each line)
+against a single precompiled pass with common.getAttributes.
+
+Usage: python bench_attributes.py [NUM_LINES]
+'''
+
+import os
+import re
+import sys
+import time
+
+_here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(_here, '..'))
+from ctakes.format import common
+
+_lines = [
+    '<textsem:DiseaseDisorderMention xmi:id="%d" sofa="3" begin="%d" end="%d" ontologyConceptArr="%d %d" typeID="2" polarity="1" uncertainty="0" conditional="false" generic="false" subject="patient" confidence="0.0" discoveryTechnique="1"/>',
+    '<refsem:UmlsConcept xmi:id="%d" codingScheme="SNOMEDCT_US" code="%d" score="0.0" disambiguated="false" cui="C%07d" tui="T047" preferredText="Diabetes mellitus"/>',
+]
+
+# the attributes XMI.getMentions used to read from mention and concept lines
+_mention_fields = ('ontologyConceptArr', 'begin', 'end')
+_concept_fields = ('id', 'cui')
+
+def _previousGetAttributeValue(line, attr_name):
+    match = re.findall('%s=".+"' % attr_name, line)
+    match = match[0]
+    opn = match.index('"')
+    cls = match[opn+1:].index('"')
+    return match[opn+1:opn+cls+1]
+
+def _previous(line):
+    fields = _mention_fields if line[1] == 't' else _concept_fields
+    return tuple([_previousGetAttributeValue(line, field) for field in fields])
+
+def _current(line):
+    fields = _mention_fields if line[1] == 't' else _concept_fields
+    return common.getAttributes(line, fields)
+
+def _currentDict(line):
+    return common.getAttributes(line)
+
+def makeLines(num_lines):
+    lines = []
+    for i in range(num_lines):
+        if i % 2 == 0: lines.append(_lines[0] % (i, i*10, i*10+7, i+1, i+2))
+        else: lines.append(_lines[1] % (i, i, i))
+    return lines
+
+def timeIt(fn, lines, repeats=5):
+    '''Return the best time (in seconds) over several runs of fn on every line.
+    '''
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for line in lines: fn(line)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best: best = elapsed
+    return best
+
+if __name__ == '__main__':
+    num_lines = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    lines = makeLines(num_lines)
+    assert [_previous(line) for line in lines[:100]] == [_current(line) for line in lines[:100]]
+
+    previous = timeIt(_previous, lines)
+    current = timeIt(_current, lines)
+    current_dict = timeIt(_currentDict, lines)
+    print('lines: %d' % num_lines)
+    print('per-attribute regexes        : %.2f us/line' % (1e6 * previous / num_lines))
+    print('getAttributes (field tuple)  : %.2f us/line (%.2fx)' % (1e6 * current / num_lines, previous / current))
+    print('getAttributes (all, as dict) : %.2f us/line (%.2fx)' % (1e6 * current_dict / num_lines, previous / current_dict))
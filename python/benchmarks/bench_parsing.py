@@ -0,0 +1,209 @@
+'''
+Benchmark harness for the public XMI and CAS parsing entry points.
+
+Generates synthetic documents (see synthetic.py) over a grid of sizes,
+formats and layouts, then times each entry point (best and mean over
+several runs) and measures its peak traced memory in a separate run
+(tracemalloc slows execution, so it is kept out of the timings).
+Results are written as JSON for comparison across commits.
+
+Usage: python bench_parsing.py [options] OUTFILE
+'''
+
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import tracemalloc
+import subprocess
+import optparse
+from datetime import datetime
+
+_here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(_here, '..'))
+import synthetic
+from ctakes.format import XMI, CAS, common
+
+def _documentAll(fmt, fpath):
+    '''Parse once through a Document and read every product from it.
+    '''
+    doc = fmt.Document(fpath)
+    mentions = doc.mentions
+    return (doc.document_id, doc.text, mentions, doc.sentences,
+        doc.tokens(mentions=mentions, by_sentence=True))
+
+# entry point name -> function(module, fpath)
+ENTRY_POINTS = [
+    ('getDocumentID', lambda fmt, fpath: fmt.getDocumentID(fpath)),
+    ('getMentions', lambda fmt, fpath: fmt.getMentions(fpath)),
+    ('getTokens', lambda fmt, fpath: fmt.getTokens(fpath)),
+    ('getTokens(POS,words_only)', lambda fmt, fpath: fmt.getTokens(fpath, get_POS_tags=True, words_only=True)),
+    ('getTokens(by_sentence)', lambda fmt, fpath: fmt.getTokens(fpath, by_sentence=True)),
+    ('getTokens(mentions,by_sentence)', lambda fmt, fpath: fmt.getTokens(
+        fpath, mentions=fmt.getMentions(fpath), by_sentence=True)),
+    ('getTokens(mentions,surface)', lambda fmt, fpath: fmt.getTokens(
+        fpath, mentions=fmt.getMentions(fpath), surface=True)),
+    ('iterMentions', lambda fmt, fpath: list(fmt.iterMentions(fpath))),
+    ('iterTokens', lambda fmt, fpath: list(fmt.iterTokens(fpath))),
+    ('iterTokens(mentions)', lambda fmt, fpath: list(fmt.iterTokens(fpath, mentions=fmt.getMentions(fpath)))),
+    ('iterSentences', lambda fmt, fpath: list(fmt.iterSentences(fpath))),
+    ('iterSentences(mentions,surface)', lambda fmt, fpath: list(fmt.iterSentences(
+        fpath, mentions=fmt.getMentions(fpath), surface=True))),
+    ('Document', _documentAll),
+] + [
+    # overlaps='all' (the default) is timed above
+    ('getTokens(mentions,overlaps=%s)' % policy, lambda fmt, fpath, policy=policy: fmt.getTokens(
+        fpath, mentions=fmt.getMentions(fpath), overlaps=policy))
+        for policy in common.OVERLAP_POLICIES if policy != 'all'
+]
+
+FORMATS = {
+    'XMI': (XMI, synthetic.writeXMI, '.xmi'),
+    'CAS': (CAS, synthetic.writeCAS, '.xml'),
+}
+
+def timeEntryPoint(fn, fmt, fpath, repeats):
+    '''Return (best, mean) wall-clock seconds over repeats runs.
+    '''
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn(fmt, fpath)
+        times.append(time.perf_counter() - start)
+    return min(times), sum(times) / len(times)
+
+def peakMemory(fn, fmt, fpath):
+    '''Return the peak memory (in bytes) allocated during one run.
+    '''
+    tracemalloc.start()
+    try:
+        fn(fmt, fpath)
+        (_, peak) = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+def runBenchmarks(sizes, formats, layouts, repeats=3, mention_density=0.1,
+        overlap_rate=0.2, entry_points=None, workdir=None, log=None):
+    '''Run every combination of the input settings; return a list of
+    result records (dicts).
+    '''
+    if entry_points is None: entry_points = [name for (name, _) in ENTRY_POINTS]
+    fns = dict(ENTRY_POINTS)
+    results = []
+    for num_tokens in sizes:
+        doc = synthetic.generateDocument(num_tokens=num_tokens,
+            mention_density=mention_density, overlap_rate=overlap_rate, seed=num_tokens)
+        for format_name in formats:
+            (fmt, writer, ext) = FORMATS[format_name]
+            for layout in layouts:
+                fpath = os.path.join(workdir, '%s_%d_%s%s' % (format_name, num_tokens, layout, ext))
+                writer(doc, fpath, clean=(layout == 'clean'))
+                file_bytes = os.path.getsize(fpath)
+                for name in entry_points:
+                    fn = fns[name]
+                    (best, mean) = timeEntryPoint(fn, fmt, fpath, repeats)
+                    peak = peakMemory(fn, fmt, fpath)
+                    result = {
+                        'format': format_name,
+                        'layout': layout,
+                        'num_tokens': num_tokens,
+                        'num_mentions': len(doc.mentions),
+                        'file_bytes': file_bytes,
+                        'entry_point': name,
+                        'repeats': repeats,
+                        'best_sec': best,
+                        'mean_sec': mean,
+                        'MB_per_sec': (file_bytes / (1024**2)) / best if best > 0 else None,
+                        'peak_bytes': peak,
+                    }
+                    results.append(result)
+                    if log:
+                        log.write('%-4s %-6s %8d tokens  %-40s %9.4fs  %7.1f MB/s  peak %8.1f MB\n' % (
+                            format_name, layout, num_tokens, name, best,
+                            result['MB_per_sec'] or 0, peak / (1024**2)))
+                        log.flush()
+                os.remove(fpath)
+    return results
+
+def environment():
+    '''Describe the machine and code version the benchmarks ran on.
+    '''
+    try:
+        revision = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+    return {
+        'timestamp': datetime.now().isoformat(),
+        'python': sys.version.split()[0],
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'git_revision': revision,
+    }
+
+if __name__ == '__main__':
+    def _cli():
+        parser = optparse.OptionParser(usage='Usage: %prog [options] OUTFILE')
+        parser.add_option('-s', '--sizes', dest='sizes', default='1000,10000,100000',
+            help='comma-separated document sizes, in tokens (default: %default)')
+        parser.add_option('-f', '--formats', dest='formats', default='XMI,CAS',
+            help='comma-separated formats (default: %default)')
+        parser.add_option('-l', '--layouts', dest='layouts', default='single,clean',
+            help='comma-separated layouts: "single" (one line) or "clean" (one element per line) (default: %default)')
+        parser.add_option('-e', '--entry-points', dest='entry_points', default=None,
+            help='comma-separated entry points to run (default: all of %s)' % ', '.join(
+                [name for (name, _) in ENTRY_POINTS]))
+        parser.add_option('-r', '--repeats', dest='repeats', type='int', default=3,
+            help='timed runs per measurement (default: %default)')
+        parser.add_option('-d', '--mention-density', dest='mention_density', type='float', default=0.1,
+            help='probability of a mention starting at each token (default: %default)')
+        parser.add_option('-o', '--overlap-rate', dest='overlap_rate', type='float', default=0.2,
+            help='probability of a mention having an overlapping mention (default: %default)')
+        parser.add_option('-w', '--workdir', dest='workdir', default=None,
+            help='directory for generated files (default: a temporary directory)')
+        (options, args) = parser.parse_args()
+        if len(args) != 1:
+            parser.print_help()
+            exit()
+        return args[0], options
+    outf, options = _cli()
+
+    sizes = [int(s) for s in options.sizes.split(',')]
+    formats = options.formats.split(',')
+    layouts = options.layouts.split(',')
+    # (entry point names may themselves hold commas, inside parentheses)
+    entry_points = re.split(r',(?![^(]*\))', options.entry_points) if options.entry_points else None
+    unknown = [name for name in (entry_points or []) if not name in dict(ENTRY_POINTS)]
+    if len(unknown) > 0:
+        sys.stderr.write('Unknown entry points: %s\n' % ', '.join(unknown))
+        exit(1)
+
+    workdir = options.workdir or tempfile.mkdtemp(prefix='ctakes-bench-')
+    try:
+        results = runBenchmarks(sizes, formats, layouts, repeats=options.repeats,
+            mention_density=options.mention_density, overlap_rate=options.overlap_rate,
+            entry_points=entry_points, workdir=workdir, log=sys.stdout)
+    finally:
+        if options.workdir is None: shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(outf, 'w') as stream:
+        json.dump({
+            'environment': environment(),
+            'settings': {
+                'sizes': sizes,
+                'formats': formats,
+                'layouts': layouts,
+                'repeats': options.repeats,
+                'mention_density': options.mention_density,
+                'overlap_rate': options.overlap_rate,
+            },
+            'results': results,
+        }, stream, indent=2)
+    print('Wrote %d results to %s' % (len(results), outf))
@@ -0,0 +1,164 @@
+'''
+Benchmark for read-ahead (ctakes.prefetch) on a slow filesystem.
+
+Writes a corpus of synthetic documents (see synthetic.py), then runs
+corpus.processCorpus over it with a DelayedReader standing in for a slow
+or networked filesystem: every file read waits a fixed latency plus its
+size over a bandwidth limit.  Each read-ahead window is timed against the
+same reader, so the gain from overlapping reads with parsing can be
+measured offline.  A zero latency is included by default, so the case of
+reads finishing before the read-ahead bookkeeping (local, cached files)
+is exercised too.  Results are written as JSON.
+
+Usage: python bench_prefetch.py [options] OUTFILE
+'''
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import optparse
+
+_here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(_here, '..'))
+import synthetic
+from bench_parsing import FORMATS, environment
+from ctakes import corpus, prefetch
+
+class DelayedReader:
+    '''Reads whole files, sleeping latency seconds plus size/bandwidth
+    (in bytes/sec; None for unlimited) per file to simulate a slow
+    filesystem.
+    '''
+    def __init__(self, latency=0.02, bandwidth=None):
+        self.latency = latency
+        self.bandwidth = bandwidth
+
+    def __call__(self, fpath):
+        data = prefetch.readFile(fpath)
+        delay = self.latency
+        if self.bandwidth: delay += len(data) / self.bandwidth
+        time.sleep(delay)
+        return data
+
+def writeCorpus(workdir, num_files, num_tokens, format_name='XMI'):
+    '''Write num_files synthetic documents; returns their paths.
+    '''
+    (_, writer, ext) = FORMATS[format_name]
+    fpaths = []
+    for i in range(num_files):
+        doc = synthetic.generateDocument(num_tokens=num_tokens, seed=i)
+        fpath = os.path.join(workdir, 'doc%05d%s' % (i, ext))
+        writer(doc, fpath)
+        fpaths.append(fpath)
+    return fpaths
+
+def timeCorpus(fpaths, reader, read_ahead, num_workers=1, io_threads=4, chunk_size=16):
+    '''Return the wall-clock seconds to parse every file in fpaths.
+    '''
+    start = time.perf_counter()
+    for result in corpus.processCorpus(fpaths, num_workers=num_workers, chunk_size=chunk_size,
+            read_ahead=read_ahead, io_threads=io_threads, reader=reader):
+        if result.error != None:
+            raise RuntimeError('Failed to parse %s:\n%s' % (result.path, result.error))
+    return time.perf_counter() - start
+
+def runBenchmarks(fpaths, windows, reader, repeats=3, num_workers=1, io_threads=4,
+        chunk_size=16, log=None):
+    '''Time each read-ahead window (runs of the windows are interleaved,
+    to spread machine noise evenly); return a list of result records.
+    '''
+    times = { window: [] for window in windows }
+    for _ in range(repeats):
+        for window in windows:
+            times[window].append(timeCorpus(fpaths, reader, window, num_workers=num_workers,
+                io_threads=io_threads, chunk_size=chunk_size))
+    total_bytes = sum(os.path.getsize(fpath) for fpath in fpaths)
+    baseline = min(times[windows[0]])
+    results = []
+    for window in windows:
+        best = min(times[window])
+        result = {
+            'read_ahead': window,
+            'repeats': repeats,
+            'best_sec': best,
+            'mean_sec': sum(times[window]) / len(times[window]),
+            'docs_per_sec': len(fpaths) / best,
+            'MB_per_sec': (total_bytes / (1024**2)) / best,
+            'speedup': baseline / best,
+        }
+        results.append(result)
+        if log:
+            log.write('read-ahead %3d  %8.3fs  %7.1f docs/s  %6.2f MB/s  x%.2f\n' % (
+                window, best, result['docs_per_sec'], result['MB_per_sec'], result['speedup']))
+            log.flush()
+    return results
+
+if __name__ == '__main__':
+    def _cli():
+        parser = optparse.OptionParser(usage='Usage: %prog [options] OUTFILE')
+        parser.add_option('-d', '--docs', dest='num_files', type='int', default=64,
+            help='number of documents in the corpus (default: %default)')
+        parser.add_option('-s', '--size', dest='num_tokens', type='int', default=2000,
+            help='document size, in tokens (default: %default)')
+        parser.add_option('-f', '--format', dest='format', default='XMI', choices=list(FORMATS.keys()),
+            help='document format (default: %default)')
+        parser.add_option('-w', '--windows', dest='windows', default='0,2,8',
+            help='comma-separated read-ahead windows to compare, the first being the'
+                 ' baseline (default: %default)')
+        parser.add_option('--latencies', dest='latencies', default='0,0.02',
+            help='comma-separated simulated seconds of latency per file read, each'
+                 ' benchmarked in turn (default: %default)')
+        parser.add_option('--bandwidth', dest='bandwidth', type='float', default=None,
+            help='simulated read bandwidth, in MB/sec (default: unlimited)')
+        parser.add_option('-t', '--io-threads', dest='io_threads', type='int', default=4,
+            help='reading threads per worker (default: %default)')
+        parser.add_option('-n', '--num-workers', dest='num_workers', type='int', default=1,
+            help='number of worker processes (default: %default)')
+        parser.add_option('-r', '--repeats', dest='repeats', type='int', default=3,
+            help='timed runs per window (default: %default)')
+        parser.add_option('--workdir', dest='workdir', default=None,
+            help='directory for generated files (default: a temporary directory)')
+        (options, args) = parser.parse_args()
+        if len(args) != 1:
+            parser.print_help()
+            exit()
+        return args[0], options
+    outf, options = _cli()
+
+    windows = [int(w) for w in options.windows.split(',')]
+    latencies = [float(latency) for latency in options.latencies.split(',')]
+    bandwidth = options.bandwidth * 1024 * 1024 if options.bandwidth else None
+
+    workdir = options.workdir or tempfile.mkdtemp(prefix='ctakes-bench-')
+    try:
+        fpaths = writeCorpus(workdir, options.num_files, options.num_tokens, options.format)
+        results = []
+        for latency in latencies:
+            print('Latency %.3fs:' % latency)
+            reader = DelayedReader(latency=latency, bandwidth=bandwidth)
+            for result in runBenchmarks(fpaths, windows, reader, repeats=options.repeats,
+                    num_workers=options.num_workers, io_threads=options.io_threads, log=sys.stdout):
+                result['latency'] = latency
+                results.append(result)
+    finally:
+        if options.workdir is None: shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(outf, 'w') as stream:
+        json.dump({
+            'environment': environment(),
+            'settings': {
+                'num_files': options.num_files,
+                'num_tokens': options.num_tokens,
+                'format': options.format,
+                'latencies': latencies,
+                'bandwidth_MB_per_sec': options.bandwidth,
+                'io_threads': options.io_threads,
+                'num_workers': options.num_workers,
+                'repeats': options.repeats,
+            },
+            'results': results,
+        }, stream, indent=2)
+    print('Wrote %d results to %s' % (len(results), outf))
@@ -0,0 +1,200 @@
+'''
+Generator for synthetic cTAKES XMI and CAS output files.
+
+Documents are built from a small clinical vocabulary with randomly placed
+sentences, tokens (word, number, punctuation and symbol), UMLS concept
+mentions (optionally overlapping) and a DocumentID, and can be written
+either as single-line files (as cTAKES writes them) or with one element
+per line (as produced by clean-xmi).
+
+Usage:
+    doc = generateDocument(num_tokens=10000, mention_density=0.1, seed=1)
+    writeXMI(doc, 'doc.xmi')
+    writeCAS(doc, 'doc.xml', clean=True)
+'''
+
+import random
+from xml.sax.saxutils import quoteattr
+
+_words = [
+    'patient', 'denies', 'chest', 'pain', 'weight', 'loss', 'diabetes',
+    'mellitus', 'type', 'heart', 'failure', 'history', 'of', 'with', 'no',
+    'acute', 'distress', 'blood', 'pressure', 'shortness', 'breath',
+    'reports', 'mild', 'fever', 'cough', 'medication', 'daily', 'mg',
+]
+_symbols = ['&', '%', '/', '<', '>', '+']
+_punctuation = ['.', ',', ';', ':']
+_pos_tags = ['NN', 'NNS', 'VBZ', 'JJ', 'IN', 'DT', 'CD', 'SYM', '.']
+_mention_types = [
+    'SignSymptomMention',
+    'DiseaseDisorderMention',
+    'MedicationMention',
+    'ProcedureMention',
+    'AnatomicalSiteMention',
+]
+
+_xmi_namespaces = [
+    ('xmi', 'http://www.omg.org/XMI'),
+    ('cas', 'http:///uima/cas.ecore'),
+    ('tcas', 'http:///uima/tcas.ecore'),
+    ('textspan', 'http:///org/apache/ctakes/typesystem/type/textspan.ecore'),
+    ('syntax', 'http:///org/apache/ctakes/typesystem/type/syntax.ecore'),
+    ('textsem', 'http:///org/apache/ctakes/typesystem/type/textsem.ecore'),
+    ('refsem', 'http:///org/apache/ctakes/typesystem/type/refsem.ecore'),
+    ('structured', 'http:///org/apache/ctakes/typesystem/type/structured.ecore'),
+]
+
+class SyntheticDocument:
+    '''Annotations for one synthetic document.
+
+    tokens    :: list of (begin, end, text, token type, POS or None)
+    sentences :: list of (begin, end)
+    mentions  :: list of (begin, end, mention type, [CUIs])
+    '''
+    def __init__(self, document_id, text, tokens, sentences, mentions):
+        self.document_id = document_id
+        self.text = text
+        self.tokens = tokens
+        self.sentences = sentences
+        self.mentions = mentions
+
+def generateDocument(num_tokens=1000, num_sentences=None, mention_density=0.1,
+        overlap_rate=0.2, max_mention_tokens=4, max_CUIs=3, seed=0):
+    '''Generate a SyntheticDocument.
+
+    Parameters:
+        num_tokens         :: number of tokens in the document
+        num_sentences      :: number of sentences (default: ~1 per 12 tokens)
+        mention_density    :: probability of a mention starting at each token
+        overlap_rate       :: probability of each mention having a second,
+                              overlapping mention starting inside it
+        max_mention_tokens :: maximum mention length, in tokens
+        max_CUIs           :: maximum number of CUIs per mention
+        seed               :: random seed
+    '''
+    rand = random.Random(seed)
+    if num_sentences is None: num_sentences = max(1, num_tokens // 12)
+    num_sentences = max(1, min(num_sentences, num_tokens))
+
+    # tokens, separated by single spaces
+    tokens, pieces, offset = [], [], 0
+    for _ in range(num_tokens):
+        roll = rand.random()
+        if roll < 0.08: (text, token_type) = (rand.choice(_punctuation), 'PunctuationToken')
+        elif roll < 0.11: (text, token_type) = (rand.choice(_symbols), 'SymbolToken')
+        elif roll < 0.18: (text, token_type) = (str(rand.randint(0, 500)), 'NumToken')
+        else: (text, token_type) = (rand.choice(_words), 'WordToken')
+        pos = rand.choice(_pos_tags) if rand.random() < 0.95 else None
+        tokens.append((offset, offset + len(text), text, token_type, pos))
+        pieces.append(text)
+        offset += len(text) + 1
+    text = ' '.join(pieces)
+
+    # sentences, as contiguous runs of tokens
+    breaks = sorted(rand.sample(range(1, num_tokens), num_sentences - 1)) if num_sentences > 1 else []
+    sentence_token_ranges = list(zip([0] + breaks, breaks + [num_tokens]))
+    sentences = [(tokens[first][0], tokens[stop-1][1]) for (first, stop) in sentence_token_ranges]
+
+    # mentions, kept within sentences
+    mentions = []
+    def _addMention(first, stop):
+        CUIs = ['C%07d' % rand.randint(1, 99999) for _ in range(rand.randint(1, max_CUIs))]
+        mentions.append((tokens[first][0], tokens[stop-1][1], rand.choice(_mention_types), CUIs))
+    for (sent_first, sent_stop) in sentence_token_ranges:
+        for first in range(sent_first, sent_stop):
+            if rand.random() >= mention_density: continue
+            stop = min(sent_stop, first + rand.randint(1, max_mention_tokens))
+            _addMention(first, stop)
+            if rand.random() < overlap_rate:
+                inner_first = rand.randint(first, stop - 1)
+                inner_stop = min(sent_stop, inner_first + rand.randint(1, max_mention_tokens))
+                if (inner_first, inner_stop) != (first, stop):
+                    _addMention(inner_first, inner_stop)
+
+    return SyntheticDocument('note%d.txt' % seed, text, tokens, sentences, mentions)
+
+def writeXMI(doc, fpath, clean=False):
+    '''Write a SyntheticDocument as cTAKES XMI output; if clean is True,
+    each element goes on its own line.
+    '''
+    ids = _IDs()
+    elements = [
+        '<cas:NULL xmi:id="0"/>',
+        '<cas:Sofa xmi:id="%d" sofaNum="1" sofaID="_InitialView" mimeType="text" sofaString=%s/>' % (
+            ids.sofa, quoteattr(doc.text)),
+        '<structured:DocumentID xmi:id="%d" sofa="%d" begin="0" end="0" documentID=%s/>' % (
+            ids.next(), ids.sofa, quoteattr(doc.document_id)),
+    ]
+    for (i, (begin, end)) in enumerate(doc.sentences):
+        elements.append('<textspan:Sentence xmi:id="%d" sofa="%d" begin="%d" end="%d" sentenceNumber="%d"/>' % (
+            ids.next(), ids.sofa, begin, end, i))
+    for (i, (begin, end, text, token_type, pos)) in enumerate(doc.tokens):
+        elements.append('<syntax:%s xmi:id="%d" sofa="%d" begin="%d" end="%d" tokenNumber="%d" normalizedForm=%s%s/>' % (
+            token_type, ids.next(), ids.sofa, begin, end, i, quoteattr(text),
+            ' partOfSpeech=%s' % quoteattr(pos) if pos != None else ''))
+    for (begin, end, mention_type, CUIs) in doc.mentions:
+        concept_ids = [ids.next() for _ in CUIs]
+        elements.append('<textsem:%s xmi:id="%d" sofa="%d" begin="%d" end="%d" ontologyConceptArr="%s" typeID="2" polarity="1"/>' % (
+            mention_type, ids.next(), ids.sofa, begin, end, ' '.join([str(c) for c in concept_ids])))
+        for (concept_id, cui) in zip(concept_ids, CUIs):
+            elements.append('<refsem:UmlsConcept xmi:id="%d" codingScheme="SNOMEDCT_US" code="%d" cui="%s" tui="T047"/>' % (
+                concept_id, concept_id, cui))
+
+    sep = '\n' if clean else ''
+    namespaces = ' '.join(['xmlns:%s="%s"' % (ns, uri) for (ns, uri) in _xmi_namespaces])
+    with open(fpath, 'w', encoding='utf-8') as stream:
+        stream.write('<?xml version="1.0" encoding="UTF-8"?><xmi:XMI %s xmi:version="2.0">%s' % (namespaces, sep))
+        for element in elements:
+            stream.write(element)
+            stream.write(sep)
+        stream.write('</xmi:XMI>\n')
+
+def writeCAS(doc, fpath, clean=False):
+    '''Write a SyntheticDocument as cTAKES CAS output; if clean is True,
+    each element goes on its own line.
+    '''
+    ctakes = 'org.apache.ctakes.typesystem.type'
+    ids = _IDs()
+    elements = [
+        '<uima.cas.Sofa _indexed="0" _id="%d" sofaNum="1" sofaID="_InitialView" mimeType="text" sofaString=%s/>' % (
+            ids.sofa, quoteattr(doc.text)),
+        '<%s.structured.DocumentID _indexed="1" _id="%d" _ref_sofa="%d" begin="0" end="0" documentID=%s/>' % (
+            ctakes, ids.next(), ids.sofa, quoteattr(doc.document_id)),
+    ]
+    for (i, (begin, end)) in enumerate(doc.sentences):
+        elements.append('<%s.textspan.Sentence _indexed="1" _id="%d" _ref_sofa="%d" begin="%d" end="%d" sentenceNumber="%d"/>' % (
+            ctakes, ids.next(), ids.sofa, begin, end, i))
+    for (i, (begin, end, text, token_type, pos)) in enumerate(doc.tokens):
+        elements.append('<%s.syntax.%s _indexed="1" _id="%d" _ref_sofa="%d" begin="%d" end="%d" tokenNumber="%d" normalizedForm=%s%s/>' % (
+            ctakes, token_type, ids.next(), ids.sofa, begin, end, i, quoteattr(text),
+            ' partOfSpeech=%s' % quoteattr(pos) if pos != None else ''))
+    for (begin, end, mention_type, CUIs) in doc.mentions:
+        array_id = ids.next()
+        concept_ids = [ids.next() for _ in CUIs]
+        elements.append('<%s.textsem.%s _indexed="1" _id="%d" _ref_sofa="%d" begin="%d" end="%d" _ref_ontologyConceptArr="%d" typeID="2" polarity="1"/>' % (
+            ctakes, mention_type, ids.next(), ids.sofa, begin, end, array_id))
+        elements.append('<uima.cas.FSArray _id="%d" size="%d">' % (array_id, len(concept_ids)))
+        elements.extend(['<i>%d</i>' % concept_id for concept_id in concept_ids])
+        elements.append('</uima.cas.FSArray>')
+        for (concept_id, cui) in zip(concept_ids, CUIs):
+            elements.append('<%s.refsem.UmlsConcept _indexed="0" _id="%d" codingScheme="SNOMEDCT_US" code="%d" cui="%s" tui="T047"/>' % (
+                ctakes, concept_id, concept_id, cui))
+
+    sep = '\n' if clean else ''
+    with open(fpath, 'w', encoding='utf-8') as stream:
+        stream.write('<?xml version="1.0" encoding="UTF-8"?><CAS version="2">%s' % sep)
+        for element in elements:
+            stream.write(element)
+            stream.write(sep)
+        stream.write('</CAS>\n')
+
+class _IDs:
+    '''Sequential UIMA feature structure IDs.
+    '''
+    def __init__(self):
+        self.sofa = 1
+        self._next = 10
+
+    def next(self):
+        self._next += 1
+        return self._next
@@ -1,13 +1,89 @@
 '''
 Module for cTAKES data models.
+
+@depends NumPy
 '''
 
+import sys
+import numpy as np
+
+class Sofa:
+    '''The original text of a document (its UIMA Sofa string), held once
+    and shared by the annotations that refer to it; their surface text is
+    only sliced out when asked for.
+
+    Annotation offsets count UTF-16 code units (as Java strings do), so if
+    the text has characters outside the Basic Multilingual Plane, offsets
+    are mapped to string positions.  Offsets outside the text are clamped
+    to it (so spans past its end give short or empty text), whatever
+    characters it holds.
+    '''
+    __slots__ = ('text', '_positions')
+
+    def __init__(self, text=None):
+        self.text = None
+        self._positions = None
+        if text != None: self.setText(text)
+
+    def setText(self, text):
+        self.text = text
+        self._positions = None
+        if text and not text.isascii():
+            code_points = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+            widths = np.where(code_points > 0xFFFF, 2, 1)
+            if len(code_points) != widths.sum():
+                # string position of each UTF-16 offset
+                self._positions = np.repeat(np.arange(len(text) + 1), np.append(widths, 1))
+
+    def position(self, offset):
+        '''Return the string position of a (UTF-16) annotation offset,
+        clamped to the text.
+        '''
+        if self._positions is None:
+            if self.text is None: return offset
+            return min(max(offset, 0), len(self.text))
+        return int(self._positions[min(max(offset, 0), len(self._positions) - 1)])
+
+    def slice(self, begin, end):
+        '''Return the text of the [begin, end) span, or None if the text is
+        not available.
+        '''
+        if self.text is None: return None
+        return self.text[self.position(begin):self.position(end)]
+
+    def context(self, begin, end, width=50):
+        '''Return (left context, text, right context) for the [begin, end)
+        span, with up to width characters of context on each side.
+        '''
+        if self.text is None: return None
+        (begin, end) = (self.position(begin), self.position(end))
+        return (self.text[max(0, begin-width):begin], self.text[begin:end], self.text[end:end+width])
+
 class Mention:
-    def __init__(self, CUIs=[], bounds=None):
+    __slots__ = ('CUIs', 'begin', 'end', 'text', 'type', 'sofa')
+
+    def __init__(self, CUIs=[], bounds=None, type=None, sofa=None):
         self.CUIs = CUIs
         self.begin = bounds[0] if bounds != None else None
         self.end = bounds[1] if bounds != None else None
-        self.text = None
+        self.text = None    # normalized token text, filled in by getTokens
+        self.type = type    # mention annotation type, e.g. 'DiseaseDisorderMention'
+        self.sofa = sofa    # document text (a Sofa), if available
+
+    @property
+    def surface(self):
+        '''The exact text of the mention in the original document (None if
+        the document text was not parsed, or the Mention was unpickled).
+        '''
+        if self.sofa is None: return None
+        return self.sofa.slice(self.begin, self.end)
+
+    def context(self, width=50):
+        '''Return (left context, surface text, right context) from the
+        original document, or None if the document text was not parsed.
+        '''
+        if self.sofa is None: return None
+        return self.sofa.context(self.begin, self.end, width=width)
 
     def __repr__(self):
         return '{ CUIs: [%s] Begin: %d End: %d Text: "%s" }' % (
@@ -18,14 +94,29 @@ class Mention:
         )
 
     def __eq__(self, other):
-        for c in self.CUIs:
-            if not c in other.CUIs: return False
+        if not isinstance(other, Mention): return NotImplemented
         return self.begin == other.begin \
            and self.end == other.end \
-           and self.text == other.text
+           and self.text == other.text \
+           and set(self.CUIs) == set(other.CUIs)
+
+    def __ne__(self, other):
+        eq = self.__eq__(other)
+        if eq is NotImplemented: return eq
+        return not eq
 
-    def __neq__(self, other):
-        return not self.__eq__(other)
+    def __hash__(self):
+        # text is left out, as it is filled in after the Mention is created
+        return hash((self.begin, self.end, frozenset(self.CUIs)))
+
+    def __getstate__(self):
+        # the document text stays in the process that parsed it, so pickled
+        # results (and results sent back from workers) do not each carry it
+        return { slot: getattr(self, slot) for slot in self.__slots__ if slot != 'sofa' }
+
+    def __setstate__(self, state):
+        for (slot, value) in state.items(): setattr(self, slot, value)
+        self.sofa = None
 
     def tokenize(self):
         '''Return list of individual surface tokens for this mention
@@ -34,8 +125,191 @@ class Mention:
         else: return []
 
 class Sentence:
-    def __init__(self, bounds=None, tokens=None):
+    __slots__ = ('tokens', 'begin', 'end', 'sofa')
+
+    def __init__(self, bounds=None, tokens=None, sofa=None):
         if tokens is None: self.tokens = []
         else: self.tokens = tokens
         self.begin = bounds[0] if not bounds is None else None
         self.end = bounds[1] if not bounds is None else None
+        self.sofa = sofa    # document text (a Sofa), if available
+
+    @property
+    def surface(self):
+        '''The exact text of the sentence in the original document (None if
+        the document text was not parsed, or the Sentence was unpickled).
+        '''
+        if self.sofa is None: return None
+        return self.sofa.slice(self.begin, self.end)
+
+    def __getstate__(self):
+        # as for Mention, the document text is not pickled
+        return { slot: getattr(self, slot) for slot in self.__slots__ if slot != 'sofa' }
+
+    def __setstate__(self, state):
+        for (slot, value) in state.items(): setattr(self, slot, value)
+        self.sofa = None
+
+
+### Compact mention storage ############
+
+class CUIVocabulary:
+    '''Shared mapping between CUI strings and integer IDs.
+
+    IDs are assigned in order of first appearance; CUI strings are interned.
+    '''
+    def __init__(self, CUIs=None):
+        self.CUIs = []
+        self._ids = {}
+        if CUIs != None:
+            for cui in CUIs: self.add(cui)
+
+    def add(self, cui):
+        '''Return the ID for cui, assigning a new one if needed.
+        '''
+        ID = self._ids.get(cui, None)
+        if ID is None:
+            ID = len(self.CUIs)
+            cui = sys.intern(cui)
+            self.CUIs.append(cui)
+            self._ids[cui] = ID
+        return ID
+
+    def get(self, cui, default=None):
+        '''Return the ID for cui, or default if it is not in the vocabulary.
+        '''
+        return self._ids.get(cui, default)
+
+    def __getitem__(self, ID):
+        return self.CUIs[ID]
+
+    def __contains__(self, cui):
+        return cui in self._ids
+
+    def __len__(self):
+        return len(self.CUIs)
+
+class MentionTable:
+    '''Array-backed storage for a list of mentions.
+
+    Mention bounds are stored as int32 arrays, and each mention's CUIs as
+    a slice of a flat array of vocabulary IDs (CSR layout):
+    the CUIs of mention i are cui_ids[cui_offsets[i]:cui_offsets[i+1]].
+
+    Usage:
+        table = MentionTable.fromMentions(XMI.getMentions(fpath))
+        diabetes = table.filterCUI('C0011849').toMentions()
+    '''
+    def __init__(self, begins, ends, cui_offsets, cui_ids, vocabulary, texts=None, types=None, sofa=None):
+        self.begins = np.asarray(begins, dtype=np.int32)
+        self.ends = np.asarray(ends, dtype=np.int32)
+        self.cui_offsets = np.asarray(cui_offsets, dtype=np.int64)
+        self.cui_ids = np.asarray(cui_ids, dtype=np.int32)
+        self.vocabulary = vocabulary
+        self.texts = texts
+        self.types = types
+        self.sofa = sofa
+        assert len(self.begins) == len(self.ends) == len(self.cui_offsets) - 1
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['sofa'] = None    # as for Mention, the document text is not pickled
+        return state
+
+    @classmethod
+    def fromMentions(cls, mentions, vocabulary=None):
+        '''Build a MentionTable from a list of Mention objects, adding their
+        CUIs to vocabulary (a new CUIVocabulary if not given).
+        '''
+        if vocabulary is None: vocabulary = CUIVocabulary()
+        # keep the document text if all mentions share it
+        sofa = mentions[0].sofa if len(mentions) > 0 else None
+        if any([m.sofa is not sofa for m in mentions]): sofa = None
+        begins, ends, cui_offsets, cui_ids = [], [], [0], []
+        texts, has_text = [], False
+        types, has_type = [], False
+        for m in mentions:
+            begins.append(m.begin)
+            ends.append(m.end)
+            cui_ids.extend([vocabulary.add(cui) for cui in m.CUIs])
+            cui_offsets.append(len(cui_ids))
+            texts.append(m.text)
+            if m.text != None: has_text = True
+            types.append(m.type)
+            if m.type != None: has_type = True
+        return cls(begins, ends, cui_offsets, cui_ids, vocabulary,
+            texts=texts if has_text else None, types=types if has_type else None, sofa=sofa)
+
+    def toMentions(self):
+        '''Convert back to a list of Mention objects.
+        '''
+        return [self[i] for i in range(len(self))]
+
+    def CUIs(self, i):
+        '''Return the list of CUI strings for mention i.
+        '''
+        ids = self.cui_ids[self.cui_offsets[i]:self.cui_offsets[i+1]]
+        return [self.vocabulary[ID] for ID in ids.tolist()]
+
+    def __getitem__(self, i):
+        m = Mention(CUIs=self.CUIs(i), bounds=(int(self.begins[i]), int(self.ends[i])), sofa=self.sofa)
+        if self.texts != None: m.text = self.texts[i]
+        if self.types != None: m.type = self.types[i]
+        return m
+
+    def surface(self, i):
+        '''Return the text of mention i in the original document (None if
+        the table has no document text).
+        '''
+        if self.sofa is None: return None
+        return self.sofa.slice(int(self.begins[i]), int(self.ends[i]))
+
+    def __len__(self):
+        return len(self.begins)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    @property
+    def nbytes(self):
+        '''Total size of the backing arrays, in bytes.
+        '''
+        return self.begins.nbytes + self.ends.nbytes + self.cui_offsets.nbytes + self.cui_ids.nbytes
+
+    def filterSpan(self, begin, end, contained=False):
+        '''Return the MentionTable of mentions overlapping the [begin, end)
+        span (or, if contained is True, lying entirely within it).
+        '''
+        if contained: mask = (self.begins >= begin) & (self.ends <= end)
+        else: mask = (self.begins < end) & (self.ends > begin)
+        return self.take(np.nonzero(mask)[0])
+
+    def filterCUI(self, CUIs):
+        '''Return the MentionTable of mentions tagged with any of the input
+        CUIs (a single CUI string or a list of them).
+        '''
+        if isinstance(CUIs, str): CUIs = [CUIs]
+        query_ids = [self.vocabulary.get(cui) for cui in CUIs]
+        query_ids = np.array([ID for ID in query_ids if ID != None], dtype=np.int32)
+        # map each matching CUI entry back to the mention that owns it
+        owners = np.repeat(np.arange(len(self)), np.diff(self.cui_offsets))
+        matches = owners[np.isin(self.cui_ids, query_ids)]
+        return self.take(np.unique(matches))
+
+    def take(self, indices):
+        '''Return the MentionTable of the mentions at the input indices.
+        '''
+        indices = np.asarray(indices, dtype=np.int64)
+        counts = np.diff(self.cui_offsets)[indices]
+        cui_offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+        np.cumsum(counts, out=cui_offsets[1:])
+        # gather each selected mention's CUI slice in one step
+        positions = np.arange(cui_offsets[-1], dtype=np.int64) \
+            - np.repeat(cui_offsets[:-1], counts) \
+            + np.repeat(self.cui_offsets[indices], counts)
+        texts, types = None, None
+        if self.texts != None: texts = [self.texts[i] for i in indices.tolist()]
+        if self.types != None: types = [self.types[i] for i in indices.tolist()]
+        return MentionTable(self.begins[indices], self.ends[indices], cui_offsets,
+            self.cui_ids[positions], self.vocabulary, texts=texts, types=types, sofa=self.sofa)
@@ -0,0 +1,183 @@
+'''
+Reading cTAKES output from compressed files and tar/zip archives.
+
+Compressed files (gzip, bzip2 or xz) are recognized by their leading
+magic bytes and decompressed as a stream, so every ctakes.format reader
+accepts e.g. note.xmi.gz directly.  Archive members are named by joining
+the archive path and the member name with MEMBER_SEPARATOR, e.g.
+
+    /data/notes.tar.gz::batch1/note.xmi
+
+and can be passed to the readers like any other path.  Opening a single
+member of a tar archive scans the archive up to it, so to process a
+whole archive use iterMembers (or corpus.processCorpus, which does),
+which reads all members in one pass in archive order.
+'''
+
+import io
+import os
+import bz2
+import gzip
+import lzma
+import tarfile
+import zipfile
+
+MEMBER_SEPARATOR = '::'
+
+ARCHIVE_EXTENSIONS = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz', '.zip')
+COMPRESSION_EXTENSIONS = ('.gz', '.bz2', '.xz')
+
+# magic bytes -> function wrapping a binary stream to decompress it
+_decompressors = [
+    (b'\x1f\x8b', lambda stream: gzip.GzipFile(fileobj=stream, mode='rb')),
+    (b'BZh', lambda stream: bz2.BZ2File(stream, mode='rb')),
+    (b'\xfd7zXZ\x00', lambda stream: lzma.LZMAFile(stream, mode='rb')),
+]
+_magic_length = max([len(magic) for (magic, _) in _decompressors])
+# compression extension -> function wrapping a binary stream to compress into it
+_compressors = {
+    '.gz': lambda stream: gzip.GzipFile(fileobj=stream, mode='wb'),
+    '.bz2': lambda stream: bz2.BZ2File(stream, mode='wb'),
+    '.xz': lambda stream: lzma.LZMAFile(stream, mode='wb'),
+}
+
+def isArchive(path):
+    '''Return True if path names a tar or zip archive (by extension).
+    '''
+    return path.lower().endswith(ARCHIVE_EXTENSIONS)
+
+def splitMember(path):
+    '''Split an archive member path into (archive path, member name);
+    other paths give (path, None).
+    '''
+    if MEMBER_SEPARATOR in path:
+        (archive_path, member) = path.split(MEMBER_SEPARATOR, 1)
+        return (archive_path, member)
+    return (path, None)
+
+def memberPath(archive_path, member):
+    '''Return the path naming member of the archive at archive_path.
+    '''
+    return '%s%s%s' % (archive_path, MEMBER_SEPARATOR, member)
+
+def baseName(path):
+    '''Return the file name that path holds a document under, without any
+    archive path or compression extension (for guessing its format).
+    '''
+    (archive_path, member) = splitMember(path)
+    name = os.path.basename(member if member != None else archive_path)
+    (root, ext) = os.path.splitext(name)
+    if ext.lower() in COMPRESSION_EXTENSIONS: name = root
+    return name
+
+def decompress(stream):
+    '''Wrap a seekable binary stream to decompress it, if it starts with
+    the magic bytes of a supported compression format; closing the
+    wrapper closes stream.
+    '''
+    magic = stream.read(_magic_length)
+    stream.seek(0)
+    for (prefix, decompressor) in _decompressors:
+        if magic.startswith(prefix):
+            # (the decompressor leaves stream open when it is closed)
+            return _OwningStream(decompressor(stream), stream)
+    return stream
+
+def compress(stream, path):
+    '''Wrap a writable binary stream of the file at path to compress it,
+    if path has a compression extension (closing the wrapper does not
+    close stream).
+    '''
+    ext = os.path.splitext(path)[1].lower()
+    if ext in _compressors:
+        return _compressors[ext](stream)
+    return stream
+
+def openRaw(path):
+    '''Open a file or archive member for binary reading, without
+    decompressing it.
+    '''
+    (archive_path, member) = splitMember(path)
+    if member is None:
+        return open(path, 'rb')
+    if archive_path.lower().endswith('.zip'):
+        container = zipfile.ZipFile(archive_path, 'r')
+        stream = io.BytesIO(container.read(member))
+    else:
+        container = tarfile.open(archive_path, 'r:*')
+        stream = container.extractfile(member)
+        if stream is None:
+            container.close()
+            raise IOError('%s is not a regular file in %s' % (member, archive_path))
+    return _OwningStream(stream, container)
+
+def getSize(path):
+    '''Return the size in bytes of a file or archive member (as read,
+    before any decompression by the format readers).
+    '''
+    (archive_path, member) = splitMember(path)
+    if member is None:
+        return os.path.getsize(path)
+    if archive_path.lower().endswith('.zip'):
+        with zipfile.ZipFile(archive_path, 'r') as container:
+            return container.getinfo(member).file_size
+    with tarfile.open(archive_path, 'r:*') as container:
+        return container.getmember(member).size
+
+def iterMembers(archive_path, extensions=None):
+    '''Yield (member path, member bytes) for every regular file in the
+    archive whose base name (see baseName) has one of the given extensions
+    (default: all), in a single pass in archive order.
+
+    Only one member is held in memory at a time.
+    '''
+    if archive_path.lower().endswith('.zip'):
+        with zipfile.ZipFile(archive_path, 'r') as container:
+            for info in container.infolist():
+                if not info.is_dir() and _matches(info.filename, extensions):
+                    yield (memberPath(archive_path, info.filename), container.read(info))
+    else:
+        # stream mode reads the (possibly compressed) archive sequentially
+        with tarfile.open(archive_path, 'r|*') as container:
+            for info in container:
+                if info.isfile() and _matches(info.name, extensions):
+                    yield (memberPath(archive_path, info.name), container.extractfile(info).read())
+
+def _matches(name, extensions):
+    if extensions is None: return True
+    return os.path.splitext(baseName(name))[1].lower() in extensions
+
+class _OwningStream(io.RawIOBase):
+    '''A readable stream that also closes the object it was opened from
+    (an archive, for an archive member; the raw file, for a decompressed
+    stream) when closed.
+    '''
+    def __init__(self, stream, container):
+        self.stream = stream
+        self.container = container
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return self.stream.seekable()
+
+    def read(self, size=-1):
+        return self.stream.read(size)
+
+    def readinto(self, buffer):
+        data = self.stream.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self.stream.seek(offset, whence)
+
+    def tell(self):
+        return self.stream.tell()
+
+    def close(self):
+        if not self.closed:
+            self.stream.close()
+            self.container.close()
+        super().close()
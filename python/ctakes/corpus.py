@@ -0,0 +1,460 @@
+'''
+Methods for processing whole corpora of cTAKES output files.
+
+Files are parsed in a pool of worker processes, and results are streamed
+back in the same (deterministic) order as the input files.  Errors are
+isolated per file, so one malformed document does not stop the run.
+Compressed files and tar/zip archives are read directly (see
+ctakes.archives).
+
+Usage:
+    fpaths = listFiles(['/path/to/xmi/dir'])
+    with open('out.jsonl', 'w') as outf:
+        writeJSONL(processCorpus(fpaths, num_workers=8), outf)
+
+To keep an output up to date as files are added, changed and removed,
+reprocessing only those (see ctakes.manifest):
+    updateOutput(listFiles(['/path/to/xmi/dir']), 'out.jsonl', num_workers=8)
+'''
+
+import os
+import sys
+import time
+import json
+import pickle
+import functools
+import threading
+import traceback
+import multiprocessing
+from . import files
+from . import archives
+from . import prefetch
+from .manifest import Manifest
+from .format import XMI, CAS
+from .format import stats as parse_stats
+from .annotations import Mention, Sentence
+
+FORMATS = {
+    'XMI': XMI,
+    'CAS': CAS,
+}
+_format_extensions = {
+    '.xmi': 'XMI',
+    '.xml': 'CAS',
+}
+
+def listFiles(paths, extensions=None, compressed=True):
+    '''Return the sorted list of cTAKES output files under the input paths.
+
+    Each path may be a file (always included) or a directory, which is
+    walked recursively for files with one of the given extensions
+    (default: any extension with a known format).  If compressed is True,
+    the walk also takes compressed files (e.g. note.xmi.gz) and tar/zip
+    archives, which are listed whole (processCorpus expands them into
+    their members).
+    '''
+    if extensions is None: extensions = set(_format_extensions.keys())
+    fpaths = []
+    for path in paths:
+        if os.path.isdir(path):
+            for (dirpath, _, fnames) in os.walk(path):
+                for fname in fnames:
+                    if compressed:
+                        matches = archives.isArchive(fname) \
+                            or os.path.splitext(archives.baseName(fname))[1].lower() in extensions
+                    else:
+                        matches = os.path.splitext(fname)[1].lower() in extensions
+                    if matches:
+                        fpaths.append(os.path.join(dirpath, fname))
+        else:
+            fpaths.append(path)
+    fpaths.sort()
+    return fpaths
+
+def readFileList(list_fpath):
+    '''Read a list of file paths (one per line) from a file.
+    '''
+    with open(list_fpath, 'r') as hook:
+        return [line.strip() for line in hook if len(line.strip()) > 0]
+
+def gatherFiles(paths, list_fpath=None, extensions=None, compressed=True):
+    '''Return the sorted, distinct list of files under the input paths
+    (as for listFiles) and, if list_fpath is given, in that file list.
+    '''
+    fpaths = listFiles(paths, extensions=extensions, compressed=compressed)
+    if list_fpath != None:
+        fpaths.extend(readFileList(list_fpath))
+    return sorted(set(fpaths))
+
+def getFormat(fpath, format=None):
+    '''Return the format module (XMI or CAS) to use for the input file,
+    either as named by format or as guessed from the file extension
+    (under any compression extension).
+    '''
+    if format is None:
+        ext = os.path.splitext(archives.baseName(fpath))[1].lower()
+        format = _format_extensions.get(ext, 'XMI')
+    return FORMATS[format]
+
+def parseFile(fpath, format=None, tokens=False, get_POS_tags=False, words_only=False, by_sentence=False,
+        overlaps='all'):
+    '''Parse a single cTAKES output file, returning a dict with its
+    DocumentID, mentions and (optionally) tokens.
+
+    Token options are as for XMI.getTokens; mentions are included in the
+    token list when tokens are requested.  Only the nodes needed for the
+    output are parsed (tokens and sentences are skipped unless requested).
+    '''
+    projection = ['document_id', 'mentions']
+    if tokens: projection += ['tokens', 'sentences'] if by_sentence else ['tokens']
+    doc = getFormat(fpath, format).Document(fpath, projection=projection)
+    # parse the whole file first, so the DocumentID comes from the same
+    # pass (rather than an early-exit read of its own)
+    mentions = doc.mentions
+    try:
+        document_id = doc.document_id
+    except KeyError:
+        document_id = None
+    parsed = {
+        'document_id': document_id,
+        'mentions': mentions,
+    }
+    if tokens:
+        parsed['tokens'] = doc.tokens(mentions=mentions, get_POS_tags=get_POS_tags,
+            words_only=words_only, by_sentence=by_sentence, overlaps=overlaps)
+    return parsed
+
+def iterCorpusSentences(fpaths, format=None, mentions=False, get_POS_tags=False, words_only=False,
+        overlaps='all'):
+    '''Yield (path, Sentence) for every sentence of every file in fpaths,
+    in order, holding only one document's parse in memory at a time.
+
+    If mentions is True, each document's mentions are included in its
+    sentence tokens; other token options are as for XMI.getTokens.
+    Tokens that fall outside of every sentence are skipped.  Archives in
+    fpaths are read member by member, as in processCorpus.
+    '''
+    for (fpath, data) in iterSources(fpaths):
+        preloaded = { fpath: data } if data != None else {}
+        with prefetch.Prefetcher(list(preloaded.keys()), window=0, preloaded=preloaded):
+            doc = getFormat(fpath, format).Document(fpath)
+            doc_mentions = doc.mentions if mentions else None
+            for sentence in doc.iterSentences(mentions=doc_mentions, get_POS_tags=get_POS_tags,
+                    words_only=words_only, overlaps=overlaps):
+                if isinstance(sentence, Sentence):
+                    yield (fpath, sentence)
+
+class FileResult:
+    '''The outcome of processing one file: either a value or an error,
+    and the ParseStats recorded while processing it (if requested).
+    '''
+    def __init__(self, path, size=0, value=None, error=None, stats=None):
+        self.path = path
+        self.size = size
+        self.value = value
+        self.error = error
+        self.stats = stats
+
+def processCorpus(fpaths, process=parseFile, num_workers=None, chunk_size=16, progress=None, stats=None,
+        read_ahead=0, read_ahead_bytes=prefetch.DEFAULT_MAX_BYTES, io_threads=4, reader=None):
+    '''Apply process to every file in fpaths, yielding FileResult objects
+    in input order.
+
+    Parameters:
+        fpaths           :: list of file paths to process
+        process          :: (picklable) function taking a file path
+        num_workers      :: number of worker processes (default: CPU count);
+                            1 processes files serially in this process
+        chunk_size       :: number of files submitted to a worker at a time
+        progress         :: (optional) Progress object to update per file
+        stats            :: (optional) ParseStats to aggregate the parsing stats
+                            of every file into (see ctakes.format.stats)
+        read_ahead       :: number of files each worker reads ahead of the one
+                            it is parsing, in background threads (0: none);
+                            see ctakes.prefetch
+        read_ahead_bytes :: limit on the bytes each worker buffers ahead
+        io_threads       :: number of reading threads per worker
+        reader           :: (optional, picklable) function reading a file path
+                            to bytes, used for every parser read (e.g., to
+                            simulate a slow filesystem)
+
+    Any tar/zip archive in fpaths is expanded into its members with known
+    format extensions (read in one pass, in archive order; see
+    ctakes.archives), which are processed and yielded in its place, with
+    paths of the form {archive}::{member}.
+
+    With read-ahead or archives, files are sent to workers (and so results
+    come back) chunk_size at a time, and a worker only reads ahead within
+    its chunk.
+    '''
+    worker = functools.partial(_processSafely, process, collect_stats=(stats != None))
+    has_archives = any([archives.isArchive(fpath) for fpath in fpaths])
+    chunked = (read_ahead > 0 or reader != None or has_archives)
+    throttle = None
+    if chunked:
+        worker = functools.partial(_processChunk, worker, read_ahead=read_ahead,
+            read_ahead_bytes=read_ahead_bytes, io_threads=io_threads, reader=reader)
+        work, pool_chunk_size = _chunks(iterSources(fpaths), chunk_size), 1
+        if num_workers != 1:
+            # the pool consumes its input eagerly; bound the archive members
+            # held in memory waiting for a worker
+            throttle = _Throttle(4 * (num_workers or multiprocessing.cpu_count()))
+            work = throttle.wrap(work)
+    else:
+        work, pool_chunk_size = fpaths, chunk_size
+    if num_workers == 1:
+        results = map(worker, work)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(processes=num_workers)
+        results = pool.imap(worker, work, chunksize=pool_chunk_size)
+
+    try:
+        for chunk_results in results:
+            if throttle != None: throttle.release()
+            for result in (chunk_results if chunked else [chunk_results]):
+                if progress != None: progress.update(result)
+                if stats != None and result.stats != None: stats.merge(result.stats)
+                yield result
+    finally:
+        if pool != None:
+            if throttle != None: throttle.stop()
+            pool.terminate()
+            pool.join()
+        if progress != None: progress.finish()
+
+def iterSources(fpaths, extensions=None):
+    '''Yield (path, data) for every file in fpaths, where data is None for
+    files to be read from disk.  Archives in fpaths are replaced by their
+    members with one of the given extensions (default: any known format),
+    in archive order, with data holding each member's bytes.
+    '''
+    if extensions is None: extensions = set(_format_extensions.keys())
+    for fpath in fpaths:
+        if archives.isArchive(fpath):
+            for (member_path, data) in archives.iterMembers(fpath, extensions=extensions):
+                yield (member_path, data)
+        else:
+            yield (fpath, None)
+
+def _processSafely(process, fpath, collect_stats=False, size=None):
+    # record stats per file, so they can be sent back from worker processes
+    file_stats = parse_stats.ParseStats() if collect_stats else None
+    if collect_stats: previous_stats = parse_stats.setStats(file_stats)
+    try:
+        if size is None:
+            size = 0
+            size = archives.getSize(fpath)
+        return FileResult(fpath, size=size, value=process(fpath), stats=file_stats)
+    except Exception:
+        return FileResult(fpath, size=size, error=traceback.format_exc(), stats=file_stats)
+    finally:
+        if collect_stats: parse_stats.setStats(previous_stats)
+
+def _processChunk(worker, sources, read_ahead=0, read_ahead_bytes=prefetch.DEFAULT_MAX_BYTES,
+        io_threads=4, reader=None):
+    '''Process a chunk of (path, data) sources, serving the data from
+    memory and reading any other files ahead (if requested).
+    '''
+    preloaded = { fpath: data for (fpath, data) in sources if data != None }
+    if read_ahead > 0 or reader != None:
+        fpaths = [fpath for (fpath, _) in sources]
+    else:
+        fpaths = list(preloaded.keys())
+    with prefetch.Prefetcher(fpaths, window=read_ahead, max_bytes=read_ahead_bytes,
+            num_threads=io_threads, reader=reader if reader != None else prefetch.readFile,
+            preloaded=preloaded):
+        return [
+            worker(fpath, size=(len(data) if data != None else None))
+                for (fpath, data) in sources
+        ]
+
+class _Throttle:
+    '''Limits how many items of an iterable can be taken before being
+    released (or the throttle stopped).
+    '''
+    def __init__(self, limit):
+        self._semaphore = threading.BoundedSemaphore(limit)
+        self._stopped = False
+
+    def wrap(self, iterable):
+        for item in iterable:
+            self._semaphore.acquire()
+            if self._stopped: return
+            yield item
+
+    def release(self):
+        try: self._semaphore.release()
+        except ValueError: pass
+
+    def stop(self):
+        self._stopped = True
+        self.release()
+
+def _chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk: yield chunk
+
+
+### Progress reporting ##################
+
+class Progress:
+    '''Tracks documents and bytes processed, and periodically reports
+    throughput (docs/sec, MB/sec) to a stream.
+    '''
+    def __init__(self, total=None, stream=sys.stderr, interval=5.0):
+        self.total = total
+        self.stream = stream
+        self.interval = interval
+        self.docs, self.bytes, self.errors = 0, 0, 0
+        self.start = time.time()
+        self._last_report = self.start
+
+    def update(self, result):
+        self.docs += 1
+        self.bytes += result.size
+        if result.error != None: self.errors += 1
+        now = time.time()
+        if now - self._last_report >= self.interval:
+            self.report(now)
+            self._last_report = now
+
+    def finish(self):
+        self.report(time.time())
+
+    def elapsed(self, now=None):
+        if now is None: now = time.time()
+        return max(now - self.start, 1e-9)
+
+    def report(self, now):
+        if self.stream is None: return
+        elapsed = self.elapsed(now)
+        if self.total != None: count = '%d/%d' % (self.docs, self.total)
+        else: count = '%d' % self.docs
+        self.stream.write('  >> %s docs (%.1f docs/sec, %.2f MB/sec), %d errors\n' % (
+            count,
+            self.docs / elapsed,
+            self.bytes / elapsed / (1024 * 1024),
+            self.errors
+        ))
+        self.stream.flush()
+
+
+### Output ##############################
+
+def writeJSONL(results, outf):
+    '''Write FileResults to an open text stream, one JSON object per line.
+    '''
+    for result in results:
+        outf.write(_jsonLine(result))
+
+def _jsonLine(result):
+    record = { 'path': result.path }
+    if result.error != None:
+        record['error'] = result.error
+    else:
+        record.update(toJSON(result.value))
+    return json.dumps(record) + '\n'
+
+def writePickle(results, outf):
+    '''Write FileResults to an open binary stream, as a sequence of
+    pickled (path, value, error) tuples.
+    '''
+    for result in results:
+        pickle.dump((result.path, result.value, result.error), outf, protocol=pickle.HIGHEST_PROTOCOL)
+
+def _writePickleBinary(result, outf):
+    pickle.dump((result.path, result.value, result.error), outf, protocol=pickle.HIGHEST_PROTOCOL)
+
+def _writeJSONLBinary(result, outf):
+    outf.write(_jsonLine(result).encode('utf-8'))
+
+_binary_writers = {
+    'jsonl': _writeJSONLBinary,
+    'pickle': _writePickleBinary,
+}
+
+def updateOutput(fpaths, outfile, output_format='jsonl', manifest_path=None, settings=None,
+        process=parseFile, **kwargs):
+    '''Bring outfile (as written by writeJSONL or writePickle, for
+    output_format 'jsonl' or 'pickle') up to date with the files in
+    fpaths, reprocessing only the files that were added or changed since
+    the last update, and dropping the results of removed files.
+
+    A Manifest (see ctakes.manifest) of the files and the byte range of
+    their results in outfile is kept at manifest_path (default:
+    outfile + '.manifest.json'); settings describes the processing options,
+    and if they change (or the output no longer matches the manifest),
+    every file is reprocessed.  Results of unchanged files are copied
+    from the previous output as bytes, and results are written in input
+    order.  Files that failed to parse are not recorded in the manifest,
+    so they are retried on the next update.
+
+    Other keyword arguments are passed to processCorpus.  Returns the
+    Changes (see Manifest.diff) that were applied.
+    '''
+    if manifest_path is None: manifest_path = outfile + '.manifest.json'
+    write = _binary_writers[output_format]
+    manifest = Manifest(manifest_path, settings={ 'output_format': output_format, 'settings': settings })
+    manifest.checkOutput(outfile)
+    changes = manifest.diff(fpaths)
+
+    results = iter(processCorpus(changes.process, process=process, **kwargs))
+    next_result = next(results, None)
+    unchanged = set(changes.unchanged)
+    previous = open(outfile, 'rb') if len(unchanged) > 0 else None
+    try:
+        with files.atomicWrite(outfile) as outf:
+            for fpath in changes.states:
+                (offset, failed) = (outf.tell(), False)
+                if fpath in unchanged:
+                    (previous_offset, length) = manifest.get(fpath)['output']
+                    previous.seek(previous_offset)
+                    outf.write(previous.read(length))
+                else:
+                    # results of fpath (one per member, for an archive)
+                    while next_result != None and _sourcePath(next_result.path, fpath):
+                        write(next_result, outf)
+                        failed = failed or (next_result.error != None)
+                        next_result = next(results, None)
+                if failed: manifest.remove(fpath)
+                else: manifest.record(fpath, changes.states[fpath], output=(offset, outf.tell() - offset))
+    finally:
+        if previous != None: previous.close()
+    for fpath in changes.removed:
+        manifest.remove(fpath)
+    manifest.save(output_path=outfile)
+    return changes
+
+def _sourcePath(path, fpath):
+    # True if a result for path came from processing fpath
+    return path == fpath or (archives.isArchive(fpath) and archives.splitMember(path)[0] == fpath)
+
+def readPickle(inf):
+    '''Iterate over the (path, value, error) tuples written by writePickle.
+    '''
+    while True:
+        try:
+            yield pickle.load(inf)
+        except EOFError:
+            return
+
+def toJSON(obj):
+    '''Convert parsed output (Mentions, Sentences, and nested lists and
+    dicts of them) to JSON-serializable objects.
+    '''
+    if isinstance(obj, Mention):
+        return { 'CUIs': obj.CUIs, 'begin': obj.begin, 'end': obj.end, 'text': obj.text }
+    elif isinstance(obj, Sentence):
+        return { 'begin': obj.begin, 'end': obj.end, 'tokens': toJSON(obj.tokens) }
+    elif isinstance(obj, dict):
+        return { key: toJSON(value) for (key, value) in obj.items() }
+    elif isinstance(obj, (list, tuple)):
+        return [toJSON(item) for item in obj]
+    else:
+        return obj
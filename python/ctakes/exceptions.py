@@ -3,7 +3,7 @@ Custom exceptions for cTAKES processing components
 '''
 
 class AttributeNotFoundException(KeyError):
-    def __init_(self, attr_name):
+    def __init__(self, attr_name):
         message = "No attribute named '%s' found in element." % attr_name
         super(AttributeNotFoundException, self).__init__(message)
 
@@ -0,0 +1,79 @@
+'''
+Shared helpers for the files that ctakes writes and reads back: atomic
+output (written to a temporary file or directory alongside, and renamed
+into place only once complete, so readers and interrupted runs never see
+a partial result), and memory-mapped arrays.
+
+Usage:
+    with atomicWrite('/data/out.jsonl') as outf:
+        outf.write(...)
+    writeJSON('/data/meta.json', { ... })
+    with atomicDirectory('/data/index/segment-000001') as tmp_dir:
+        np.save(os.path.join(tmp_dir, 'docs.npy'), docs)
+
+@depends NumPy
+'''
+
+import os
+import json
+import shutil
+import tempfile
+import contextlib
+import numpy as np
+
+@contextlib.contextmanager
+def atomicWrite(fpath, mode='wb', copy_mode_from=None):
+    '''Open a temporary file alongside fpath for writing (in mode), and
+    move it into place as fpath once the with block completes; if the
+    block raises, the temporary file is removed and fpath is untouched.
+
+    The temporary file is created readable by its owner only; to give
+    fpath the permissions of another file (e.g. the one it replaces),
+    pass that file's path as copy_mode_from.
+    '''
+    directory = os.path.dirname(os.path.abspath(fpath))
+    (fd, tmp_path) = tempfile.mkstemp(dir=directory, prefix='.%s.' % os.path.basename(fpath), suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode) as stream:
+            yield stream
+        if copy_mode_from != None: shutil.copymode(copy_mode_from, tmp_path)
+        os.replace(tmp_path, fpath)
+    except BaseException:
+        _discard(tmp_path)
+        raise
+
+@contextlib.contextmanager
+def atomicDirectory(dirpath):
+    '''Yield the path of a new temporary directory alongside dirpath,
+    which is renamed to dirpath (which must not exist) once the with block
+    completes; if the block raises, the directory is removed.
+    '''
+    parent = os.path.dirname(os.path.abspath(dirpath))
+    tmp_path = tempfile.mkdtemp(dir=parent, prefix='.%s.' % os.path.basename(dirpath))
+    try:
+        yield tmp_path
+        os.rename(tmp_path, dirpath)
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+def writeJSON(fpath, data, **kwargs):
+    '''Atomically write data as JSON to fpath; other keyword arguments are
+    passed to json.dump.
+    '''
+    with atomicWrite(fpath, 'w') as stream:
+        json.dump(data, stream, **kwargs)
+
+def mapArray(fpath):
+    '''Memory-map a .npy array (empty arrays, which cannot be mapped, are
+    loaded directly).
+    '''
+    try:
+        return np.load(fpath, mmap_mode='r')
+    except ValueError:
+        return np.load(fpath)
+
+def _discard(tmp_path):
+    # remove a temporary file without masking the error being handled
+    try: os.unlink(tmp_path)
+    except OSError: pass
@@ -1,68 +1,208 @@
 '''
 Methods for handling cTAKES CAS output.
+
+Speed: CAS files are parsed with the same streaming XML parser as XMI
+files, and per byte they parse at least as fast, but the CAS form of a
+document is ~40% larger than its XMI form (full type names, and an
+FSArray element with one child per concept for each mention).  Most of
+the time is spent in the XML parser itself, which scales with size, so
+the same document still takes ~10-25% longer to parse as CAS than as
+XMI (synthetic 100,000-token documents; see benchmarks/bench_parsing.py).
 '''
 
-import codecs
-import re
 from . import common
 from ..annotations import Mention
 from ..exceptions import *
 
-def getMentions(outputf):
-    '''Get the (ambiguous) entity mentions from the XMI file,
+### Node types #############
+
+def _ctakesType(type_name):
+    return (None, 'org.apache.ctakes.typesystem.type.%s' % type_name)
+
+_mention_prefix = 'org.apache.ctakes.typesystem.type.textsem.'
+_fsarray        = (None, 'uima.cas.FSArray')
+_concept        = _ctakesType('refsem.UmlsConcept')
+_document_id    = _ctakesType('structured.DocumentID')
+_text           = (None, 'uima.cas.Sofa')
+
+_text_token_types = [
+    _ctakesType('syntax.WordToken'),
+    _ctakesType('syntax.NumToken'),
+    _ctakesType('syntax.ContractionToken'),
+]
+_token_types = [
+    _ctakesType('syntax.SymbolToken'),
+    _ctakesType('syntax.PunctuationToken'),
+] + _text_token_types
+_sentence_type = _ctakesType('textspan.Sentence')
+_mention_types = [
+    'SignSymptomMention',
+    'DiseaseDisorderMention',
+    'MedicationMention',
+    'ProcedureMention',
+    'AnatomicalSiteMention',
+]
+
+### Type registry ##########
+
+def _textsemMention(node_type):
+    # any other textsem mention type (e.g. LabMention) is also a mention
+    (ns, node_name) = node_type
+    if ns is None and node_name.startswith(_mention_prefix) and node_name.endswith('Mention'):
+        return common.AnnotationType(node_type, node_name[len(_mention_prefix):], common.MENTION)
+    return None
+
+registry = common.TypeRegistry(fallback=_textsemMention, fallback_names=lambda name: name.endswith('Mention'))
+for node_type in _token_types:
+    registry.register(node_type, node_type[1].split('.')[-1], common.TOKEN)
+registry.register(_sentence_type, 'Sentence', common.SENTENCE)
+registry.register(_document_id, 'DocumentID', common.DOCUMENT_ID)
+registry.register(_text, 'Sofa', common.TEXT)
+registry.register(_concept, 'UmlsConcept', common.CONCEPT)
+registry.register(_fsarray, 'FSArray', common.CONCEPT)
+
+def registerMentionType(name, package='org.apache.ctakes.typesystem.type.textsem'):
+    '''Parse nodes of an additional mention type (by default, any textsem
+    type named *Mention is parsed) as Mentions; their
+    _ref_ontologyConceptArr must refer to an FSArray of UmlsConcepts.
+    '''
+    registry.register((None, '%s.%s' % (package, name)), name, common.MENTION)
+
+for name in _mention_types:
+    registerMentionType(name)
+
+def registerType(name, type_name, handler):
+    '''Parse nodes of a custom type (full type name, e.g.
+    'org.apache.ctakes.typesystem.type.textsem.DateAnnotation') by calling
+    handler(node) on each; Document.annotations(name) returns the results.
+    '''
+    registry.register((None, type_name), name, common.CUSTOM, handler=handler)
+
+class Document(common.Document):
+    '''A single cTAKES CAS output file, parsed at most once.
+
+    Files are parsed as a stream of XML nodes, so any line layout (single
+    line, or one element per line) is supported; mention -> FSArray ->
+    UmlsConcept references are resolved once the pass is complete, in
+    whatever order the nodes appear.
+
+    Usage:
+        doc = Document(fpath)
+        tokens = doc.tokens(mentions=doc.mentions, by_sentence=True)
+    '''
+
+    _registry = registry
+    _token_types = _token_types
+    _text_token_types = _text_token_types
+    _sentence_type = _sentence_type
+    _document_id_type = _document_id
+    _sofa_type = _text
+
+    def __init__(self, fpath, stats=None, projection=None):
+        super(Document, self).__init__(fpath, stats=stats, projection=projection)
+        self._fsarrays = []
+        self._concepts = {}
+        self._array_bounds = {}
+        self._array_types = {}
+        self._next_fsarray = 0      # next FSArray for _readyMentions
+
+    def _readNode(self, node_type, node):
+        if node_type == _fsarray:
+            fsarray = _FSArray(node.attrib.get('_id', None))
+            fsarray.concept_IDs = [item.text.strip() for item in node if item.text]
+            self._fsarrays.append(fsarray)
+        else:
+            self._concepts[node.attrib['_id']] = node.attrib['cui']
+
+    def _readMention(self, mention_type, node):
+        ID = node.attrib.get('_ref_ontologyConceptArr', None)
+        if ID != None:
+            self._array_bounds[ID] = (int(node.attrib['begin']), int(node.attrib['end']))
+            self._array_types[ID] = mention_type
+
+    def _buildMentions(self):
+        return _FSArraysToMentions(self._mentionFSArrays(self._fsarrays), self._concepts)
+
+    def _readyMentions(self, final=False):
+        # an FSArray is ready once its mention and all of its concepts
+        # have been read (FSArrays held for other purposes only become
+        # ready at the end of the file)
+        ready = []
+        while self._next_fsarray < len(self._fsarrays):
+            fsarray = self._fsarrays[self._next_fsarray]
+            if not final:
+                if not fsarray.ID in self._array_bounds: break
+                if not all([concept_ID in self._concepts for concept_ID in fsarray.concept_IDs]): break
+            ready.extend(_FSArraysToMentions(self._mentionFSArrays([fsarray]), self._concepts))
+            self._next_fsarray += 1
+        return ready
+
+    def _mentionFSArrays(self, fsarrays):
+        # keep only the FSArrays that hold mention concepts
+        # (there are _FSArrays for other purposes than just CUI storage)
+        mention_fsarrays = []
+        for fsarray in fsarrays:
+            bounds = self._array_bounds.get(fsarray.ID, None)
+            if bounds != None and len(fsarray.concept_IDs) > 0:
+                (fsarray.start, fsarray.stop) = bounds
+                fsarray.mention_type = self._array_types[fsarray.ID]
+                mention_fsarrays.append(fsarray)
+        return mention_fsarrays
+
+def getMentions(outputf, types=None):
+    '''Get the (ambiguous) entity mentions from the CAS file,
     as a list of Mention objects.
+
+    If types (a list of mention type names, e.g. ['DiseaseDisorderMention'])
+    is given, only mentions of those types are parsed.
     '''
-    fsarrays, cur_fsarray, in_fsarray = [], None, False
-    pln, tag_tokens = None, 0
-    concepts, array_bounds = {}, {}
+    return Document(outputf, projection=common.mentionProjection(types)).mentions
 
-    hook = codecs.open(outputf, 'r')
-    for line in hook:
-        line = line.strip()
+def iterMentions(outputf, types=None):
+    '''Generator version of getMentions, yielding each Mention as soon as
+    it has been read from the CAS file.
+    '''
+    return Document(outputf, projection=common.mentionProjection(types)).iterMentions()
 
-        if common.matchesRegex(_fsarray_start, line):
-            # grab its bounds from the array_bounds map (should be stored already)
-            try:
-                ID = getAttributeValue(line, '_id')
-                (start, stop) = array_bounds[ID]
-                cur_fsarray = _FSArray(ID, start, stop)
-                cur_fsarray.start, cur_fsarray.stop = start, stop
-                in_fsarray = True
-            except KeyError as e:
-                pass    # there are _FSArrays for other purposes than just CUI storage
-        elif common.matchesRegex(_fsarray_end, line) and in_fsarray:
-            if len(cur_fsarray.concept_IDs) > 0: fsarrays.append(cur_fsarray)
-            in_fsarray = False
-        elif common.matchesRegex(_concept, line):
-            _addConcept(line, concepts)
-
-        elif in_fsarray and common.matchesRegex(_fsarray_item, line):
-            mtch = re.findall(r'[0-9]+', line)
-            assert len(mtch) == 1
-            cur_fsarray.concept_IDs.append(mtch[0])
-
-        elif common.matchesRegex(_entity_mention, line):
-            _addMentionBounds(line, array_bounds)
-
-    hook.close()
-    return _FSArraysToMentions(fsarrays, concepts)
-
-def getTokens(outputf, mentions=None):
-    return common.getTokens(outputf, mentions=mentions, _token_regexes=_token_regexes)
-common.inheritDocstring(getTokens, common.getTokens)
+def getDocumentID(outputf):
+    '''Returns the name of the original file cTAKES parsed
+    to generate this output.
+    '''
+    return Document(outputf).document_id
+
+def getTokens(outputf, mentions=None, get_POS_tags=False, words_only=False, by_sentence=False, surface=False,
+        overlaps='all'):
+    return Document(outputf, projection=common.tokenProjection(by_sentence)).tokens(mentions=mentions, get_POS_tags=get_POS_tags,
+        words_only=words_only, by_sentence=by_sentence, surface=surface, overlaps=overlaps)
+common.inheritDocstring(getTokens, common.Document.tokens)
+
+def iterTokens(outputf, mentions=None, get_POS_tags=False, words_only=False, surface=False, overlaps='all'):
+    return Document(outputf, projection=common.tokenProjection()).iterTokens(mentions=mentions, get_POS_tags=get_POS_tags,
+        words_only=words_only, surface=surface, overlaps=overlaps)
+common.inheritDocstring(iterTokens, common.Document.iterTokens)
+
+def iterSentences(outputf, mentions=None, get_POS_tags=False, words_only=False, surface=False, overlaps='all'):
+    return Document(outputf, projection=common.tokenProjection(True)).iterSentences(mentions=mentions, get_POS_tags=get_POS_tags,
+        words_only=words_only, surface=surface, overlaps=overlaps)
+common.inheritDocstring(iterSentences, common.Document.iterSentences)
 
 def getAttributeValue(line, attr_name):
     return common.getAttributeValue(line, attr_name)
 common.inheritDocstring(getAttributeValue, common.getAttributeValue)
 
+def getAttributes(line, attr_names=None):
+    return common.getAttributes(line, attr_names=attr_names)
+common.inheritDocstring(getAttributes, common.getAttributes)
+
 
 ### FSArray handling #######
 
 class _FSArray:
-    def __init__(self, ID=None, start=0, stop=0):
+    def __init__(self, ID=None, start=0, stop=0, mention_type=None):
         self.ID = ID
         self.start = start
         self.stop = stop
+        self.mention_type = mention_type
         self.concept_IDs = []
 
 def _FSArraysToMentions(fsarrays, concepts):
@@ -80,42 +220,7 @@ def _FSArraysToMentions(fsarrays, concepts):
         if len(cui_set) > 0:
             mentions.append(Mention(
                 CUIs=cui_set,
-                bounds=(fsarr.start, fsarr.stop)
+                bounds=(fsarr.start, fsarr.stop),
+                type=fsarr.mention_type
             ))
     return mentions
-
-def _addConcept(line, concepts):
-    '''Add an ID->CUI mapping from a UmlsConcept instance line
-    '''
-    ID, cui = getAttributeValue(line, '_id'), getAttributeValue(line, 'cui')
-    concepts[ID] = cui
-
-def _addMentionBounds(line, array_bounds):
-    '''Add the character bounds for a tagged entity mention
-    '''
-    ID = getAttributeValue(line, '_ref_ontologyConceptArr')
-    start = int(getAttributeValue(line, 'begin'))
-    stop = int(getAttributeValue(line, 'end'))
-    array_bounds[ID] = (start, stop)
-
-
-### Regexes ################
-
-def _compileRegex(ptrn):
-    ptrn = r'^\s*%s' % ptrn
-    return re.compile(ptrn)
-
-_fsarray_start  = _compileRegex(r'<uima.cas.FSArray')
-_fsarray_item   = _compileRegex(r'<i>')
-_fsarray_end    = _compileRegex(r'</uima.cas.FSArray>')
-_entity_mention = _compileRegex(r'<org.apache.ctakes.typesystem.type.textsem.[A-Za-z]*Mention .* _ref_ontologyConceptArr="[0-9]+"')
-_concept        = _compileRegex(r'<org.apache.ctakes.typesystem.type.refsem.UmlsConcept')
-_text           = _compileRegex(r'<uima.cas.Sofa')
-
-_token_regexes = [
-    _compileRegex(r'<org.apache.ctakes.typesystem.type.syntax.SymbolToken'),
-    _compileRegex(r'<org.apache.ctakes.typesystem.type.syntax.WordToken'),
-    _compileRegex(r'<org.apache.ctakes.typesystem.type.syntax.PunctuationToken'),
-    _compileRegex(r'<org.apache.ctakes.typesystem.type.syntax.NumToken'),
-    _compileRegex(r'<org.apache.ctakes.typesystem.type.syntax.ContractionToken'),
-]
@@ -1,116 +1,161 @@
 '''
 Methods for handling cTAKES XMI output.
-
-@depends BeautifulSoup
 '''
 
-import re
-import codecs
-from bs4 import BeautifulSoup
 from . import common
 from ..annotations import Mention
 from ..exceptions import *
 
-def getMentions(fpath):
+### Node types #############
+
+_xmi_id = '{http://www.omg.org/XMI}id'
+
+_umls_concept = ('refsem', 'UmlsConcept')
+_mention_types = [
+    ('textsem', 'SignSymptomMention'),
+    ('textsem', 'DiseaseDisorderMention'),
+    ('textsem', 'MedicationMention'),
+    ('textsem', 'ProcedureMention'),
+    ('textsem', 'AnatomicalSiteMention')
+]
+_document_id = ('structured', 'DocumentID')
+_sofa = ('cas', 'Sofa')
+_text_token_types = [
+    ('syntax', 'WordToken'),
+    ('syntax', 'NumToken'),
+    ('syntax', 'ContractionToken')
+]
+_token_types = [
+    ('syntax', 'SymbolToken'),
+    ('syntax', 'PunctuationToken'),
+] + _text_token_types
+_sentence_type = ('textspan', 'Sentence')
+
+### Type registry ##########
+
+registry = common.TypeRegistry()
+for node_type in _token_types:
+    registry.register(node_type, node_type[1], common.TOKEN)
+registry.register(_sentence_type, 'Sentence', common.SENTENCE)
+registry.register(_document_id, 'DocumentID', common.DOCUMENT_ID)
+registry.register(_sofa, 'Sofa', common.TEXT)
+registry.register(_umls_concept, 'UmlsConcept', common.CONCEPT)
+
+def registerMentionType(name, namespace='textsem'):
+    '''Parse nodes of an additional mention type (e.g. 'LabMention') as
+    Mentions; their ontologyConceptArr must refer to UmlsConcepts.
+    '''
+    registry.register((namespace, name), name, common.MENTION)
+
+def registerType(name, node_type, handler):
+    '''Parse nodes of a custom (namespace prefix, node name) type by calling
+    handler(node) on each; Document.annotations(name) returns the results.
+    '''
+    registry.register(node_type, name, common.CUSTOM, handler=handler)
+
+for (namespace, name) in _mention_types:
+    registerMentionType(name, namespace=namespace)
+
+class Document(common.Document):
+    '''A single cTAKES XMI output file, parsed at most once.
+
+    Usage:
+        doc = Document(fpath)
+        tokens = doc.tokens(mentions=doc.mentions, by_sentence=True)
+    '''
+
+    _registry = registry
+    _token_types = _token_types
+    _text_token_types = _text_token_types
+    _sentence_type = _sentence_type
+    _document_id_type = _document_id
+    _sofa_type = _sofa
+
+    def __init__(self, fpath, stats=None, projection=None):
+        super(Document, self).__init__(fpath, stats=stats, projection=projection)
+        self._concept_cui_map = {}
+        self._mention_records = []
+        self._next_mention = 0      # next mention record for _readyMentions
+
+    def _readNode(self, node_type, node):
+        self._concept_cui_map[node.attrib[_xmi_id]] = node.attrib['cui']
+
+    def _readMention(self, mention_type, node):
+        concept_ids = node.attrib.get('ontologyConceptArr', None)
+        if concept_ids != None:
+            self._mention_records.append((
+                concept_ids.split(' '),
+                (int(node.attrib['begin']), int(node.attrib['end'])),
+                mention_type
+            ))
+
+    def _buildMentions(self):
+        return [self._mentionFromRecord(record) for record in self._mention_records]
+
+    def _readyMentions(self, final=False):
+        # mentions are ready once all of their concepts have been read
+        ready = []
+        while self._next_mention < len(self._mention_records):
+            record = self._mention_records[self._next_mention]
+            if not final:
+                (concept_ids, _, _) = record
+                if not all([concept_id in self._concept_cui_map for concept_id in concept_ids]):
+                    break
+            ready.append(self._mentionFromRecord(record))
+            self._next_mention += 1
+        return ready
+
+    def _mentionFromRecord(self, record):
+        # replace concept IDs in the mention with CUIs
+        (concept_ids, bounds, mention_type) = record
+        return Mention(
+            CUIs=[self._concept_cui_map[concept_id] for concept_id in concept_ids],
+            bounds=bounds,
+            type=mention_type
+        )
+
+def getMentions(fpath, types=None):
     '''Get the (ambiguous) entity mentions from the XMI file,
     as a list of Mention objects.
+
+    If types (a list of mention type names, e.g. ['DiseaseDisorderMention'])
+    is given, only mentions of those types are parsed.
     '''
-    concept_sets, bounds = [], []
-    concept_cui_map = {}
-
-    hook = codecs.open(fpath, 'r', 'utf-8')
-    for line in hook:
-        if common.matchesRegex(_umls_concept, line):
-            concept_id = getAttributeValue(line, 'id')
-            concept_cui = getAttributeValue(line, 'cui')
-            concept_cui_map[concept_id] = concept_cui
-        else:
-            for regex in _mention_regexes:
-                if common.matchesRegex(regex, line):
-                    try:
-                        concept_ids = getAttributeValue(line, 'ontologyConceptArr').split(' ')
-                    except AttributeNotFoundException:
-                        continue
-                    concept_sets.append(concept_ids)
-                    bounds.append((
-                        int(getAttributeValue(line, 'begin')),
-                        int(getAttributeValue(line, 'end'))
-                    ))
-                    break   # only one mention type for any given line
-    hook.close()
-
-    # replace concept IDs in mentions with CUIs
-    cui_sets = []
-    for concept_set in concept_sets:
-        cui_sets.append([
-            concept_cui_map[concept_id] for concept_id in concept_set
-        ])
-
-    # build data models
-    assert len(bounds) == len(cui_sets)
-    mentions = []
-    for i in range(len(cui_sets)):
-        mentions.append(Mention(
-            CUIs=cui_sets[i],
-            bounds=bounds[i]
-        ))
-    return mentions
+    return Document(fpath, projection=common.mentionProjection(types)).mentions
+
+def iterMentions(fpath, types=None):
+    '''Generator version of getMentions, yielding each Mention as soon as
+    it has been read from the XMI file.
+    '''
+    return Document(fpath, projection=common.mentionProjection(types)).iterMentions()
 
 def getDocumentID(fpath):
     '''Returns the name of the original file cTAKES parsed
     to generate this output.
     '''
-    hook = codecs.open(fpath, 'r', 'utf-8')
-    contents = hook.read()
-    hook.close()
+    return Document(fpath).document_id
+
+def getTokens(outputf, mentions=None, get_POS_tags=False, words_only=False, by_sentence=False, surface=False,
+        overlaps='all'):
+    return Document(outputf, projection=common.tokenProjection(by_sentence)).tokens(mentions=mentions, get_POS_tags=get_POS_tags,
+        words_only=words_only, by_sentence=by_sentence, surface=surface, overlaps=overlaps)
+common.inheritDocstring(getTokens, common.Document.tokens)
 
-    soup = BeautifulSoup(contents, 'lxml-xml')
-    return soup.XMI.DocumentID['documentID']
+def iterTokens(outputf, mentions=None, get_POS_tags=False, words_only=False, surface=False, overlaps='all'):
+    return Document(outputf, projection=common.tokenProjection()).iterTokens(mentions=mentions, get_POS_tags=get_POS_tags,
+        words_only=words_only, surface=surface, overlaps=overlaps)
+common.inheritDocstring(iterTokens, common.Document.iterTokens)
 
-def getTokens(outputf, mentions=None, get_POS_tags=False, words_only=False, by_sentence=False):
-    if words_only: token_types = _text_token_types
-    else: token_types = _token_types
-    return common.getTokens(outputf, mentions=mentions, get_POS_tags=get_POS_tags,
-        by_sentence=by_sentence, _token_types=token_types, _sentence_type=_sentence_type)
-common.inheritDocstring(getTokens, common.getTokens)
+def iterSentences(outputf, mentions=None, get_POS_tags=False, words_only=False, surface=False, overlaps='all'):
+    return Document(outputf, projection=common.tokenProjection(True)).iterSentences(mentions=mentions, get_POS_tags=get_POS_tags,
+        words_only=words_only, surface=surface, overlaps=overlaps)
+common.inheritDocstring(iterSentences, common.Document.iterSentences)
 
 def getAttributeValue(line, attr_name):
     return common.getAttributeValue(line, attr_name)
 common.inheritDocstring(getAttributeValue, common.getAttributeValue)
 
+def getAttributes(line, attr_names=None):
+    return common.getAttributes(line, attr_names=attr_names)
+common.inheritDocstring(getAttributes, common.getAttributes)
 
-### Regexes ################
-
-def _compileRegex(sem_type, annot_type):
-    ptrn = r'^\s*<%s:%s' % (sem_type, annot_type)
-    return re.compile(ptrn)
-    
-def _prepareSearches(*ns_node_types):
-    prepared = []
-    for (ns, nodename) in ns_node_types:
-        prepared.append( (nodename, _compileRegex(ns, nodename)) )
-    if len(prepared) == 1: return prepared[0]
-    else: return prepared
-
-_umls_concept = _compileRegex('refsem', 'UmlsConcept')
-_mention_regexes = [
-    _compileRegex('textsem', 'SignSymptomMention'),
-    _compileRegex('textsem', 'DiseaseDisorderMention'),
-    _compileRegex('textsem', 'MedicationMention'),
-    _compileRegex('textsem', 'ProcedureMention'),
-    _compileRegex('textsem', 'AnatomicalSiteMention')
-]
-_text_token_type_set = [
-    ('syntax', 'WordToken'),
-    ('syntax', 'NumToken'),
-    ('syntax', 'ContractionToken')
-]
-_text_token_types = _prepareSearches(*_text_token_type_set)
-_token_types = _prepareSearches(
-    ('syntax', 'SymbolToken'),
-    ('syntax', 'PunctuationToken'),
-    *_text_token_type_set
-)
-_sentence_type = _prepareSearches(
-    ('textspan', 'Sentence')    
-)
@@ -4,6 +4,16 @@ Package for processing various formats of cTAKES output files.
 Formats currently supported:
     XMI
     CAS
+
+Parse results can optionally be cached on disk; see ctakes.format.cache.
+Per-stage parsing times and counters can be recorded with ctakes.format.stats.
+Compressed (gzip/bz2/xz) files and tar/zip archive members can be read
+directly; see ctakes.archives.
+
+Each format keeps a registry of the node types it parses; additional
+mention types (e.g. XMI.registerMentionType('LabMention')) and custom
+types with their own handlers can be registered, and Documents can be
+given a projection to parse only some annotations.
 '''
 
 __all__ = ['XMI', 'CAS']
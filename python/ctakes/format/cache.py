@@ -0,0 +1,199 @@
+'''
+Opt-in persistent cache of parsed cTAKES output files.
+
+When enabled, each Document stores its parse results (tokens, sentences,
+mentions, DocumentID and text) as an uncompressed .npz file of flat arrays,
+and later Documents for the same file load those arrays instead of
+re-parsing the XML.  Entries are keyed on the file's absolute path, size,
+modification time (for archive members, the archive's) and PARSER_VERSION,
+so changed files (or parser changes) miss the cache automatically; stale
+entries age out through LRU eviction once the cache exceeds its size
+limit.
+
+Each ParseCache tracks entry sizes and recency in memory, so stores stay
+cheap however many entries the cache holds.  Worker processes (e.g. of
+corpus.processCorpus) share the directory but each keep their own view of
+it, so once a process's view reaches the size limit, it re-reads the
+directory's actual contents and evicts down to LOW_WATER_MARK of the
+limit: the limit applies to the directory as a whole, give or take what
+other processes stored since they last evicted.
+
+Usage:
+    from ctakes.format import cache, XMI
+    cache.enable('/scratch/ctakes-cache', max_bytes=20 * 1024**3)
+    mentions = XMI.getMentions(fpath)   # parsed and cached on first run,
+                                        # loaded from cache afterwards
+
+@depends NumPy
+'''
+
+import os
+import zipfile
+import hashlib
+import collections
+import numpy as np
+from .. import archives
+from .. import files
+
+# bump whenever the parse output (or its cached layout) changes
+PARSER_VERSION = 3
+
+# fraction of max_bytes that eviction brings the cache down to
+LOW_WATER_MARK = 0.9
+
+_cache = None
+
+def enable(directory, max_bytes=None):
+    '''Turn on caching for all Documents, storing entries in directory,
+    which is limited to max_bytes (unlimited if None).
+    '''
+    global _cache
+    _cache = ParseCache(directory, max_bytes=max_bytes)
+    return _cache
+
+def disable():
+    '''Turn off caching.
+    '''
+    global _cache
+    _cache = None
+
+def getCache():
+    '''Return the active ParseCache, or None if caching is disabled.
+    '''
+    return _cache
+
+class ParseCache:
+    '''A directory of cached parse results with a size limit and
+    least-recently-used eviction (entry mtimes record last use, across
+    runs).
+    '''
+    def __init__(self, directory, max_bytes=None, low_water=LOW_WATER_MARK):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.low_water = low_water
+        self.hits, self.misses = 0, 0
+        if not os.path.isdir(directory): os.makedirs(directory)
+        # entry path -> size, least recently used first
+        self._index = collections.OrderedDict()
+        self._size = 0
+        self._scan()
+
+    def key(self, fpath, kind):
+        '''Return the cache key for the current version of fpath, as parsed
+        by parser kind (e.g. the Document class name).
+        '''
+        # archive members are versioned by their archive file
+        stat = os.stat(archives.splitMember(fpath)[0])
+        ident = '%s\0%s\0%d\0%d\0%d' % (
+            kind, os.path.abspath(fpath), stat.st_size, stat.st_mtime_ns, PARSER_VERSION
+        )
+        return hashlib.sha1(ident.encode('utf-8')).hexdigest()
+
+    def load(self, fpath, kind):
+        '''Return the dict of cached arrays for fpath, or None on a miss.
+        '''
+        entry = self._entryPath(self.key(fpath, kind))
+        try:
+            with np.load(entry, allow_pickle=False) as arrays:
+                state = { name: arrays[name] for name in arrays.files }
+        except (IOError, ValueError, EOFError, zipfile.BadZipFile):
+            # missing, or corrupt (e.g. truncated by a full disk)
+            self.misses += 1
+            return None
+        try: os.utime(entry)
+        except OSError: pass
+        if entry in self._index:
+            self._index.move_to_end(entry)
+        else:
+            # stored by another process
+            try: self._add(entry, os.path.getsize(entry))
+            except OSError: pass
+        self.hits += 1
+        return state
+
+    def store(self, fpath, kind, arrays):
+        '''Save a dict of arrays as the cache entry for fpath, then evict
+        old entries if the cache is over its size limit.
+        '''
+        entry = self._entryPath(self.key(fpath, kind))
+        entry_dir = os.path.dirname(entry)
+        if not os.path.isdir(entry_dir): os.makedirs(entry_dir, exist_ok=True)
+        # write atomically, so concurrent readers never see a partial entry
+        with files.atomicWrite(entry) as stream:
+            np.savez(stream, **arrays)
+        self._add(entry, os.path.getsize(entry))
+        if self.max_bytes != None and self._size > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        '''Remove least recently used entries until the cache is within
+        low_water of its size limit.  The directory is re-read first, so
+        entries stored (or evicted) by other processes are counted.
+        '''
+        if self.max_bytes is None: return
+        self._scan()
+        target = self.max_bytes * self.low_water
+        while self._size > target and len(self._index) > 0:
+            (path, size) = self._index.popitem(last=False)
+            self._size -= size
+            try: os.unlink(path)
+            except OSError: pass    # already evicted by another process
+
+    def clear(self):
+        '''Remove all entries.
+        '''
+        for (path, _, _) in self._entries():
+            try: os.unlink(path)
+            except OSError: pass
+        self._index.clear()
+        self._size = 0
+
+    def _scan(self):
+        # rebuild the index from the directory, ordered by last use
+        self._index.clear()
+        for (path, size, _) in sorted(self._entries(), key=lambda entry: entry[2]):
+            self._index[path] = size
+        self._size = sum(self._index.values())
+
+    def _add(self, entry, size):
+        # (re)index entry as most recently used, replacing any old size
+        self._size += size - self._index.pop(entry, 0)
+        self._index[entry] = size
+
+    def _entryPath(self, key):
+        return os.path.join(self.directory, key[:2], '%s.npz' % key)
+
+    def _entries(self):
+        '''Return (path, size, last use) for every entry.
+        '''
+        entries = []
+        for (dirpath, _, fnames) in os.walk(self.directory):
+            for fname in fnames:
+                if fname.endswith('.npz'):
+                    path = os.path.join(dirpath, fname)
+                    try:
+                        stat = os.stat(path)
+                        entries.append((path, stat.st_size, stat.st_mtime_ns))
+                    except OSError:
+                        pass
+        return entries
+
+
+### Array packing #######################
+
+def packStrings(strings):
+    '''Pack a list of strings (or None) into a uint8 array of UTF-8 bytes
+    and an array of offsets.
+    '''
+    encoded = [(s if s != None else '').encode('utf-8') for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(e) for e in encoded], out=offsets[1:])
+    data = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+    return data, offsets
+
+def unpackStrings(data, offsets):
+    '''Inverse of packStrings (None values come back as empty strings).
+    '''
+    raw = data.tobytes()
+    offsets = offsets.tolist()
+    return [raw[offsets[i]:offsets[i+1]].decode('utf-8') for i in range(len(offsets) - 1)]
@@ -4,228 +4,1183 @@ Shared methods for cTAKES output file format processing.
 Not included in from ctakes.format import *
 '''
 
+import io
 import re
-import codecs
+import abc
+import heapq
+import bisect
 import numpy as np
-from bs4 import BeautifulSoup
+import xml.etree.ElementTree as ET
+from . import cache
+from . import stats as _stats
+from .. import archives
+from .. import prefetch
+from ..intervals import IntervalIndex, alignSpans, mergeRanges
 from ..exceptions import *
 from ..annotations import *
 
 def getAttributeValue(line, attr_name):
     '''Return the value of the specified attribute in the input line
     '''
-    match = re.findall('%s=".+"' % attr_name, line)
-    if len(match) != 1:
-        raise AttributeNotFoundException(attr_name)
-    match = match[0]
-
-    opn = match.index('"')
-    cls = match[opn+1:].index('"')
-    return match[opn+1:opn+cls+1]
-
-def getTokens(fpath, mentions=None, get_POS_tags=False, by_sentence=False, _token_types=[], _sentence_type=None):
-    '''Get the ordered list of tokens from the document, as
-    tokenized by cTAKES.
-
-    If list of Mentions is provided, the token list will consist
-    of the following types:
-     - str : non-mention token
-     - Mention : non-overlapping entity mention
-     - list : overlapping entity mentions within the same text span;
-              each item consists of non-mention tokens and a single Mention
-              e.g. [(Mention:"weight loss"), ("weight", Mention:"loss")]
-
-    Parameters:
-        fpath        :: path to XMI file to process
-        mentions     :: (optional) list of Mention objects to include
-                        in place of the appropriate token
-        get_POS_tags :: Boolean flag to return POS tag information along
-                        with token strings
-        by_sentence  :: return lists of tokens, where each corresponds to a
-                        single sentence as partitioned by cTAKES
-    '''
-
-    # if including mentions, index them by beginning index
-    # (may be multiple beginning at same index)
-    if mentions != None:
-        indexed_mentions = {}
-        for m in mentions:
-            if indexed_mentions.get(m.begin, None) == None: indexed_mentions[m.begin] = []
-            indexed_mentions[m.begin].append(m)
-
-    # storage for instances of each token type
-    tokens = [[] for _ in _token_types]
-    # storage for starting bound of token type instances
-    starts = [[] for _ in _token_types]
-    
-    # parse the XML file
-    hook = codecs.open(fpath, 'r', 'utf-8')
-    soup = BeautifulSoup(hook.read(), 'lxml-xml')
-    hook.close()
-    
-    # iterate over the types of token nodes we're looking for
-    for (node_type, regex) in _token_types:
-        # get valid child nodes and sort by beginning index
-        validated_nodes = _get_and_validate_children(soup, node_type, regex)
-        sorted_nodes = _sort_by_position(validated_nodes, attr='begin')
-        # pull out token and beginning index, store separately
-        typed_tokens, typed_starts = [], []
-        for node in sorted_nodes:
-            token_string = node['normalizedForm']
+    return getAttributes(line, (attr_name,))[0]
+
+def getAttributes(line, attr_names=None):
+    '''Return the name="value" attributes in the input line, with XML
+    entities in values unescaped.
+
+    If attr_names is given, returns a tuple of the values of just those
+    attributes (raising AttributeNotFoundException if any is missing);
+    otherwise, returns a dict of all attributes.  If an attribute occurs
+    more than once in the line, its first value is used.
+
+    An attribute name without a namespace prefix (e.g. "id") also matches
+    a prefixed attribute of the same name (e.g. "xmi:id").
+    '''
+    if attr_names is None:
+        attrs = dict(reversed(_attribute_regex.findall(line)))
+        if '&' in line:
+            for (name, value) in attrs.items():
+                if '&' in value: attrs[name] = _unescape(value)
+        return attrs
+
+    values = []
+    for attr_name in attr_names:
+        match = _namedAttributeRegex(attr_name).search(line)
+        if match is None:
+            raise AttributeNotFoundException(attr_name)
+        value = match.group(1)
+        if '&' in value: value = _unescape(value)
+        values.append(value)
+    return tuple(values)
+
+def _namedAttributeRegex(attr_name):
+    '''Return the (cached) compiled regex matching a single attribute.
+    '''
+    regex = _named_attribute_regexes.get(attr_name, None)
+    if regex is None:
+        regex = re.compile(r'[\s:]%s="([^"]*)"' % re.escape(attr_name))
+        _named_attribute_regexes[attr_name] = regex
+    return regex
+
+def _unescape(value):
+    '''Replace XML entity and character references in an attribute value.
+    '''
+    return _entity_regex.sub(_replaceEntity, value)
+
+def _replaceEntity(match):
+    entity = match.group(1)
+    if entity[0] == '#':
+        if entity[1] in 'xX': return chr(int(entity[2:], 16))
+        else: return chr(int(entity[1:]))
+    return _named_entities.get(entity, match.group(0))
+
+_attribute_regex = re.compile(r'\s([^\s=]+)="([^"]*)"')
+_named_attribute_regexes = {}
+_entity_regex = re.compile(r'&(#[0-9]+|#[xX][0-9A-Fa-f]+|[A-Za-z]+);')
+_named_entities = {
+    'lt': '<',
+    'gt': '>',
+    'amp': '&',
+    'quot': '"',
+    'apos': "'",
+}
+
+
+### Annotation type registry ###########
+
+# kinds of registered node types
+TOKEN = 'token'
+SENTENCE = 'sentence'
+DOCUMENT_ID = 'document_id'
+TEXT = 'text'
+MENTION = 'mention'
+CONCEPT = 'concept'     # nodes mentions refer to (e.g. UmlsConcept)
+CUSTOM = 'custom'
+
+# projection names selecting the core (non-mention, non-custom) kinds
+_kind_projection_names = {
+    TOKEN: 'tokens',
+    SENTENCE: 'sentences',
+    DOCUMENT_ID: 'document_id',
+    TEXT: 'text',
+}
+_core_projection_names = set(_kind_projection_names.values())
+
+class AnnotationType:
+    '''A registered node type: its (namespace prefix, node name) tag, the
+    name it is selected by in projections, its kind, and for CUSTOM
+    types, the handler function(node) whose return values are collected
+    by Document.annotations(name).
+    '''
+    def __init__(self, node_type, name, kind, handler=None):
+        self.node_type = node_type
+        self.name = name
+        self.kind = kind
+        self.handler = handler
+
+class TypeRegistry:
+    '''Maps node types to the AnnotationTypes they hold, so that each node
+    is dispatched during parsing with a single dict lookup.
+
+    Node types that are not registered are offered (once each) to the
+    optional fallback function(node_type), which may return an
+    AnnotationType for them; everything else is skipped.  As those types
+    are not known in advance, fallback_names is an optional function(name)
+    returning True for projection names the fallback may produce.
+    '''
+    def __init__(self, fallback=None, fallback_names=None):
+        self._types = {}
+        self._fallback = fallback
+        self._fallback_names = fallback_names
+        self._tables = {}
+        self._names = None
+
+    def register(self, node_type, name, kind, handler=None):
+        '''Register (or replace) the AnnotationType for node_type.
+        '''
+        if kind == CUSTOM and handler is None:
+            raise ValueError('Custom annotation type %s needs a handler' % name)
+        self._types[node_type] = AnnotationType(node_type, name, kind, handler=handler)
+        self._tables = {}
+        self._names = None
+
+    def unregister(self, node_type):
+        self._types.pop(node_type, None)
+        self._tables = {}
+        self._names = None
+
+    def get(self, node_type):
+        '''Return the AnnotationType for node_type, or None.
+        '''
+        annotation_type = self._types.get(node_type, None)
+        if annotation_type is None and self._fallback != None:
+            annotation_type = self._fallback(node_type)
+        return annotation_type
+
+    def types(self, kind=None):
+        '''Return the registered AnnotationTypes (of the given kind).
+        '''
+        return [t for t in self._types.values() if kind is None or t.kind == kind]
+
+    def signature(self):
+        '''Return a string identifying the registered mention and custom
+        types (which decide what a parse produces).
+        '''
+        return ','.join(sorted([
+            '%s=%s:%s' % (t.name, t.node_type, t.kind)
+                for t in self._types.values() if t.kind in (MENTION, CUSTOM)
+        ]))
+
+    def dispatchTable(self, projection=None):
+        '''Return the dict mapping node types to handler functions
+        (doc, annotation type, node) for the given projection (a frozenset
+        of names, or None for everything); node types that are not wanted
+        map to None.
+        '''
+        table = self._tables.get(projection, None)
+        if table is None:
+            table = _DispatchTable(self, projection)
+            self._tables[projection] = table
+        return table
+
+    def names(self):
+        '''Return the set of names a projection may select: the core kinds,
+        'mentions', and the registered mention and custom types.
+        '''
+        if self._names is None:
+            self._names = _core_projection_names | set(['mentions']) | set([
+                t.name for t in self._types.values() if t.kind in (MENTION, CUSTOM)
+            ])
+        return self._names
+
+    def checkProjection(self, projection):
+        '''Raise ValueError if the projection (a frozenset of names, or None
+        for everything) holds a name that selects nothing.
+        '''
+        if projection is None: return
+        unknown = [
+            name for name in projection
+                if not name in self.names()
+                    and not (self._fallback_names != None and self._fallback_names(name))
+        ]
+        if len(unknown) > 0:
+            raise ValueError('Unknown annotation type(s) %s in projection; known types are %s' % (
+                ', '.join(["'%s'" % name for name in sorted(unknown)]),
+                ', '.join(sorted(self.names()))))
+
+    def wants(self, annotation_type, projection):
+        '''Return True if the projection selects annotation_type.
+        '''
+        if projection is None: return True
+        if annotation_type.kind == MENTION:
+            return 'mentions' in projection or annotation_type.name in projection
+        elif annotation_type.kind == CONCEPT:
+            # needed by any mention type (which may only be known through
+            # the fallback, so anything not core or custom counts)
+            custom_names = set([t.name for t in self.types(CUSTOM)])
+            return any([
+                not name in _core_projection_names and not name in custom_names
+                    for name in projection
+            ])
+        elif annotation_type.kind == CUSTOM:
+            return annotation_type.name in projection
+        return _kind_projection_names[annotation_type.kind] in projection
+
+class _DispatchTable(dict):
+    '''Node type -> handler, filled in on first sight of each node type.
+    '''
+    def __init__(self, registry, projection):
+        super(_DispatchTable, self).__init__()
+        self.registry = registry
+        self.projection = projection
+
+    def __missing__(self, node_type):
+        annotation_type = self.registry.get(node_type)
+        handler = None
+        if annotation_type != None and self.registry.wants(annotation_type, self.projection):
+            handler = _kind_handlers[annotation_type.kind](annotation_type)
+        self[node_type] = handler
+        return handler
+
+# per kind, function(annotation type) -> handler(doc, node type, node)
+
+def _readToken(doc, node_type, node):
+    doc._typed_tokens[node_type].append((
+        int(node.attrib['begin']),
+        int(node.attrib['end']),
+        node.attrib['normalizedForm'],
+        node.attrib.get('partOfSpeech', None)
+    ))
+
+def _readSentence(doc, node_type, node):
+    doc._sentence_bounds.append( (int(node.attrib['begin']), int(node.attrib['end'])) )
+
+def _readDocumentID(doc, node_type, node):
+    if doc._document_id is None: doc._document_id = node.attrib['documentID']
+
+def _readText(doc, node_type, node):
+    if doc._sofa.text is None: doc._sofa.setText(node.attrib.get('sofaString', None))
+
+def _readConcept(doc, node_type, node):
+    doc._readNode(node_type, node)
+
+def _mentionReader(annotation_type):
+    name = annotation_type.name
+    def _readMention(doc, node_type, node):
+        doc._readMention(name, node)
+    return _readMention
+
+def _customReader(annotation_type):
+    (name, handler) = (annotation_type.name, annotation_type.handler)
+    def _readCustom(doc, node_type, node):
+        doc._annotations.setdefault(name, []).append(handler(node))
+    return _readCustom
+
+_kind_handlers = {
+    TOKEN: lambda annotation_type: _readToken,
+    SENTENCE: lambda annotation_type: _readSentence,
+    DOCUMENT_ID: lambda annotation_type: _readDocumentID,
+    TEXT: lambda annotation_type: _readText,
+    MENTION: _mentionReader,
+    CONCEPT: lambda annotation_type: _readConcept,
+    CUSTOM: _customReader,
+}
+
+def makeProjection(names):
+    '''Normalize a projection (an iterable of names: 'tokens', 'sentences',
+    'document_id', 'text', 'mentions', mention type names such as
+    'DiseaseDisorderMention', or custom type names) to a frozenset, or
+    None (everything) if names is None.
+    '''
+    if names is None: return None
+    if isinstance(names, str): names = [names]
+    return frozenset(names)
+
+def tokenProjection(by_sentence=False):
+    '''Return the projection needed to get tokens (and sentences), with
+    the document text for their surface strings.
+    '''
+    return ['tokens', 'sentences', 'text'] if by_sentence else ['tokens', 'text']
+
+def mentionProjection(types=None):
+    '''Return the projection needed to get mentions of the given types
+    (default: all), with the document text for their surface strings.
+    '''
+    return list(types or ['mentions']) + ['text']
+
+
+class Document(abc.ABC):
+    '''A single cTAKES output file, parsed at most once.
+
+    The file is read in a single pass the first time any of its contents
+    are requested; mentions, tokens, sentences, DocumentID and text are
+    all served from that one parse and memoized.
+
+    If a parse cache is enabled (see ctakes.format.cache), parse results
+    are loaded from and saved to it.
+
+    Per-stage timings and counters are recorded to stats (a ParseStats),
+    or if not given, to the active ParseStats if ctakes.format.stats is
+    enabled.
+
+    If a projection is given (an iterable of names: 'tokens', 'sentences',
+    'document_id', 'text', 'mentions', mention type names such as
+    'DiseaseDisorderMention', or registered custom type names), only
+    those annotations are parsed and every other node is skipped.
+
+    Format-specific subclasses define a TypeRegistry of the node types to
+    collect, and must implement the abstract methods _readMention, _readNode
+    and _buildMentions (so Document itself cannot be instantiated).
+    '''
+
+    _registry = TypeRegistry()
+    _token_types = []
+    _text_token_types = []
+    _sentence_type = None
+    _document_id_type = None
+    _sofa_type = None
+
+    def __init__(self, fpath, stats=None, projection=None):
+        self.fpath = fpath
+        self.stats = stats if stats != None else _stats.getStats()
+        self.projection = makeProjection(projection)
+        self._registry.checkProjection(self.projection)
+        self._parsed = False
+        self._mentions = None
+        self._sentences = None
+        self._document_id = None
+        self._annotations = {}
+        # the document text, shared by every annotation read from it
+        self._sofa = Sofa()
+
+    @property
+    def mentions(self):
+        '''The (ambiguous) entity mentions in the document (of the projected
+        mention types), as a list of Mention objects.
+        '''
+        if self._mentions is None:
+            self._parse()
+            # (mentions loaded from the parse cache are already built)
+            if self._mentions is None:
+                if self.stats != None: start = _stats.clock()
+                self._mentions = self._attachSofa(self._buildMentions())
+                if self.stats != None:
+                    self.stats.record('build_mentions', _stats.clock() - start, self.fpath,
+                        mentions=len(self._mentions))
+        return self._mentions
+
+    @property
+    def sentences(self):
+        '''The sentences in the document as partitioned by cTAKES, as an
+        ordered list of (token-less) Sentence objects.
+        '''
+        if self._sentences is None:
+            self._requireProjected(SENTENCE)
+            self._parse()
+            self._sentences = self._attachSofa(
+                [Sentence(bounds=bounds) for bounds in self._sortedSentenceBounds()])
+        return self._sentences
+
+    @property
+    def document_id(self):
+        '''The name of the original file cTAKES parsed to generate this output.
+
+        If the file has not been parsed yet, it is only read as far as the
+        DocumentID node.
+        '''
+        if self._document_id is None and not self._parsed: self._loadCached()
+        if self._document_id is None and not (self._parsed and self._projects(DOCUMENT_ID)):
+            node = findNode(self.fpath, self._document_id_type, stats=self.stats)
+            if node != None: self._document_id = node.attrib['documentID']
+        if self._document_id is None:
+            raise ElementNotFoundException('DocumentID')
+        return self._document_id
+
+    @property
+    def text(self):
+        '''The original document text (the Sofa string).
+        '''
+        self._requireProjected(TEXT)
+        self._parse()
+        if self._sofa.text is None:
+            raise ElementNotFoundException('Sofa')
+        return self._sofa.text
+
+    @property
+    def sofa(self):
+        '''The original document text as a Sofa, for slicing the surface
+        text of annotations by their offsets without copying it.
+        '''
+        self._requireProjected(TEXT)
+        self._parse()
+        if self._sofa.text is None:
+            raise ElementNotFoundException('Sofa')
+        return self._sofa
+
+    def tokens(self, mentions=None, get_POS_tags=False, words_only=False, by_sentence=False, surface=False,
+            overlaps='all'):
+        '''Get the ordered list of tokens from the document, as
+        tokenized by cTAKES.
+
+        If list of Mentions is provided, the token list will consist
+        of the following types:
+         - str : non-mention token
+         - Mention : non-overlapping entity mention
+         - list : overlapping entity mentions within the same text span;
+                  each item consists of non-mention tokens and a single Mention
+                  e.g. [(Mention:"weight loss"), ("weight", Mention:"loss")]
+                  (only with overlaps='all')
+
+        Parameters:
+            mentions     :: (optional) list of Mention objects to include
+                            in place of the appropriate token
+            get_POS_tags :: Boolean flag to return POS tag information along
+                            with token strings
+            words_only   :: Boolean flag to skip symbol and punctuation tokens
+            by_sentence  :: return lists of tokens, where each corresponds to a
+                            single sentence as partitioned by cTAKES
+            surface      :: Boolean flag to return each token as its exact
+                            text in the original document, instead of its
+                            normalized form
+            overlaps     :: policy for overlapping mentions (see OVERLAP_POLICIES):
+                            'all' keeps every alternative, as lists; the
+                            others resolve each overlap to non-overlapping
+                            mentions, for a flat token list
+        '''
+        self._requireProjected(TOKEN)
+        if by_sentence: self._requireProjected(SENTENCE)
+        self._parse()
+        if by_sentence: sentence_bounds = self._sortedSentenceBounds()
+        else: sentence_bounds = None
+        output_tokens = _orderTokens(self._typedTokens(get_POS_tags, words_only, surface),
+            sentence_bounds=sentence_bounds, mentions=mentions, overlaps=overlaps, stats=self.stats,
+            fpath=self.fpath)
+        if by_sentence: self._attachSofa([t for t in output_tokens if type(t) == Sentence])
+        return output_tokens
+
+    def iterMentions(self):
+        '''Generator version of mentions, yielding Mentions in the same
+        order.
+
+        If the document has not been parsed yet, mentions are streamed from
+        a pass over the file that keeps no tokens, and each is yielded as
+        soon as it (and every mention before it) can be resolved to CUIs.
+        (The document text is usually stored after the mentions, so their
+        surface text is only available once the pass is complete.)
+        '''
+        if self._parsed or self._loadCached():
+            for mention in self.mentions:
+                yield mention
+            return
+
+        # read into a separate Document, so this one's parse state is
+        # untouched, skipping everything but mentions (and text)
+        if self.projection is None: projection = ['mentions', 'text']
+        else: projection = [name for name in self.projection
+            if not name in _core_projection_names or name == _kind_projection_names[TEXT]]
+        reader = type(self)(self.fpath, stats=self.stats, projection=projection)
+        dispatch = reader._registry.dispatchTable(reader.projection)
+        for (ns, node_name, node) in iterNodes(self.fpath, stats=self.stats):
+            handler = dispatch[(ns, node_name)]
+            if handler != None:
+                handler(reader, (ns, node_name), node)
+                for mention in reader._attachSofa(reader._readyMentions()):
+                    yield mention
+        for mention in reader._attachSofa(reader._readyMentions(final=True)):
+            yield mention
+
+    def iterTokens(self, mentions=None, get_POS_tags=False, words_only=False, surface=False, overlaps='all'):
+        '''Generator version of tokens(), yielding one token (or Mention,
+        or list of overlapping mentions) at a time.
+
+        The whole file is still read before the first token is yielded
+        (cTAKES does not write tokens in text order), but only its
+        compact parse records are held; output objects are built one at a
+        time.
+        '''
+        self._requireProjected(TOKEN)
+        self._parse()
+        for token in _iterOrderedTokens(self._typedTokens(get_POS_tags, words_only, surface),
+                mentions=mentions, overlaps=overlaps, stats=self.stats, fpath=self.fpath):
+            yield token
+
+    def iterSentences(self, mentions=None, get_POS_tags=False, words_only=False, surface=False, overlaps='all'):
+        '''Generator version of tokens(by_sentence=True), yielding each
+        Sentence (with its tokens) as soon as it is complete.
+
+        As with tokens(by_sentence=True), any tokens that fall outside of
+        every sentence are yielded individually.
+        '''
+        self._requireProjected(TOKEN)
+        self._requireProjected(SENTENCE)
+        self._parse()
+        for sentence in _iterOrderedTokens(self._typedTokens(get_POS_tags, words_only, surface),
+                sentence_bounds=self._sortedSentenceBounds(), mentions=mentions,
+                overlaps=overlaps, stats=self.stats, fpath=self.fpath):
+            if type(sentence) == Sentence and self._projects(TEXT): sentence.sofa = self._sofa
+            yield sentence
+
+    def annotations(self, name):
+        '''Return the values returned by the handler of the registered
+        custom type name for each of its nodes in the document, in order.
+        '''
+        annotation_types = [t for t in self._registry.types(CUSTOM) if t.name == name]
+        if len(annotation_types) == 0:
+            raise KeyError("No custom annotation type named '%s' is registered" % name)
+        if not self._registry.wants(annotation_types[0], self.projection):
+            raise ValueError("'%s' is not in the document's projection" % name)
+        self._parse()
+        return self._annotations.get(name, [])
+
+    def tokenIndex(self, words_only=False):
+        '''Return an IntervalIndex over the document's tokens, in the order
+        returned by tokens() (without mentions).
+        '''
+        records = self._orderedTokenRecords(words_only)
+        return IntervalIndex(
+            [begin for (begin, _, _, _) in records],
+            [end for (_, end, _, _) in records]
+        )
+
+    def mentionIndex(self):
+        '''Return an IntervalIndex over the document's mentions.
+        '''
+        return IntervalIndex([m.begin for m in self.mentions], [m.end for m in self.mentions])
+
+    def tokensOverlapping(self, begin, end, words_only=False):
+        '''Return the token strings overlapping the [begin, end) span.
+        '''
+        records = self._orderedTokenRecords(words_only)
+        return [records[i][2] for i in self.tokenIndex(words_only).overlapping(begin, end).tolist()]
+
+    def mentionsOverlapping(self, begin, end):
+        '''Return the Mentions overlapping the [begin, end) span.
+        '''
+        return [self.mentions[i] for i in self.mentionIndex().overlapping(begin, end).tolist()]
+
+    def mentionTokenRanges(self, mentions=None, words_only=False):
+        '''Map each mention (default: the document's own) to the range of
+        token indices it covers, in the order returned by tokens().
+
+        Returns (first, stop, aligned) arrays, as for intervals.alignSpans.
+        '''
+        if mentions is None: mentions = self.mentions
+        records = self._orderedTokenRecords(words_only)
+        return alignSpans(
+            [begin for (begin, _, _, _) in records],
+            [m.begin for m in mentions],
+            [m.end for m in mentions]
+        )
+
+    def _typedTokens(self, get_POS_tags=False, words_only=False, surface=False):
+        '''Return a list of (begin, token) records per token type, where
+        each token is its string (or (string, POS) if get_POS_tags).
+
+        If surface, token strings are sliced from the document text
+        instead of being the normalized forms.
+        '''
+        if words_only: token_types = self._text_token_types
+        else: token_types = self._token_types
+        if surface: self._requireProjected(TEXT)
+
+        typed_tokens = []
+        for node_type in token_types:
+            records = self._typed_tokens[node_type]
+            if surface:
+                if self._sofa.text is None: raise ElementNotFoundException('Sofa')
+                records = [(begin, end, self._sofa.slice(begin, end), pos) for (begin, end, _, pos) in records]
             if get_POS_tags:
-                try: token_pos = node['partOfSpeech']
-                except KeyError: token_pos = None
-                typed_tokens.append( (token_string, token_pos) )
+                typed_tokens.append([(begin, (token_string, pos)) for (begin, _, token_string, pos) in records])
             else:
-                typed_tokens.append(token_string)
-            typed_starts.append(int(node['begin']))
-        tokens.append(typed_tokens)
-        starts.append(typed_starts)
-
-    # if getting by sentence, fetch and order all the tagged sentences
-    if by_sentence:
-        (sentence_node_type, sentence_regex) = _sentence_type
-        # get sentence nodes and sort by beginning index
-        validated_nodes = _get_and_validate_children(soup, sentence_node_type, sentence_regex)
-        sorted_sentences = _sort_by_position(validated_nodes, attr='begin')
-        # cast to Sentence objects
-        sorted_sentences = [Sentence(bounds=(int(s['begin']), int(s['end']))) for s in sorted_sentences]
-    
-    ordered_tokens = []
-
-    # starts_remaining tracks the start indices for the token types left
-    # to empty; contains pairs of token type (index) and start indices
-    starts_remaining = []
-    for i in range(len(starts)):
-        if len(starts[i]) > 0: starts_remaining.append((i,starts[i]))
-    
-    cur_mentions = []   # current list of overlapping mentions
-    overlap_sofar = []  # tokens in the current overlap preceding the next mention
-    in_mention = False  # are we currently in >0 mentions?
-
-    if by_sentence:
-        current_sentence = None
-
-    while len(starts_remaining) > 0:
-        # find the next token type from the text
-        next_starts = [start[0] for (_,start) in starts_remaining]
-        next_starts_ix = np.argmin(next_starts)
-        next_tokentype = starts_remaining[next_starts_ix][0]
-        # get the next token
-        next_token = tokens[next_tokentype].pop(0)
-        next_token_start = starts_remaining[next_starts_ix][1][0]
-
-        # if still in one or more mentions, try to resolve them
-        if in_mention:
-            # check for completed mentions and add token appropriately
-            in_mention = False
-            for (before, m, after) in cur_mentions:
-                if m.end > next_token_start:
-                    m.text.append(next_token)
-                    in_mention = True
-                else:
-                    after.append(next_token)
+                typed_tokens.append([(begin, token_string) for (begin, _, token_string, _) in records])
+        return typed_tokens
 
-                # make sure no mentions are going outside a sentence
-                if by_sentence and not current_sentence is None:
-                    assert m.end <= current_sentence.end
+    def _orderedTokenRecords(self, words_only=False):
+        self._requireProjected(TOKEN)
+        self._parse()
+        if words_only: token_types = self._text_token_types
+        else: token_types = self._token_types
+        return [record for (_, record) in _mergeByPosition([
+            [(record[0], record) for record in self._typed_tokens[node_type]]
+                for node_type in token_types
+        ])]
+
+    def _parse(self):
+        '''Read all relevant nodes from the file, if not done already.
+        '''
+        if self._parsed or self._loadCached(): return
+
+        # storage for instances of each token type, as (begin, end, token, POS) records
+        self._typed_tokens = { node_type: [] for node_type in self._token_types }
+        self._sentence_bounds = []
+        self._sorted_sentence_bounds = None
+        self._sofa.setText(None)
+
+        # collect all projected nodes in a single pass over the file,
+        # dispatching each with one lookup (unwanted nodes map to None)
+        dispatch = self._registry.dispatchTable(self.projection)
+        for (ns, node_name, node) in iterNodes(self.fpath, stats=self.stats):
+            handler = dispatch[(ns, node_name)]
+            if handler != None: handler(self, (ns, node_name), node)
+
+        # sort each token type by beginning index
+        if self.stats != None: start = _stats.clock()
+        for node_type in self._token_types:
+            self._typed_tokens[node_type] = _sort_by_position(self._typed_tokens[node_type])
+        self._parsed = True
+        if self.stats != None:
+            self.stats.record('sort', _stats.clock() - start, self.fpath, files=1,
+                tokens=sum([len(records) for records in self._typed_tokens.values()]),
+                sentences=len(self._sentence_bounds))
+
+        parse_cache = cache.getCache()
+        if parse_cache != None and self._cacheable():
+            if self.stats != None: start = _stats.clock()
+            parse_cache.store(self.fpath, self._cacheKind(), self._saveState())
+            if self.stats != None:
+                self.stats.record('cache_store', _stats.clock() - start, self.fpath)
+
+    def _cacheKind(self):
+        # what a parse produces depends on the registered types and projection
+        return '%s.%s|%s|%s' % (type(self).__module__, type(self).__name__, self._registry.signature(),
+            ','.join(sorted(self.projection)) if self.projection != None else '*')
 
-            # if all mentions completed, flush them as a block
-            if not in_mention:
-                for (before, m, after) in cur_mentions:
-                    m.text = ' '.join(m.text)
-                    after.pop(-1) # the last token is spurious
+    def _cacheable(self):
+        # values returned by custom type handlers are not cached
+        return not any([self._registry.wants(t, self.projection) for t in self._registry.types(CUSTOM)])
+
+    def _attachSofa(self, annotations):
+        # share the document text with Mentions and Sentences, if parsed
+        if self._projects(TEXT):
+            for annotation in annotations: annotation.sofa = self._sofa
+        return annotations
+
+    def _projects(self, kind):
+        return self.projection is None or _kind_projection_names[kind] in self.projection
+
+    def _requireProjected(self, kind):
+        if not self._projects(kind):
+            raise ValueError("'%s' is not in the document's projection" % _kind_projection_names[kind])
+
+    def _loadCached(self):
+        '''Restore parse results from the parse cache, if enabled; returns
+        True if they were found.
+        '''
+        parse_cache = cache.getCache()
+        if parse_cache is None or not self._cacheable(): return False
+        if self.stats != None: start = _stats.clock()
+        state = parse_cache.load(self.fpath, self._cacheKind())
+        if state != None:
+            self._loadState(state)
+            self._parsed = True
+        if self.stats != None:
+            self.stats.record('cache_load', _stats.clock() - start, self.fpath,
+                cache_hits=int(state != None), cache_misses=int(state is None))
+        return self._parsed
+
+    def _saveState(self):
+        '''Return the parse results as a dict of flat arrays.
+        '''
+        token_begins, token_ends, token_forms, token_pos = [], [], [], []
+        token_type_offsets = [0]
+        for node_type in self._token_types:
+            for (begin, end, token_string, pos) in self._typed_tokens[node_type]:
+                token_begins.append(begin)
+                token_ends.append(end)
+                token_forms.append(token_string)
+                token_pos.append(pos)
+            token_type_offsets.append(len(token_begins))
+
+        state = {
+            'token_begins': np.array(token_begins, dtype=np.int32),
+            'token_ends': np.array(token_ends, dtype=np.int32),
+            'token_type_offsets': np.array(token_type_offsets, dtype=np.int64),
+            'token_has_pos': np.array([pos != None for pos in token_pos], dtype=bool),
+            'sentence_bounds': np.array(self._sentence_bounds, dtype=np.int32).reshape(-1, 2),
+            'has_strings': np.array([self._document_id != None, self._sofa.text != None], dtype=bool),
+        }
+        (state['token_forms'], state['token_form_offsets']) = cache.packStrings(token_forms)
+        (state['token_pos'], state['token_pos_offsets']) = cache.packStrings(token_pos)
+        (state['strings'], state['string_offsets']) = cache.packStrings([self._document_id, self._sofa.text])
+
+        table = MentionTable.fromMentions(self.mentions)
+        state['mention_begins'] = table.begins
+        state['mention_ends'] = table.ends
+        state['mention_cui_offsets'] = table.cui_offsets
+        state['mention_cui_ids'] = table.cui_ids
+        (state['cuis'], state['cui_offsets']) = cache.packStrings(table.vocabulary.CUIs)
+        (state['mention_types'], state['mention_type_offsets']) = cache.packStrings(
+            table.types if table.types != None else [None] * len(table))
+        return state
+
+    def _loadState(self, state):
+        '''Restore the parse results saved by _saveState.
+        '''
+        token_begins = state['token_begins'].tolist()
+        token_ends = state['token_ends'].tolist()
+        token_forms = cache.unpackStrings(state['token_forms'], state['token_form_offsets'])
+        token_pos = cache.unpackStrings(state['token_pos'], state['token_pos_offsets'])
+        token_has_pos = state['token_has_pos'].tolist()
+        token_type_offsets = state['token_type_offsets'].tolist()
+        self._typed_tokens = {}
+        for (i, node_type) in enumerate(self._token_types):
+            self._typed_tokens[node_type] = [
+                (token_begins[j], token_ends[j], token_forms[j], token_pos[j] if token_has_pos[j] else None)
+                    for j in range(token_type_offsets[i], token_type_offsets[i+1])
+            ]
+
+        self._sentence_bounds = [tuple(bounds) for bounds in state['sentence_bounds'].tolist()]
+        self._sorted_sentence_bounds = None
+
+        (has_document_id, has_text) = state['has_strings'].tolist()
+        (document_id, text) = cache.unpackStrings(state['strings'], state['string_offsets'])
+        self._document_id = document_id if has_document_id else None
+        self._sofa.setText(text if has_text else None)
+
+        vocabulary = CUIVocabulary(cache.unpackStrings(state['cuis'], state['cui_offsets']))
+        mention_types = [mention_type if mention_type != '' else None for mention_type in
+            cache.unpackStrings(state['mention_types'], state['mention_type_offsets'])]
+        table = MentionTable(state['mention_begins'], state['mention_ends'],
+            state['mention_cui_offsets'], state['mention_cui_ids'], vocabulary, types=mention_types)
+        self._mentions = self._attachSofa(table.toMentions())
+
+    def _sortedSentenceBounds(self):
+        if self._sorted_sentence_bounds is None:
+            self._sorted_sentence_bounds = _sort_by_position(self._sentence_bounds)
+        return self._sorted_sentence_bounds
+
+    @abc.abstractmethod
+    def _readMention(self, mention_type, node):
+        '''Handle a node of the named mention type.
+        '''
+
+    @abc.abstractmethod
+    def _readNode(self, node_type, node):
+        '''Handle a node that mentions refer to (of kind CONCEPT).
+        '''
+
+    @abc.abstractmethod
+    def _buildMentions(self):
+        '''Build the list of Mention objects from the parsed nodes.
+        '''
+
+    def _readyMentions(self, final=False):
+        '''Return the Mentions read so far that can be resolved, and were
+        not returned by an earlier call, in order; if final, return all
+        the rest.  Used by iterMentions to stream mentions.
+
+        By default, no mentions are ready until the file has been read.
+        '''
+        if final: return self._buildMentions()
+        return []
+
+# policies for resolving overlapping mentions in token lists:
+#   all       :: keep every alternative (as a list of [before, Mention, after])
+#   longest   :: prefer the mentions with the longest spans
+#   first     :: prefer the mentions starting first (then the longest)
+#   most_cuis :: prefer the mentions with the most CUIs (then the longest)
+# Other than 'all', each cluster of overlapping mentions is resolved by
+# taking mentions in order of preference, skipping any that overlap one
+# already taken, so the output is flat.
+OVERLAP_POLICIES = ('all', 'longest', 'first', 'most_cuis')
+
+_overlap_priorities = {
+    'longest': lambda m, first, stop: (m.begin - m.end, first),
+    'first': lambda m, first, stop: (first, m.begin - m.end),
+    'most_cuis': lambda m, first, stop: (-len(m.CUIs), m.begin - m.end, first),
+}
+
+def _orderTokens(typed_tokens, sentence_bounds=None, mentions=None, overlaps='all', stats=None, fpath=None):
+    '''Merge lists of (begin, token) records for each token type into
+    the ordered token list described in Document.tokens.
+
+    If sentence_bounds (sorted (begin, end) pairs) is given,
+    tokens are grouped into Sentence objects.
+
+    If stats (a ParseStats) is given, the time spent in each step is
+    recorded to it.
+    '''
+    prepared = _prepareTokens(typed_tokens, mentions=mentions, overlaps=overlaps, stats=stats, fpath=fpath)
+    if stats != None: start = _stats.clock()
+
+    ordered_tokens = list(_sweepTokens(*prepared, sentence_bounds=sentence_bounds))
+    if stats != None: start = _recordStage(stats, 'sweep', start, fpath)
+
+    # flatten mentions and contexts
+    output_tokens = _flatten_mention_spans(ordered_tokens)
+    if stats != None: _recordStage(stats, 'flatten', start, fpath)
+
+    return output_tokens
+
+def _iterOrderedTokens(typed_tokens, sentence_bounds=None, mentions=None, overlaps='all', stats=None, fpath=None):
+    '''Generator version of _orderTokens, yielding each item of the
+    ordered token list (a token, mention group or Sentence) as soon as it
+    is complete.
+    '''
+    prepared = _prepareTokens(typed_tokens, mentions=mentions, overlaps=overlaps, stats=stats, fpath=fpath)
+    for item in _sweepTokens(*prepared, sentence_bounds=sentence_bounds):
+        yield _flattenItem(item)
+
+def _prepareTokens(typed_tokens, mentions=None, overlaps='all', stats=None, fpath=None):
+    '''Merge token types into text order and cluster the mentions over
+    them (resolving overlaps by the given policy); returns (tokens,
+    token_starts, clusters, mention_ends_by_start), as used by _sweepTokens.
+    '''
+    if not overlaps in OVERLAP_POLICIES:
+        raise ValueError("Unknown overlap policy '%s'" % overlaps)
+    if stats != None: start = _stats.clock()
+
+    # merge all token types into text order
+    token_starts, tokens = [], []
+    for (begin, token) in _mergeByPosition(typed_tokens):
+        token_starts.append(begin)
+        tokens.append(token)
+    if stats != None: start = _recordStage(stats, 'merge', start, fpath, tokens_emitted=len(tokens))
+
+    # group mentions into clusters of overlapping mentions, keyed by the
+    # index of the token each cluster starts at
+    if mentions != None:
+        (clusters, mention_ends_by_start) = _clusterMentions(tokens, token_starts, mentions, overlaps=overlaps)
+        if stats != None:
+            _recordStage(stats, 'cluster_mentions', start, fpath,
+                mentions_emitted=sum([_countMentions(items) for (_, items) in clusters.values()]))
+    else:
+        (clusters, mention_ends_by_start) = ({}, {})
+
+    return tokens, token_starts, clusters, mention_ends_by_start
+
+def _sweepTokens(tokens, token_starts, clusters, mention_ends_by_start, sentence_bounds=None):
+    '''Sweep over the merged tokens in text order, yielding each top-level
+    item of the (unflattened) token list as soon as it is complete:
+    tokens, mention cluster groups, and (if sentence_bounds is given)
+    Sentences.
+    '''
+    by_sentence = sentence_bounds != None
+    next_sentence_ix = 0
+
+    cluster = None          # (stop index, overlap group) of the current cluster
+    cluster_end = None      # furthest end offset of the mentions started so far
+    current_sentence = None
+
+    # sweep over all tokens in text order
+    for i in range(len(tokens)):
+        next_token, next_token_start = tokens[i], token_starts[i]
+
+        # if in a cluster of mentions, check if it has completed
+        if cluster != None:
+            # make sure no mentions are going outside a sentence
+            if by_sentence and not current_sentence is None:
+                assert cluster_end <= current_sentence.end
+
+            (cluster_stop, items) = cluster
+            if i == cluster_stop:
+                # all mentions completed, so flush them as a block
                 if by_sentence and not current_sentence is None:
-                    current_sentence.tokens.append(cur_mentions)
+                    current_sentence.tokens.extend(items)
                 else:
-                    ordered_tokens.append(cur_mentions)
-                # and reset the overlap trackers
-                cur_mentions, overlap_sofar = [], []
+                    for item in items: yield item
+                cluster, cluster_end = None, None
 
         # if in a sentence, try to resolve it
         if by_sentence and not current_sentence is None:
             if current_sentence.end <= next_token_start:
-                ordered_tokens.append(current_sentence)
+                yield current_sentence
                 current_sentence = None
         # if at the start of a sentence, load it in
-        if by_sentence and len(sorted_sentences) > 0 and next_token_start >= sorted_sentences[0].begin:
-            current_sentence = sorted_sentences.pop(0)
+        if by_sentence and next_sentence_ix < len(sentence_bounds) \
+                and next_token_start >= sentence_bounds[next_sentence_ix][0]:
+            current_sentence = Sentence(bounds=sentence_bounds[next_sentence_ix])
+            next_sentence_ix += 1
 
         # if starting a mention
-        if mentions != None and indexed_mentions.get(next_token_start, None) != None:
-            new_mentions = []
-            for m in indexed_mentions[next_token_start]:
-                m.text = [next_token]
-                cur_mentions.append([ overlap_sofar.copy(), m, [] ])
-            overlap_sofar.append(next_token)
-            in_mention = True
+        if cluster is None: cluster = clusters.get(i, None)
+        if i in mention_ends_by_start:
+            if cluster_end is None: cluster_end = mention_ends_by_start[i]
+            else: cluster_end = max(cluster_end, mention_ends_by_start[i])
 
         # otherwise, just add the word
-        if not in_mention:
+        if cluster is None:
             if by_sentence and not current_sentence is None:
                 current_sentence.tokens.append(next_token)
             else:
-                ordered_tokens.append(next_token)
-
-        # remove the starting index
-        starts_remaining[next_starts_ix][1].pop(0)
-        # check if any token types are complete
-        new_starts_remaining = []
-        for (i,start) in starts_remaining:
-            if len(start) > 0: new_starts_remaining.append((i,start))
-        starts_remaining = new_starts_remaining
-
-    # check if still have a mention buffered
-    if in_mention:
-        for (before, m, after) in cur_mentions:
-            m.text = ' '.join(m.text)
+                yield next_token
+
+    # check if still have a mention cluster buffered
+    if cluster != None:
+        (_, items) = cluster
         if by_sentence and not current_sentence is None:
-            current_sentence.tokens.append(cur_mentions)
+            current_sentence.tokens.extend(items)
         else:
-            ordered_tokens.append(cur_mentions)
+            for item in items: yield item
 
     # check if still have a sentence buffered
     if by_sentence and not current_sentence is None:
-        ordered_tokens.append(current_sentence)
-        current_sentence = None
+        yield current_sentence
 
-    # flatten mentions and contexts
-    output_tokens = _flatten_mention_spans(ordered_tokens)
+def _recordStage(stats, stage, start, fpath, **counts):
+    '''Record a stage that began at start; returns the current time, for
+    timing the next stage.
+    '''
+    now = _stats.clock()
+    stats.record(stage, now - start, fpath, **counts)
+    return now
 
-    return output_tokens
+def _clusterMentions(tokens, token_starts, mentions, overlaps='all'):
+    '''Align mentions to the ordered tokens and group overlapping mentions
+    into clusters (with a sweep over the mentions sorted by starting
+    token), filling in each Mention's text.
+
+    Mentions that do not begin exactly at a token are skipped.
+
+    Returns a dict mapping the token index at which each cluster starts
+    to (stop index, items), and a dict mapping each mention starting
+    token index to the furthest end offset of mentions starting there.
+    The items of a cluster are the top-level items of the token list
+    that replace its tokens: with overlaps='all', a single overlap group
+    (a list of [before, Mention, after] token lists); otherwise, the
+    tokens and Mentions left after resolving the overlap by that policy.
+    '''
+    (first, stop, aligned) = alignSpans(token_starts,
+        [m.begin for m in mentions], [m.end for m in mentions])
+
+    # order aligned mentions by starting token (stable, so mentions starting
+    # at the same token keep their input order)
+    mention_ixes = np.nonzero(aligned)[0]
+    mention_ixes = mention_ixes[np.argsort(first[mention_ixes], kind='stable')]
+    first, stop = first[mention_ixes], stop[mention_ixes]
+    (cluster_ids, cluster_stops) = mergeRanges(first, stop)
+
+    mention_ixes, first, stop = mention_ixes.tolist(), first.tolist(), stop.tolist()
+    cluster_ids, cluster_stops = cluster_ids.tolist(), cluster_stops.tolist()
+
+    if overlaps != 'all':
+        return _resolveClusters(tokens, [mentions[ix] for ix in mention_ixes], first, stop,
+            cluster_ids, cluster_stops, _overlap_priorities[overlaps])
+
+    clusters, mention_ends_by_start = {}, {}
+    cluster_starts = []     # distinct mention starting tokens in the current cluster
+    for j in range(len(mention_ixes)):
+        m = mentions[mention_ixes[j]]
+        cluster_stop = cluster_stops[cluster_ids[j]]
+        if j == 0 or cluster_ids[j] != cluster_ids[j-1]:
+            group = []
+            clusters[first[j]] = (cluster_stop, [group])
+            cluster_starts = []
+        if len(cluster_starts) == 0 or cluster_starts[-1] != first[j]:
+            cluster_starts.append(first[j])
+
+        # tokens in the cluster starting a mention before this one
+        before = [tokens[start] for start in cluster_starts[:-1]]
+        m.text = _mentionText(tokens[first[j]:stop[j]])
+        after = tokens[stop[j]:cluster_stop]
+        group.append([before, m, after])
+
+        mention_ends_by_start[first[j]] = max(m.end, mention_ends_by_start.get(first[j], m.end))
 
-def _get_and_validate_children(soup, node_type, validation_regex):
-    candidate_nodes, validated_nodes = soup.findChildren(node_type), []
-    for node in candidate_nodes:
-        if matchesRegex(validation_regex, repr(node)): validated_nodes.append(node)
-    return validated_nodes
-
-def _sort_by_position(nodes, attr='begin'):
-    node_sorter = { int(node[attr]): node for node in nodes }
-    assert len(node_sorter) == len(nodes)  # no duplicate 'begin' indices
-    indices, sorted_nodes = list(node_sorter.keys()), []
-    indices.sort()
-    for index in indices:
-        sorted_nodes.append(node_sorter[index])
-    return sorted_nodes
+    return clusters, mention_ends_by_start
+
+def _resolveClusters(tokens, mentions, first, stop, cluster_ids, cluster_stops, priority):
+    '''Resolve each cluster of overlapping mentions (aligned and ordered by
+    starting token, as in _clusterMentions) to non-overlapping mentions:
+    mentions are taken in order of priority (a function of the Mention
+    and its token range, lower first; ties go to input order), skipping
+    any that overlap one already taken.  Returns the same values as
+    _clusterMentions.
+    '''
+    clusters, mention_ends_by_start = {}, {}
+    if len(mentions) == 0: return clusters, mention_ends_by_start
+    cluster_lo = 0
+    for j in range(len(mentions) + 1):
+        if j < len(mentions):
+            m = mentions[j]
+            m.text = _mentionText(tokens[first[j]:stop[j]])
+            mention_ends_by_start[first[j]] = max(m.end, mention_ends_by_start.get(first[j], m.end))
+            if j == 0 or cluster_ids[j] == cluster_ids[j-1]: continue
+
+        # resolve the cluster of mentions [cluster_lo, j)
+        (cluster_start, cluster_stop) = (first[cluster_lo], cluster_stops[cluster_ids[cluster_lo]])
+        if j - cluster_lo == 1:
+            clusters[cluster_start] = (cluster_stop, [mentions[cluster_lo]] + tokens[stop[cluster_lo]:cluster_stop])
+        else:
+            ranked = sorted(range(cluster_lo, j), key=lambda k: priority(mentions[k], first[k], stop[k]))
+            taken_starts, taken = [], []    # token ranges taken, sorted by start
+            for k in ranked:
+                # taken ranges are disjoint, so only the neighbors can overlap
+                at = bisect.bisect_left(taken_starts, first[k])
+                if at > 0 and stop[taken[at-1]] > first[k]: continue
+                if at < len(taken) and first[taken[at]] < stop[k]: continue
+                taken_starts.insert(at, first[k])
+                taken.insert(at, k)
+            items, position = [], cluster_start
+            for k in taken:
+                items.extend(tokens[position:first[k]])
+                items.append(mentions[k])
+                position = stop[k]
+            items.extend(tokens[position:cluster_stop])
+            clusters[cluster_start] = (cluster_stop, items)
+        cluster_lo = j
+
+    return clusters, mention_ends_by_start
+
+def _mentionText(tokens):
+    # mention text joins the token strings (tokens are (string, POS) pairs
+    # when get_POS_tags is set)
+    return ' '.join([token[0] if type(token) == tuple else token for token in tokens])
+
+def _countMentions(items):
+    count = 0
+    for item in items:
+        if type(item) == list: count += len(item)
+        elif type(item) == Mention: count += 1
+    return count
+
+def _sort_by_position(records):
+    '''Sort (begin, value) records by beginning index.
+    '''
+    sorted_records = sorted(records, key=lambda record: record[0])
+    for i in range(1, len(sorted_records)):
+        assert sorted_records[i-1][0] != sorted_records[i][0]  # no duplicate 'begin' indices
+    return sorted_records
+
+def _mergeByPosition(typed_records):
+    '''Merge lists of (begin, value) records, each already sorted by
+    beginning index, into a single stream of (begin, value) ordered by
+    beginning index.  Ties are broken in favor of the earlier list.
+
+    Runs in O(n log k) time for n records over k lists.
+    '''
+    keyed_records = [
+        [(begin, list_ix, value) for (begin, value) in records]
+            for (list_ix, records) in enumerate(typed_records)
+    ]
+    for (begin, _, value) in heapq.merge(*keyed_records):
+        yield (begin, value)
 
 def _flatten_mention_spans(token_list):
-    output_tokens = []
-    for t in token_list:
-        if type(t) == Sentence:
-            t.tokens = _flatten_mention_spans(t.tokens)
-            output_tokens.append(t)
-        elif type(t) == list:
-            if len(t) == 1:
-                (before, m, after) = t[0]
-                output_tokens.append(m)
-            else:
-                output_tokens.append([
-                    flatten([before, m, after])
-                    for (before, m, after) in t
-                ])
-        else: output_tokens.append(t)
-    return output_tokens
+    return [_flattenItem(t) for t in token_list]
+
+def _flattenItem(t):
+    if type(t) == Sentence:
+        t.tokens = _flatten_mention_spans(t.tokens)
+        return t
+    elif type(t) == list:
+        if len(t) == 1:
+            (before, m, after) = t[0]
+            return m
+        else:
+            # (not flatten, which would also split (token, POS) pairs)
+            return [
+                before + [m] + after
+                for (before, m, after) in t
+            ]
+    else: return t
+
+
+### Streaming XML parsing ##############
+
+CHUNK_SIZE = 64 * 1024
+
+def openSource(fpath):
+    '''Open a cTAKES output file (or archive member; see ctakes.archives)
+    for binary reading, decompressing it if needed.  If the file has been
+    read ahead by the active ctakes.prefetch.Prefetcher, it is read from
+    memory.
+    '''
+    prefetcher = prefetch.getActive()
+    if prefetcher != None:
+        data = prefetcher.get(fpath)
+        if data != None: return archives.decompress(io.BytesIO(data))
+    return archives.decompress(archives.openRaw(fpath))
+
+def iterNodes(fpath, stats=None, chunk_size=CHUNK_SIZE):
+    '''Stream the annotation nodes of a cTAKES output file in a single
+    pass, yielding (namespace prefix, node name, node) for each child of
+    the document root.
+
+    The file is fed to the XML parser chunk_size bytes at a time, whatever
+    its line layout, and each node is discarded once the caller moves on
+    to the next one, so memory use stays constant as documents grow.
+
+    If stats (a ParseStats) is given, read and parse time, bytes read and
+    nodes seen are recorded to it when iteration ends.
+    '''
+    parser = ET.XMLPullParser(events=('start-ns', 'start', 'end'))
+    uri_prefixes, split_tags = {}, {}
+    root, depth, num_nodes = None, 0, 0
+    if stats != None: start = _stats.clock()
+    with openSource(fpath) as hook:
+        if stats != None:
+            # time spent waiting for a prefetched file counts as reading
+            hook = _TimedReader(hook, seconds=_stats.clock() - start)
+        try:
+            while True:
+                chunk = hook.read(chunk_size)
+                if chunk: parser.feed(chunk)
+                else: parser.close()
+                for (event, item) in parser.read_events():
+                    if event == 'start':
+                        if root is None: root = item
+                        depth += 1
+                    elif event == 'end':
+                        depth -= 1
+                        if depth == 1:
+                            split_tag = split_tags.get(item.tag, None)
+                            if split_tag is None:
+                                split_tag = _splitTag(item.tag, uri_prefixes)
+                                split_tags[item.tag] = split_tag
+                            (ns, node_name) = split_tag
+                            num_nodes += 1
+                            yield (ns, node_name, item)
+                            root.clear()
+                    else:
+                        (prefix, uri) = item
+                        uri_prefixes[uri] = prefix
+                if not chunk: break
+        finally:
+            if stats != None:
+                elapsed = _stats.clock() - start
+                stats.record('read', hook.seconds, fpath, bytes_read=hook.bytes)
+                stats.record('parse', elapsed - hook.seconds, fpath, nodes=num_nodes)
+
+class _TimedReader:
+    '''Wraps a binary file, recording the time spent in and bytes returned
+    by its reads.
+    '''
+    def __init__(self, hook, seconds=0.):
+        self.hook = hook
+        self.seconds = seconds
+        self.bytes = 0
+
+    def read(self, size=-1):
+        start = _stats.clock()
+        data = self.hook.read(size)
+        self.seconds += _stats.clock() - start
+        self.bytes += len(data)
+        return data
+
+def findNode(fpath, node_type, stats=None):
+    '''Return the first node of the given (namespace prefix, node name)
+    type in the file, or None if there is none.
+
+    Stops reading the file as soon as the node is found.
+    '''
+    nodes = iterNodes(fpath, stats=stats)
+    try:
+        for (ns, node_name, node) in nodes:
+            if (ns, node_name) == node_type:
+                return node
+    finally:
+        nodes.close()
+    return None
+
+def _splitTag(tag, uri_prefixes):
+    '''Split an ElementTree tag ("{uri}name") into its namespace prefix
+    and node name; un-namespaced tags get a prefix of None.
+    '''
+    if tag[0] == '{':
+        (uri, node_name) = tag[1:].split('}', 1)
+        return (uri_prefixes.get(uri, None), node_name)
+    return (None, tag)
 
 
 ### Utility methods #####################
@@ -0,0 +1,137 @@
+'''
+Opt-in profiling counters for the parsing pipeline.
+
+When enabled, Documents record the wall time spent in each stage of
+parsing and token ordering, along with counters for bytes read, XML nodes
+seen, and tokens, sentences and mentions produced.  Nothing is recorded
+(or timed) while stats are disabled.
+
+Stages:
+    read             :: reading file bytes
+    parse            :: XML parsing and node collection (excluding reads)
+    sort             :: sorting tokens and sentences by position
+    build_mentions   :: resolving mention concept references to CUIs
+    merge            :: merging token types into text order
+    cluster_mentions :: aligning mentions to tokens and grouping overlaps
+    sweep            :: assembling the token list (and sentences)
+    flatten          :: flattening overlapping mention groups
+    cache_load       :: loading parse results from the parse cache
+    cache_store      :: saving parse results to the parse cache
+
+Usage:
+    from ctakes.format import stats, XMI
+    totals = stats.enable()
+    for fpath in fpaths:
+        doc = XMI.Document(fpath)
+        doc.tokens(mentions=doc.mentions)
+    print(totals.report())
+    metrics = totals.asDict(prefix='ctakes.')     # flat name -> number
+
+A callback may also be given, to receive each stage as it completes:
+    stats.enable(callback=lambda stage, fpath, seconds, counts: ...)
+'''
+
+import time
+
+clock = time.perf_counter
+
+_stats = None
+
+def enable(callback=None):
+    '''Turn on stats recording for all Documents, returning the ParseStats
+    that accumulates them.  If callback is given, it is called as
+    callback(stage, fpath, seconds, counts) as each stage completes.
+    '''
+    global _stats
+    _stats = ParseStats(callback=callback)
+    return _stats
+
+def disable():
+    '''Turn off stats recording.
+    '''
+    global _stats
+    _stats = None
+
+def getStats():
+    '''Return the active ParseStats, or None if stats are disabled.
+    '''
+    return _stats
+
+def setStats(parse_stats):
+    '''Make parse_stats (a ParseStats, or None to disable) the active
+    ParseStats; returns the one that was active before.
+    '''
+    global _stats
+    previous = _stats
+    _stats = parse_stats
+    return previous
+
+class ParseStats:
+    '''Per-stage wall time, call counts and named counters, accumulated
+    over any number of documents.
+
+    ParseStats objects are picklable and can be combined with merge, so
+    stats recorded in worker processes can be aggregated in the parent.
+    '''
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.seconds = {}
+        self.calls = {}
+        self.counts = {}
+
+    def record(self, stage, seconds, fpath=None, **counts):
+        '''Add one completed run of stage, with any counters it produced.
+        '''
+        self.seconds[stage] = self.seconds.get(stage, 0.) + seconds
+        self.calls[stage] = self.calls.get(stage, 0) + 1
+        for (name, n) in counts.items():
+            self.counts[name] = self.counts.get(name, 0) + n
+        if self.callback != None:
+            self.callback(stage, fpath, seconds, counts)
+
+    def merge(self, other):
+        '''Add the stats in other to this object (the callback is not
+        called for merged stats).
+        '''
+        for (stage, seconds) in other.seconds.items():
+            self.seconds[stage] = self.seconds.get(stage, 0.) + seconds
+        for (stage, calls) in other.calls.items():
+            self.calls[stage] = self.calls.get(stage, 0) + calls
+        for (name, n) in other.counts.items():
+            self.counts[name] = self.counts.get(name, 0) + n
+        return self
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['callback'] = None    # callbacks stay in the process that set them
+        return state
+
+    @property
+    def total_seconds(self):
+        return sum(self.seconds.values())
+
+    def asDict(self, prefix=''):
+        '''Return a flat dict of metric name -> number, suitable for
+        sending to a metrics system, e.g.
+            { 'seconds.parse': 1.2, 'calls.parse': 10, 'count.bytes_read': 1048576 }
+        '''
+        metrics = {}
+        for (stage, seconds) in self.seconds.items():
+            metrics['%sseconds.%s' % (prefix, stage)] = seconds
+        for (stage, calls) in self.calls.items():
+            metrics['%scalls.%s' % (prefix, stage)] = calls
+        for (name, n) in self.counts.items():
+            metrics['%scount.%s' % (prefix, name)] = n
+        return metrics
+
+    def report(self):
+        '''Return a human-readable table of the stats.
+        '''
+        total = max(self.total_seconds, 1e-9)
+        lines = ['%-18s %10s %7s %9s' % ('stage', 'seconds', '%', 'calls')]
+        for stage in sorted(self.seconds, key=lambda stage: -self.seconds[stage]):
+            lines.append('%-18s %10.4f %6.1f%% %9d' % (
+                stage, self.seconds[stage], 100 * self.seconds[stage] / total, self.calls[stage]))
+        for name in sorted(self.counts):
+            lines.append('%-18s %10d' % (name, self.counts[name]))
+        return '\n'.join(lines)
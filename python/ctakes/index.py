@@ -0,0 +1,392 @@
+'''
+Corpus-wide inverted index from CUIs to mention postings.
+
+Each posting records one mention of a CUI: the document it occurs in, its
+[begin, end) character offsets, and its mention type.  The index lives in
+a directory of immutable segments, each holding its postings as flat
+.npy arrays sorted by (CUI, document, begin), which are memory-mapped when
+the index is opened, so queries never re-read the cTAKES output files.
+
+New documents are added by writing new segments; re-adding a path that is
+already indexed replaces its earlier version, and removing paths writes a
+segment recording their removal.  compact() merges all segments into
+one, dropping replaced and removed documents.  updateFiles() keeps the
+index in step with a changing corpus, using a manifest (see
+ctakes.manifest) to index only added and changed files.
+
+Usage:
+    index = CUIIndex('/path/to/index')
+    index.addFiles(corpus.listFiles(['/path/to/xmi/dir']), num_workers=8)
+    for (path, begin, end, mention_type) in index.postings('C0011849'):
+        ...
+    index.documentFrequency('C0011849')
+    index.cooccurrences('C0011849', 'C0020538', window=100)
+
+@depends NumPy
+'''
+
+import os
+import json
+import shutil
+import functools
+import numpy as np
+from . import files
+from . import corpus
+from . import archives
+from .manifest import Manifest
+
+INDEX_VERSION = 1
+
+_segment_prefix = 'segment-'
+_posting_arrays = ('docs', 'begins', 'ends', 'types')
+
+class CUIIndex:
+    '''An on-disk inverted index from CUI to (document, begin, end,
+    mention type) postings; the directory is created if it does not exist.
+    '''
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.isdir(directory): os.makedirs(directory)
+        self._pending = []
+        self._load()
+
+    ### Building ##########################
+
+    def addDocument(self, path, mentions, document_id=None):
+        '''Queue a document's mentions (a list of Mention objects) for
+        indexing; they are written as a new segment on flush().
+        '''
+        self._pending.append((path, document_id, mentions))
+
+    def addFiles(self, fpaths, format=None, num_workers=None, chunk_size=16, progress=None, batch_size=10000):
+        '''Parse and index cTAKES output files, writing a new segment every
+        batch_size documents.  Returns the FileResults of files that could
+        not be parsed.
+        '''
+        process = functools.partial(corpus.parseFile, format=format)
+        errors = []
+        for result in corpus.processCorpus(fpaths, process=process, num_workers=num_workers,
+                chunk_size=chunk_size, progress=progress):
+            if result.error != None:
+                errors.append(result)
+                continue
+            self.addDocument(result.path, result.value['mentions'], document_id=result.value['document_id'])
+            if len(self._pending) >= batch_size: self.flush()
+        self.flush()
+        return errors
+
+    def removeFiles(self, fpaths):
+        '''Remove the documents of the given file paths (including all
+        members of archives among them) from the index.
+        '''
+        fpaths = set(fpaths)
+        paths = sorted([
+            path for path in self._doc_by_path
+                if path in fpaths or archives.splitMember(path)[0] in fpaths
+        ])
+        if len(paths) == 0: return
+        self.flush()
+        self._writeSegment([], [], removes=paths)
+        self._load()
+
+    def updateFiles(self, fpaths, format=None, manifest_path=None, **kwargs):
+        '''Bring the index up to date with the files in fpaths: index files
+        added or changed since the last update (replacing any earlier
+        version), and remove files no longer in fpaths.
+
+        The indexed files are tracked in a Manifest at manifest_path
+        (default: manifest.json in the index directory).  Files that could
+        not be parsed are not recorded, so they are retried on the next
+        update.  Other keyword arguments are passed to addFiles.
+
+        Returns (Changes, FileResults of files that could not be parsed).
+        '''
+        if manifest_path is None: manifest_path = os.path.join(self.directory, 'manifest.json')
+        manifest = Manifest(manifest_path, settings={ 'format': format })
+        changes = manifest.diff(fpaths)
+        # changed archives may have lost members, so drop all their documents first
+        self.removeFiles(changes.changed + changes.removed)
+        errors = self.addFiles(changes.process, format=format, **kwargs)
+
+        failed = set([archives.splitMember(result.path)[0] for result in errors]
+            + [result.path for result in errors])
+        for fpath in changes.states:
+            if fpath in failed: manifest.remove(fpath)
+            else: manifest.record(fpath, changes.states[fpath], output=self.directory)
+        for fpath in changes.removed:
+            manifest.remove(fpath)
+        manifest.save()
+        return (changes, errors)
+
+    def addIndexes(self, indexes):
+        '''Add the (live) documents of other CUIIndexes to this one as a
+        single segment, with documents in order of source file path (and
+        archive members in their order in the archive, as when indexing
+        the files), replacing any earlier version of the same path in
+        this index.
+        '''
+        self.flush()
+        sources = {}
+        for (i, other) in enumerate(indexes):
+            for (path, doc) in other._doc_by_path.items():
+                sources[path] = (i, doc)
+        new_docs, documents = {}, []
+        for path in sorted(sources.keys(), key=lambda path: (archives.splitMember(path)[0],) + sources[path]):
+            (i, doc) = sources[path]
+            new_docs[(i, doc)] = self._next_doc
+            documents.append((self._next_doc, path, indexes[i].documentID(doc)))
+            self._next_doc += 1
+
+        postings = []
+        for (i, other) in enumerate(indexes):
+            for cui in other.CUIs():
+                other_postings = other.postings(cui)
+                for (doc, begin, end, type_id) in zip(other_postings.docs.tolist(), other_postings.begins.tolist(),
+                        other_postings.ends.tolist(), other_postings.type_ids.tolist()):
+                    if (i, doc) in new_docs:
+                        postings.append((cui, new_docs[(i, doc)], begin, end, other.types[type_id]))
+        # order fully, so the segment does not depend on the order of indexes
+        postings.sort(key=lambda posting: posting[:4] + (posting[4] or '',))
+        self._writeSegment(documents, postings)
+        self._load()
+
+    def flush(self):
+        '''Write all queued documents to a new segment.
+        '''
+        if len(self._pending) == 0: return
+        documents, postings = [], []
+        for (path, document_id, mentions) in self._pending:
+            doc = self._next_doc
+            self._next_doc += 1
+            documents.append((doc, path, document_id))
+            for m in mentions:
+                for cui in m.CUIs:
+                    postings.append((cui, doc, m.begin, m.end, m.type))
+        self._pending = []
+        self._writeSegment(documents, postings)
+        self._load()
+
+    def compact(self):
+        '''Merge all segments into one, dropping replaced documents.
+        '''
+        self.flush()
+        if len(self._segments) < 2 and self._num_replaced == 0: return
+        documents = [
+            (doc, self._paths[doc], self._document_ids[doc])
+                for doc in range(len(self._paths)) if self._live[doc]
+        ]
+        postings = []
+        for segment in self._segments:
+            for (i, cui) in enumerate(segment.CUIs):
+                (lo, hi) = (segment.cui_offsets[i], segment.cui_offsets[i+1])
+                docs = segment.docs[lo:hi]
+                for j in np.nonzero(self._live[docs])[0].tolist():
+                    postings.append((cui, int(docs[j]), int(segment.begins[lo+j]), int(segment.ends[lo+j]),
+                        segment.types[segment.type_ids[lo+j]]))
+        self._writeSegment(documents, postings, replaces=[segment.name for segment in self._segments])
+        for segment in self._segments:
+            shutil.rmtree(segment.path, ignore_errors=True)
+        self._load()
+
+    def _writeSegment(self, documents, postings, replaces=None, removes=None):
+        '''Atomically write a segment of documents [(doc, path, document ID)]
+        and postings [(CUI, doc, begin, end, mention type)], and the paths
+        it removes from the index.
+        '''
+        postings.sort(key=lambda posting: posting[:3])
+        CUIs, cui_offsets, types, type_ids = [], [], [], {}
+        for (i, (cui, _, _, _, mention_type)) in enumerate(postings):
+            if len(CUIs) == 0 or CUIs[-1] != cui:
+                CUIs.append(cui)
+                cui_offsets.append(i)
+            if not mention_type in type_ids:
+                type_ids[mention_type] = len(types)
+                types.append(mention_type)
+        cui_offsets.append(len(postings))
+
+        arrays = {
+            'cui_offsets': np.array(cui_offsets, dtype=np.int64),
+            'docs': np.array([posting[1] for posting in postings], dtype=np.int32),
+            'begins': np.array([posting[2] for posting in postings], dtype=np.int32),
+            'ends': np.array([posting[3] for posting in postings], dtype=np.int32),
+            'types': np.array([type_ids[posting[4]] for posting in postings], dtype=np.int16),
+        }
+        meta = {
+            'version': INDEX_VERSION,
+            'CUIs': CUIs,
+            'types': types,
+            'documents': documents,
+            'replaces': replaces or [],
+            'removes': removes or [],
+        }
+
+        name = '%s%06d' % (_segment_prefix, self._next_segment)
+        with files.atomicDirectory(os.path.join(self.directory, name)) as tmp_path:
+            for (array_name, array) in arrays.items():
+                np.save(os.path.join(tmp_path, '%s.npy' % array_name), array)
+            with open(os.path.join(tmp_path, 'meta.json'), 'w') as stream:
+                json.dump(meta, stream)
+
+    def _load(self):
+        '''(Re)open all segments in the index directory.
+        '''
+        names = sorted([
+            name for name in os.listdir(self.directory)
+                if name.startswith(_segment_prefix)
+        ])
+        segments = [_Segment(os.path.join(self.directory, name)) for name in names]
+        # skip segments already merged into a compacted one (in case
+        # compaction was interrupted before removing them)
+        replaced = set()
+        for segment in segments: replaced.update(segment.replaces)
+        self._segments = [segment for segment in segments if not segment.name in replaced]
+        if len(names) > 0: self._next_segment = int(names[-1][len(_segment_prefix):]) + 1
+        else: self._next_segment = 0
+
+        # document table; a later document with the same path replaces an
+        # earlier one, and a later removal drops it
+        num_docs = max([doc + 1 for segment in self._segments for (doc, _, _) in segment.documents] + [0])
+        self._paths = [None] * num_docs
+        self._document_ids = [None] * num_docs
+        latest = {}
+        for segment in self._segments:
+            for path in segment.removes:
+                latest.pop(path, None)
+            for (doc, path, document_id) in segment.documents:
+                self._paths[doc] = path
+                self._document_ids[doc] = document_id
+                latest[path] = max(doc, latest.get(path, -1))
+        self._live = np.zeros(num_docs, dtype=bool)
+        self._live[list(latest.values())] = True
+        self._num_replaced = sum([len(segment.documents) for segment in self._segments]) - len(latest)
+        self._doc_by_path = latest
+        self._next_doc = num_docs
+
+        # shared mention type vocabulary
+        self.types = []
+        type_ids = {}
+        for segment in self._segments:
+            for mention_type in segment.types:
+                if not mention_type in type_ids:
+                    type_ids[mention_type] = len(self.types)
+                    self.types.append(mention_type)
+            segment.global_type_ids = np.array([type_ids[t] for t in segment.types], dtype=np.int16)
+
+    ### Queries ###########################
+
+    def __len__(self):
+        '''Number of (live) indexed documents.
+        '''
+        return len(self._doc_by_path)
+
+    def __contains__(self, path):
+        return path in self._doc_by_path
+
+    def path(self, doc):
+        return self._paths[doc]
+
+    def documentID(self, doc):
+        return self._document_ids[doc]
+
+    def CUIs(self):
+        '''Return the sorted list of all indexed CUIs.
+        '''
+        CUIs = set()
+        for segment in self._segments: CUIs.update(segment.CUIs)
+        return sorted(CUIs)
+
+    def postings(self, cui):
+        '''Return the Postings of cui, sorted by document and position.
+        '''
+        parts = { name: [] for name in _posting_arrays }
+        for segment in self._segments:
+            i = segment.cui_ids.get(cui, None)
+            if i is None: continue
+            (lo, hi) = (segment.cui_offsets[i], segment.cui_offsets[i+1])
+            parts['docs'].append(segment.docs[lo:hi])
+            parts['begins'].append(segment.begins[lo:hi])
+            parts['ends'].append(segment.ends[lo:hi])
+            parts['types'].append(segment.global_type_ids[segment.type_ids[lo:hi]])
+        if len(parts['docs']) == 0:
+            return Postings(self, *[np.zeros(0, dtype=np.int32) for _ in _posting_arrays])
+        arrays = [np.concatenate(parts[name]) for name in _posting_arrays]
+        live = self._live[arrays[0]]
+        if not live.all(): arrays = [array[live] for array in arrays]
+        return Postings(self, *arrays)
+
+    def documents(self, cui):
+        '''Return the sorted list of paths of documents mentioning cui.
+        '''
+        return [self._paths[doc] for doc in self.postings(cui).uniqueDocs().tolist()]
+
+    def documentFrequency(self, cui):
+        '''Return the number of documents mentioning cui.
+        '''
+        return len(self.postings(cui).uniqueDocs())
+
+    def cooccurrences(self, cui_a, cui_b, window=0):
+        '''Return the pairs of mentions of cui_a and cui_b in the same
+        document within window characters of each other (0 for
+        overlapping), as a list of (path, (a begin, a end), (b begin, b end)).
+        '''
+        a, b = self.postings(cui_a), self.postings(cui_b)
+        pairs = []
+        for doc in np.intersect1d(a.uniqueDocs(), b.uniqueDocs()).tolist():
+            (a_lo, a_hi) = np.searchsorted(a.docs, [doc, doc + 1])
+            (b_lo, b_hi) = np.searchsorted(b.docs, [doc, doc + 1])
+            a_begins, a_ends = a.begins[a_lo:a_hi, None], a.ends[a_lo:a_hi, None]
+            b_begins, b_ends = b.begins[None, b_lo:b_hi], b.ends[None, b_lo:b_hi]
+            near = (b_begins < a_ends + window) & (b_ends + window > a_begins)
+            if cui_a == cui_b: near &= ~((a_begins == b_begins) & (a_ends == b_ends))
+            path = self._paths[doc]
+            for (i, j) in zip(*np.nonzero(near)):
+                pairs.append((path,
+                    (int(a_begins[i, 0]), int(a_ends[i, 0])),
+                    (int(b_begins[0, j]), int(b_ends[0, j]))
+                ))
+        return pairs
+
+class Postings:
+    '''The postings of one CUI, as parallel arrays sorted by document and
+    beginning offset; iterating gives (path, begin, end, mention type).
+    '''
+    def __init__(self, index, docs, begins, ends, type_ids):
+        self.index = index
+        self.docs = docs
+        self.begins = begins
+        self.ends = ends
+        self.type_ids = type_ids
+
+    def __len__(self):
+        return len(self.docs)
+
+    def __iter__(self):
+        for (doc, begin, end, type_id) in zip(self.docs.tolist(), self.begins.tolist(),
+                self.ends.tolist(), self.type_ids.tolist()):
+            yield (self.index.path(doc), begin, end, self.index.types[type_id])
+
+    def uniqueDocs(self):
+        '''Return the sorted array of distinct document numbers.
+        '''
+        if len(self.docs) == 0: return self.docs
+        return self.docs[np.concatenate(([True], self.docs[1:] != self.docs[:-1]))]
+
+class _Segment:
+    '''One immutable segment of the index, with its arrays memory-mapped.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)
+        with open(os.path.join(path, 'meta.json'), 'r') as stream:
+            meta = json.load(stream)
+        self.CUIs = meta['CUIs']
+        self.cui_ids = { cui: i for (i, cui) in enumerate(self.CUIs) }
+        self.types = meta['types']
+        self.documents = [tuple(document) for document in meta['documents']]
+        self.replaces = meta['replaces']
+        self.removes = meta.get('removes', [])
+        self.cui_offsets = np.load(os.path.join(path, 'cui_offsets.npy')).tolist()
+        self.docs = files.mapArray(os.path.join(path, 'docs.npy'))
+        self.begins = files.mapArray(os.path.join(path, 'begins.npy'))
+        self.ends = files.mapArray(os.path.join(path, 'ends.npy'))
+        self.type_ids = files.mapArray(os.path.join(path, 'types.npy'))
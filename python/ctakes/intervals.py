@@ -0,0 +1,83 @@
+'''
+Interval indexing over character offsets, used to align mentions with
+tokens and to answer span-overlap queries on a document.
+
+@depends NumPy
+'''
+
+import numpy as np
+
+class IntervalIndex:
+    '''Index over a set of [begin, end) character intervals, answering
+    overlap queries by binary search over sorted offsets.
+
+    Query results are indices into the original order of the intervals.
+    '''
+    def __init__(self, begins, ends):
+        begins = np.asarray(begins, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        self.order = np.argsort(begins, kind='stable')
+        self.begins = begins[self.order]
+        self.ends = ends[self.order]
+        # running maximum of ends, to bound the candidates for a query
+        if len(self.ends) > 0: self._max_ends = np.maximum.accumulate(self.ends)
+        else: self._max_ends = self.ends
+
+    def __len__(self):
+        return len(self.begins)
+
+    def overlapping(self, begin, end):
+        '''Return the sorted indices of intervals overlapping [begin, end).
+        '''
+        hi = np.searchsorted(self.begins, end, side='left')
+        lo = np.searchsorted(self._max_ends[:hi], begin, side='right')
+        candidates = np.arange(lo, hi)[self.ends[lo:hi] > begin]
+        return np.sort(self.order[candidates])
+
+    def contained(self, begin, end):
+        '''Return the sorted indices of intervals lying within [begin, end).
+        '''
+        lo = np.searchsorted(self.begins, begin, side='left')
+        hi = np.searchsorted(self.begins, end, side='left')
+        candidates = np.arange(lo, hi)[self.ends[lo:hi] <= end]
+        return np.sort(self.order[candidates])
+
+def alignSpans(token_begins, span_begins, span_ends):
+    '''Map character spans onto a sorted array of token beginning offsets.
+
+    Returns (first, stop, aligned) arrays: the tokens beginning inside span
+    i are token_begins[first[i]:stop[i]] (always at least the first token),
+    and aligned[i] is True if span i begins exactly at a token.
+    '''
+    token_begins = np.asarray(token_begins, dtype=np.int64)
+    span_begins = np.asarray(span_begins, dtype=np.int64)
+    span_ends = np.asarray(span_ends, dtype=np.int64)
+    num_tokens = len(token_begins)
+
+    first = np.searchsorted(token_begins, span_begins, side='left')
+    stop = np.maximum(np.searchsorted(token_begins, span_ends, side='left'), first + 1)
+    stop = np.minimum(stop, num_tokens)
+    if num_tokens > 0:
+        aligned = (first < num_tokens) & (token_begins[np.minimum(first, num_tokens - 1)] == span_begins)
+    else:
+        aligned = np.zeros(len(span_begins), dtype=bool)
+    return first, stop, aligned
+
+def mergeRanges(first, stop):
+    '''Group [first, stop) index ranges, sorted by first, into clusters of
+    overlapping ranges (a range starting exactly where the cluster so far
+    stops begins a new cluster).
+
+    Returns (cluster_ids, cluster_stops): the cluster of each range, and
+    the stop index of each cluster.
+    '''
+    first = np.asarray(first, dtype=np.int64)
+    stop = np.asarray(stop, dtype=np.int64)
+    if len(first) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    running_stop = np.maximum.accumulate(stop)
+    starts_cluster = np.ones(len(first), dtype=bool)
+    starts_cluster[1:] = first[1:] >= running_stop[:-1]
+    cluster_ids = np.cumsum(starts_cluster) - 1
+    cluster_stops = np.maximum.reduceat(stop, np.nonzero(starts_cluster)[0])
+    return cluster_ids, cluster_stops
@@ -0,0 +1,198 @@
+'''
+Incremental processing of corpora that keep growing.
+
+A Manifest records, for every input file that went into an aggregated
+output (e.g. a JSONL file written by processCorpus.py, or a CUIIndex),
+the file's size, modification time and content hash, and where its
+results are in the output.  On the next run, diff() compares the current
+list of files against it, so only added and changed files need to be
+reprocessed and only removed files dropped from the output.
+
+Only files whose size or modification time differ from the manifest are
+hashed, so unchanged files are never read; a file that was merely
+touched (or copied with a new modification time) hashes the same and is
+not reprocessed.  Hashes are of the bytes as stored, before any
+decompression, and archives are tracked as a whole.
+
+Usage:
+    manifest = Manifest('/data/mentions.jsonl.manifest.json')
+    changes = manifest.diff(corpus.listFiles(['/path/to/xmi/dir']))
+    for result in corpus.processCorpus(changes.process):
+        ...
+    manifest.record(fpath, changes.states[fpath], output=...)
+    manifest.save()
+
+corpus.updateOutput and CUIIndex.updateFiles do this for their outputs.
+'''
+
+import os
+import json
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from . import files
+from . import archives
+
+MANIFEST_VERSION = 1
+HASH_ALGORITHM = 'sha1'
+
+_block_size = 1024 * 1024
+
+def statFile(fpath):
+    '''Return (size, modification time in ns) of a file; archive members
+    have their own size and the modification time of their archive.
+    '''
+    (archive_path, member) = archives.splitMember(fpath)
+    stat = os.stat(archive_path)
+    if member is None: return (stat.st_size, stat.st_mtime_ns)
+    return (archives.getSize(fpath), stat.st_mtime_ns)
+
+def hashFile(fpath):
+    '''Return the hex digest of the raw (not decompressed) bytes of a file
+    or archive member.
+    '''
+    digest = hashlib.new(HASH_ALGORITHM)
+    with archives.openRaw(fpath) as stream:
+        while True:
+            block = stream.read(_block_size)
+            if not block: break
+            digest.update(block)
+    return digest.hexdigest()
+
+class Changes:
+    '''The differences between a list of files and a Manifest.
+
+    added, changed, unchanged and removed are lists of paths; process
+    holds the added and changed files in input order, and states maps
+    every current file to its (size, mtime_ns, hash) (hash is None for
+    files that were not hashed because their size and modification time
+    match the manifest).
+    '''
+    def __init__(self):
+        self.added, self.changed, self.unchanged, self.removed = [], [], [], []
+        self.process = []
+        self.states = {}
+
+    def summary(self):
+        return '%d added, %d changed, %d removed, %d unchanged' % (
+            len(self.added), len(self.changed), len(self.removed), len(self.unchanged))
+
+class Manifest:
+    '''The files (and their state) that an aggregated output was built
+    from, saved as JSON at fpath (loaded from it if it exists).
+
+    settings is any JSON-serializable description of how the output was
+    built (e.g. processing options); if it differs from the settings the
+    manifest was saved with, the manifest is cleared, so every file is
+    reprocessed.
+    '''
+    def __init__(self, fpath, settings=None):
+        self.fpath = fpath
+        self.settings = settings
+        self.entries = {}
+        self.output = None      # state of the output file, if any (see checkOutput)
+        if os.path.isfile(fpath):
+            with open(fpath, 'r') as stream:
+                saved = json.load(stream)
+            if saved.get('version') == MANIFEST_VERSION and saved.get('hash') == HASH_ALGORITHM \
+                    and saved.get('settings') == _normalize(settings):
+                self.entries = saved['entries']
+                self.output = saved.get('output', None)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, fpath):
+        return fpath in self.entries
+
+    def get(self, fpath):
+        '''Return the entry of fpath (a dict with its size, mtime_ns, hash
+        and output location), or None.
+        '''
+        return self.entries.get(fpath, None)
+
+    def diff(self, fpaths, num_threads=4):
+        '''Compare fpaths (duplicates are ignored) with the manifest,
+        returning a Changes.  Files whose size or modification time
+        differ are hashed, in num_threads threads.
+        '''
+        changes = Changes()
+        fpaths = list(dict.fromkeys(fpaths))
+        candidates = []
+        for fpath in fpaths:
+            (size, mtime_ns) = statFile(fpath)
+            entry = self.entries.get(fpath, None)
+            if entry != None and entry['size'] == size and entry['mtime_ns'] == mtime_ns:
+                changes.states[fpath] = (size, mtime_ns, None)
+            else:
+                changes.states[fpath] = (size, mtime_ns)
+                candidates.append(fpath)
+
+        with ThreadPoolExecutor(max_workers=max(1, num_threads)) as executor:
+            for (fpath, digest) in zip(candidates, executor.map(hashFile, candidates)):
+                changes.states[fpath] = changes.states[fpath] + (digest,)
+
+        for fpath in fpaths:
+            entry = self.entries.get(fpath, None)
+            digest = changes.states[fpath][2]
+            if entry is None:
+                changes.added.append(fpath)
+            elif digest is None or digest == entry['hash']:
+                changes.unchanged.append(fpath)
+            else:
+                changes.changed.append(fpath)
+            if entry is None or (digest != None and digest != entry['hash']):
+                changes.process.append(fpath)
+        current = set(fpaths)
+        changes.removed = sorted([fpath for fpath in self.entries if not fpath in current])
+        return changes
+
+    def record(self, fpath, state, output=None):
+        '''Record that fpath, in state (size, mtime_ns, hash; a None hash
+        keeps the recorded one), is in the output at location output
+        (any JSON-serializable value, e.g. a byte range).
+        '''
+        (size, mtime_ns, digest) = state
+        if digest is None: digest = self.entries[fpath]['hash']
+        self.entries[fpath] = {
+            'size': size,
+            'mtime_ns': mtime_ns,
+            'hash': digest,
+            'output': output,
+        }
+
+    def remove(self, fpath):
+        self.entries.pop(fpath, None)
+
+    def clear(self):
+        self.entries = {}
+        self.output = None
+
+    def checkOutput(self, output_path):
+        '''Clear the manifest unless output_path is the file it was last
+        saved with (same size and modification time), since the recorded
+        output locations are only valid for that file.
+        '''
+        if self.output is None or not os.path.isfile(output_path) \
+                or self.output != _outputState(output_path):
+            self.clear()
+
+    def save(self, output_path=None):
+        '''Atomically write the manifest, recording the state of the output
+        file at output_path (if given) for checkOutput.
+        '''
+        if output_path != None: self.output = _outputState(output_path)
+        files.writeJSON(self.fpath, {
+            'version': MANIFEST_VERSION,
+            'hash': HASH_ALGORITHM,
+            'settings': _normalize(self.settings),
+            'output': self.output,
+            'entries': self.entries,
+        })
+
+def _outputState(output_path):
+    stat = os.stat(output_path)
+    return { 'path': os.path.abspath(output_path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns }
+
+def _normalize(settings):
+    # compare settings as they read back from JSON (e.g. tuples as lists)
+    return json.loads(json.dumps(settings))
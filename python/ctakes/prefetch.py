@@ -0,0 +1,165 @@
+'''
+Background read-ahead of files, to overlap file I/O with parsing.
+
+A Prefetcher reads an ordered list of files in a small pool of threads,
+keeping up to `window` files (and roughly at most max_bytes) buffered
+ahead of the file currently being processed.  While a Prefetcher is
+active, the ctakes.format parsers read the files it holds from memory
+instead of from disk, so any code that parses files in order benefits
+without changes.
+
+Usage:
+    with Prefetcher(fpaths, window=8):
+        for fpath in fpaths:
+            mentions = XMI.getMentions(fpath)
+
+corpus.processCorpus sets this up per worker with its read_ahead option.
+'''
+
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from . import archives
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+_active = None
+
+def getActive():
+    '''Return the active Prefetcher, or None.
+    '''
+    return _active
+
+def setActive(prefetcher):
+    '''Make prefetcher (or None) the active Prefetcher; returns the one that
+    was active before.
+    '''
+    global _active
+    previous = _active
+    _active = prefetcher
+    return previous
+
+def readFile(fpath):
+    '''Read a whole file (or archive member) as bytes, without
+    decompressing it.
+    '''
+    with archives.openRaw(fpath) as stream:
+        return stream.read()
+
+class Prefetcher:
+    '''Reads the files in fpaths ahead of their use, in order.
+
+    Parameters:
+        fpaths      :: ordered list of file paths that will be read
+        window      :: number of files to read ahead of the current one
+                       (0 reads each file only when requested)
+        max_bytes   :: stop reading ahead while this many bytes are
+                       buffered (reads already in flight may overshoot it)
+        num_threads :: number of reading threads
+        reader      :: function reading a file path to bytes
+        preloaded   :: (optional) dict of file path -> bytes for files
+                       that are already in memory (e.g., archive members)
+
+    Requesting a file (with get) releases all files before it in the list.
+    '''
+    def __init__(self, fpaths, window=8, max_bytes=DEFAULT_MAX_BYTES, num_threads=4, reader=readFile,
+            preloaded=None):
+        self.fpaths = list(fpaths)
+        self.window = window
+        self.max_bytes = max_bytes
+        self.reader = reader
+        self._positions = {}
+        for (i, fpath) in enumerate(self.fpaths):
+            if not fpath in self._positions: self._positions[fpath] = i
+        self._lock = threading.Lock()
+        self._futures = {}          # list position -> Future of file bytes
+        self._sizes = {}            # list position -> size of completed read
+        self._buffered_bytes = 0
+        self._next = 0              # next list position to read
+        self._current = 0           # list position of the file in use
+        self._previous = None
+        if preloaded != None:
+            for (fpath, data) in preloaded.items():
+                if fpath in self._positions:
+                    future = Future()
+                    future.set_result(data)
+                    self._futures[self._positions[fpath]] = future
+        if window > 0:
+            self._executor = ThreadPoolExecutor(max_workers=max(1, num_threads))
+            with self._lock: started = self._fill()
+            self._watch(started)
+        else:
+            self._executor = None
+
+    def get(self, fpath):
+        '''Return the bytes of fpath (waiting for its read to finish), or
+        None if fpath is not one of this Prefetcher's files.
+        '''
+        i = self._positions.get(fpath, None)
+        if i is None: return None
+        with self._lock:
+            # release everything before the requested file
+            for j in [j for j in self._futures if j < i]:
+                self._futures.pop(j)
+                self._buffered_bytes -= self._sizes.pop(j, 0)
+            self._current = i
+            self._next = max(self._next, i)
+            started = self._fill()
+            future = self._futures.get(i, None)
+        self._watch(started)
+        if future is None:
+            return self.reader(fpath)
+        return future.result()
+
+    def close(self):
+        '''Stop reading ahead, and drop all buffered files (files requested
+        afterwards are read directly).  Reads in flight are not waited for.
+        '''
+        with self._lock:
+            (executor, self._executor) = (self._executor, None)
+            self._futures, self._sizes = {}, {}
+            self._buffered_bytes = 0
+        if executor != None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def __enter__(self):
+        self._previous = setActive(self)
+        return self
+
+    def __exit__(self, *args):
+        setActive(self._previous)
+        self.close()
+
+    def _fill(self):
+        '''Start reads up to the window and byte budget (lock held);
+        returns the [(list position, Future)] started, which must be
+        passed to _watch once the lock is released.
+        '''
+        started = []
+        if self._executor is None: return started
+        while self._next < len(self.fpaths) \
+                and self._next <= self._current + self.window \
+                and self._buffered_bytes < self.max_bytes:
+            i = self._next
+            self._next += 1
+            if i in self._futures: continue     # preloaded
+            future = self._executor.submit(self.reader, self.fpaths[i])
+            self._futures[i] = future
+            started.append((i, future))
+        return started
+
+    def _watch(self, started):
+        '''Track the size of started reads as they finish (lock not held:
+        a read that has already finished runs its callback immediately,
+        in this thread).
+        '''
+        for (i, future) in started:
+            future.add_done_callback(lambda future, i=i: self._onRead(i, future))
+
+    def _onRead(self, i, future):
+        if future.cancelled() or future.exception() != None: return
+        with self._lock:
+            if not i in self._futures: return   # already released
+            self._sizes[i] = len(future.result())
+            self._buffered_bytes += self._sizes[i]
+            started = self._fill()
+        self._watch(started)
@@ -0,0 +1,96 @@
+'''
+Builds (or adds to) a CUI inverted index over a corpus of cTAKES output
+files (XMI or CAS), or queries an existing one.
+
+Indexing:  buildIndex.py [--incremental] INDEXDIR PATH [PATH ...]
+Querying:  buildIndex.py -q CUI[,CUI] [-w WINDOW] INDEXDIR
+
+A single query CUI lists its postings and document frequency; two
+comma-separated CUIs list their co-occurrences within WINDOW characters.
+
+With --incremental, the index is kept in step with PATHs: only files
+added or changed since the last incremental run are indexed, and files
+that are gone are removed from the index.
+
+With --shard i/N, only the files assigned to shard i of N are indexed
+(see ctakes.shards), and the index is described as a shard for
+mergeShards.py.
+'''
+
+import sys
+from ctakes import corpus, archives, shards
+from ctakes.index import CUIIndex
+
+if __name__ == '__main__':
+    def _cli():
+        import optparse
+        parser = optparse.OptionParser(usage='Usage: %prog [options] INDEXDIR [PATH ...]')
+        parser.add_option('-l', '--file-list', dest='file_list',
+                help='file containing paths to index, one per line')
+        parser.add_option('-f', '--format', dest='format', choices=list(corpus.FORMATS.keys()),
+                help='input format (XMI or CAS); default is guessed from each file extension')
+        parser.add_option('-n', '--num-workers', dest='num_workers', type='int', default=None,
+                help='number of worker processes; default is the number of CPUs')
+        parser.add_option('-i', '--incremental', dest='incremental', action='store_true', default=False,
+                help='index only files added or changed since the last incremental run, and'
+                     ' remove files that are gone')
+        parser.add_option('--shard', dest='shard',
+                help='index only shard i/N (0 <= i < N) of the files, for merging with mergeShards.py')
+        parser.add_option('--shard-key', dest='shard_key', choices=list(shards.SHARD_KEYS), default='name',
+                help='assign files to shards by file name or DocumentID; default %default')
+        parser.add_option('--compact', dest='compact', action='store_true', default=False,
+                help='merge all index segments into one after indexing')
+        parser.add_option('-q', '--query', dest='query',
+                help='CUI (or two comma-separated CUIs) to query')
+        parser.add_option('-w', '--window', dest='window', type='int', default=0,
+                help='co-occurrence window, in characters; default %default')
+        (options, args) = parser.parse_args()
+        if len(args) < 1:
+            parser.print_help()
+            exit()
+        if options.shard != None:
+            try: options.shard = shards.parseShard(options.shard)
+            except ValueError as e: parser.error(str(e))
+        return options, args[0], args[1:]
+
+    options, indexdir, paths = _cli()
+    index = CUIIndex(indexdir)
+
+    if options.query:
+        CUIs = options.query.split(',')
+        if len(CUIs) == 1:
+            for (path, begin, end, mention_type) in index.postings(CUIs[0]):
+                print('%s\t%d\t%d\t%s' % (path, begin, end, mention_type))
+            print('Document frequency: %d/%d' % (index.documentFrequency(CUIs[0]), len(index)))
+        else:
+            for (path, (a_begin, a_end), (b_begin, b_end)) in index.cooccurrences(CUIs[0], CUIs[1], window=options.window):
+                print('%s\t%d\t%d\t%d\t%d' % (path, a_begin, a_end, b_begin, b_end))
+        exit()
+
+    fpaths = corpus.gatherFiles(paths, options.file_list)
+    if options.shard != None:
+        (shard, num_shards) = options.shard
+        fpaths = shards.selectShard(fpaths, shard, num_shards, key=options.shard_key, format=options.format)
+
+    print("Indexing %d files..." % len(fpaths))
+    # archives expand to an unknown number of documents (and with
+    # --incremental, only some files are indexed)
+    if options.incremental or any([archives.isArchive(fpath) for fpath in fpaths]): total = None
+    else: total = len(fpaths)
+    progress = corpus.Progress(total=total, stream=sys.stderr)
+    if options.incremental:
+        (changes, errors) = index.updateFiles(fpaths, format=options.format, num_workers=options.num_workers,
+            progress=progress)
+        print("Files since last run: %s." % changes.summary())
+    else:
+        errors = index.addFiles(fpaths, format=options.format, num_workers=options.num_workers, progress=progress)
+    for result in errors:
+        print("[ERROR] Could not parse %s" % result.path)
+    if options.compact:
+        index.compact()
+    print("Indexed %d files (%d errors); index at %s holds %d documents." % (
+        progress.docs, len(errors), indexdir, len(index)))
+
+    if options.shard != None:
+        shards.writeIndexInfo(indexdir, shard, num_shards, options.shard_key, { 'format': options.format }, fpaths)
+        print("Shard %d/%d described in %s." % (shard, num_shards, indexdir))
@@ -0,0 +1,161 @@
+'''
+Adds newlines to cTAKES XMI (or CAS) output files, to make them more readable.
+
+XMI files are, by default, written out as a single line.  This script adds
+a newline after each self-closing tag (as bash/clean-xmi does), streaming
+each file in fixed-size chunks so that memory use does not grow with the
+size of the file.  Output is written to a temporary file and moved into
+place only once complete, so an interrupted run never leaves a partial
+file behind (or a damaged original, when editing in place); it keeps the
+permissions of the input file.
+
+Compressed input (e.g. note.xmi.gz) is decompressed as it is read, and
+output is compressed according to its own extension, so in-place cleaning
+keeps a file compressed; by default, note.xmi.gz is cleaned to
+note.xmi.clean.gz.
+
+Given a directory, all files in it with a matching extension are cleaned
+in parallel worker processes.
+
+Newlines are not added after "/>" inside (double-quoted) attribute values,
+or where a newline is already present, so cleaning is idempotent.
+'''
+
+import os
+import sys
+import functools
+from ctakes import corpus, archives, files
+from ctakes.format.common import openSource
+
+CHUNK_SIZE = 1024 * 1024
+
+def cleanStream(instream, outstream, chunk_size=CHUNK_SIZE):
+    '''Copy a binary XML stream to outstream, adding a newline after each
+    self-closing tag.  Reads at most chunk_size bytes at a time.
+    '''
+    carry, in_quote = b'', False
+    while True:
+        chunk = instream.read(chunk_size)
+        if not chunk:
+            break
+        data = carry + chunk
+        # hold back a tag end split across (or just before) the chunk
+        # boundary, until the following byte is known
+        if data.endswith(b'/'): hold = 1
+        elif data.endswith(b'/>'): hold = 2
+        else: hold = 0
+        carry = data[len(data)-hold:]
+        (cleaned, in_quote) = _cleanChunk(data, len(data) - hold, in_quote)
+        outstream.write(cleaned)
+    if carry:
+        (cleaned, _) = _cleanChunk(carry, len(carry), in_quote)
+        outstream.write(cleaned)
+
+def _cleanChunk(data, stop, in_quote):
+    '''Add newlines after the self-closing tags in data[:stop] (data[stop:]
+    is only used to look ahead).  Returns the cleaned bytes and whether
+    stop falls inside a quoted attribute value.
+    '''
+    pieces = []
+    prev, counted = 0, 0
+    pos = data.find(b'/>', 0, stop)
+    while pos != -1:
+        # quote parity since the last tag end tells if this one is quoted
+        if data.count(b'"', counted, pos) % 2 == 1: in_quote = not in_quote
+        counted = pos
+        pos += 2
+        if not in_quote and data[pos:pos+1] not in (b'\n', b'\r'):
+            pieces.append(data[prev:pos])
+            pieces.append(b'\n')
+            prev = pos
+        pos = data.find(b'/>', pos, stop)
+    if data.count(b'"', counted, stop) % 2 == 1: in_quote = not in_quote
+    pieces.append(data[prev:stop])
+    return b''.join(pieces), in_quote
+
+def cleanFile(fpath, outfile=None, chunk_size=CHUNK_SIZE):
+    '''Clean fpath, writing the output atomically to outfile (default:
+    see cleanPath; use outfile=fpath to clean in place), compressed if
+    outfile has a compression extension.  Returns the output path.
+    '''
+    if outfile is None: outfile = cleanPath(fpath)
+    outdir = os.path.dirname(os.path.abspath(outfile))
+    if not os.path.isdir(outdir): os.makedirs(outdir, exist_ok=True)
+    with files.atomicWrite(outfile, copy_mode_from=archives.splitMember(fpath)[0]) as rawstream, \
+            archives.compress(rawstream, outfile) as outstream, openSource(fpath) as instream:
+        cleanStream(instream, outstream, chunk_size=chunk_size)
+    return outfile
+
+def cleanPath(fpath):
+    '''Return the default output path for cleaning fpath: {fpath}.clean,
+    ahead of any compression extension (note.xmi.gz -> note.xmi.clean.gz).
+    '''
+    (root, ext) = os.path.splitext(fpath)
+    if ext.lower() in archives.COMPRESSION_EXTENSIONS: return '%s.clean%s' % (root, ext)
+    return '%s.clean' % fpath
+
+def _outputPath(fpath, indir, outdir=None, inplace=False):
+    '''Return where the cleaned version of fpath (found under indir) goes.
+    '''
+    if inplace: return fpath
+    if outdir is None: return cleanPath(fpath)
+    return os.path.join(outdir, os.path.relpath(fpath, indir))
+
+def _cleanInto(fpath, indir=None, outdir=None, inplace=False, chunk_size=CHUNK_SIZE):
+    return cleanFile(fpath, _outputPath(fpath, indir, outdir=outdir, inplace=inplace), chunk_size=chunk_size)
+
+def cleanDirectory(indir, outdir=None, inplace=False, extensions=('.xmi',),
+        num_workers=None, chunk_size=CHUNK_SIZE, progress=None):
+    '''Clean all files under indir with one of the given extensions, in
+    parallel; each goes to the same relative path under outdir, or is
+    edited in place, or (by default) is saved alongside (see cleanPath).
+
+    Yields a corpus.FileResult (whose value is the output path) per file,
+    in sorted path order.
+    '''
+    fpaths = corpus.listFiles([indir], extensions=set(extensions), compressed=False)
+    process = functools.partial(_cleanInto, indir=indir, outdir=outdir,
+        inplace=inplace, chunk_size=chunk_size)
+    return corpus.processCorpus(fpaths, process=process, num_workers=num_workers,
+        progress=progress)
+
+if __name__ == '__main__':
+    def _cli():
+        import optparse
+        parser = optparse.OptionParser(usage='Usage: %prog [options] XMIFILE|XMIDIR')
+        parser.add_option('-i', '--in-place', dest='inplace', action='store_true', default=False,
+                help='edit files in place')
+        parser.add_option('-o', '--output', dest='output',
+                help='save output to OUTPUT (a file, or for a directory input, a directory);'
+                     ' default is {XMIFILE}.clean (ahead of any compression extension)')
+        parser.add_option('-e', '--extensions', dest='extensions', default='.xmi',
+                help='comma-separated file extensions to clean in a directory; default %default')
+        parser.add_option('-n', '--num-workers', dest='num_workers', type='int', default=None,
+                help='number of worker processes for a directory; default is the number of CPUs')
+        parser.add_option('-b', '--chunk-bytes', dest='chunk_size', type='int', default=CHUNK_SIZE,
+                help='number of bytes to read at a time; default %default')
+        parser.add_option('-q', '--quiet', dest='quiet', action='store_true', default=False,
+                help='do not report progress')
+        (options, args) = parser.parse_args()
+        if len(args) != 1 or (options.inplace and options.output):
+            parser.print_help()
+            exit()
+        return options, args[0]
+
+    options, inpath = _cli()
+
+    if os.path.isdir(inpath):
+        extensions = [ext if ext.startswith('.') else '.%s' % ext for ext in options.extensions.split(',')]
+        progress = corpus.Progress(stream=None if options.quiet else sys.stderr)
+        errors = 0
+        for result in cleanDirectory(inpath, outdir=options.output, inplace=options.inplace,
+                extensions=extensions, num_workers=options.num_workers,
+                chunk_size=options.chunk_size, progress=progress):
+            if result.error != None:
+                errors += 1
+                print("[ERROR] Could not clean %s:\n%s" % (result.path, result.error))
+        print("Cleaned %d files (%d errors) in %.1f seconds." % (progress.docs, errors, progress.elapsed()))
+    else:
+        outfile = inpath if options.inplace else options.output
+        outfile = cleanFile(inpath, outfile, chunk_size=options.chunk_size)
+        print("Cleaned output saved to %s." % outfile)
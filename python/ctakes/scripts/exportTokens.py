@@ -0,0 +1,59 @@
+'''
+Exports a corpus of cTAKES output files (XMI or CAS) as an integer-encoded
+token stream for embedding training: sharded binary arrays of sentences
+in which mentions are replaced by their CUIs, with a shared vocabulary of
+tokens and CUIs.  See ctakes.tokenstream for the output layout.
+'''
+
+import sys
+from ctakes import corpus, archives, tokenstream
+
+if __name__ == '__main__':
+    def _cli():
+        import optparse
+        parser = optparse.OptionParser(usage='Usage: %prog [options] OUTDIR [PATH ...]')
+        parser.add_option('-l', '--file-list', dest='file_list',
+                help='file containing paths to export, one per line')
+        parser.add_option('-f', '--format', dest='format', choices=list(corpus.FORMATS.keys()),
+                help='input format (XMI or CAS); default is guessed from each file extension')
+        parser.add_option('--overlaps', dest='overlaps', choices=list(tokenstream.OVERLAP_POLICIES),
+                default='first', help='policy for overlapping mentions (%s); default %%default' % (
+                    ', '.join(tokenstream.OVERLAP_POLICIES)))
+        parser.add_option('--cuis', dest='cuis', choices=list(tokenstream.CUI_POLICIES),
+                default='first', help='CUIs to write for each mention (%s); default %%default' % (
+                    ', '.join(tokenstream.CUI_POLICIES)))
+        parser.add_option('--words-only', dest='words_only', action='store_true', default=False,
+                help='skip symbol and punctuation tokens')
+        parser.add_option('--lowercase', dest='lowercase', action='store_true', default=False,
+                help='lowercase surface tokens')
+        parser.add_option('--shard-tokens', dest='shard_tokens', type='int',
+                default=tokenstream.DEFAULT_SHARD_TOKENS,
+                help='approximate number of token IDs per shard; default %default')
+        parser.add_option('-n', '--num-workers', dest='num_workers', type='int', default=None,
+                help='number of worker processes; default is the number of CPUs')
+        parser.add_option('-q', '--quiet', dest='quiet', action='store_true', default=False,
+                help='do not report progress')
+        (options, args) = parser.parse_args()
+        if len(args) < 1 or (len(args) == 1 and options.file_list is None):
+            parser.print_help()
+            exit()
+        return options, args[0], args[1:]
+
+    options, outdir, paths = _cli()
+
+    fpaths = corpus.gatherFiles(paths, options.file_list)
+
+    print("Exporting %d files..." % len(fpaths))
+    # archives expand to an unknown number of documents
+    total = None if any([archives.isArchive(fpath) for fpath in fpaths]) else len(fpaths)
+    progress = corpus.Progress(total=total, stream=None if options.quiet else sys.stderr)
+    errors = tokenstream.exportCorpus(fpaths, outdir, format=options.format,
+        overlaps=options.overlaps, cuis=options.cuis, words_only=options.words_only,
+        lowercase=options.lowercase, shard_tokens=options.shard_tokens,
+        num_workers=options.num_workers, progress=progress)
+    for result in errors:
+        print("[ERROR] Could not parse %s" % result.path)
+
+    stream = tokenstream.TokenStream(outdir)
+    print("Exported %d sentences (%d token IDs, vocabulary of %d) from %d files (%d errors) to %s." % (
+        len(stream), stream.num_tokens, len(stream.vocabulary), progress.docs, len(errors), outdir))
@@ -0,0 +1,35 @@
+'''
+Merges the shard outputs of processCorpus.py --shard or buildIndex.py
+--shard (see ctakes.shards) into a single output, after checking that
+all N shards are present, were made with the same settings, and match
+their checksums.  The merged output is the same whatever the number of
+shards, and can be given CUI counts (mentions and documents per CUI).
+
+Results:  mergeShards.py results MERGEDFILE SHARDFILE [SHARDFILE ...]
+Indexes:  mergeShards.py index MERGEDDIR SHARDDIR [SHARDDIR ...]
+'''
+
+from ctakes import shards
+
+if __name__ == '__main__':
+    def _cli():
+        import optparse
+        parser = optparse.OptionParser(usage='Usage: %prog [options] {results|index} OUTPUT SHARD [SHARD ...]')
+        parser.add_option('-c', '--cui-counts', dest='cui_counts',
+                help='also write the mention and document counts of each CUI to this file')
+        (options, args) = parser.parse_args()
+        if len(args) < 3 or not args[0] in ('results', 'index'):
+            parser.print_help()
+            exit()
+        return options, args[0], args[1], args[2:]
+
+    options, kind, output, shard_paths = _cli()
+
+    print("Merging %d shards..." % len(shard_paths))
+    if kind == 'results':
+        counts = shards.mergeResults(shard_paths, output, cui_counts_path=options.cui_counts)
+    else:
+        counts = shards.mergeIndexes(shard_paths, output, cui_counts_path=options.cui_counts)
+    print("Merged %d shards to %s (%d distinct CUIs)." % (len(shard_paths), output, len(counts)))
+    if options.cui_counts != None:
+        print("CUI counts saved to %s." % options.cui_counts)
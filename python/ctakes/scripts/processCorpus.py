@@ -0,0 +1,121 @@
+'''
+Parses a corpus of cTAKES output files (XMI or CAS) in parallel, writing
+the mentions (and optionally tokens) of each file to a JSONL or pickle file.
+
+Results are written in sorted file order; files that fail to parse are
+recorded with their error rather than stopping the run.
+
+With --incremental, an existing OUTFILE is updated in place: only files
+added or changed since the last run are parsed, and results of removed
+files are dropped (see ctakes.manifest).
+
+With --shard i/N, only the files assigned to shard i of N are processed
+(see ctakes.shards), and OUTFILE is described as a shard for
+mergeShards.py.
+'''
+
+import sys
+import json
+import functools
+from ctakes import corpus, archives, shards
+from ctakes.format import stats, common
+
+if __name__ == '__main__':
+    def _cli():
+        import optparse
+        parser = optparse.OptionParser(usage='Usage: %prog [options] OUTFILE [PATH ...]')
+        parser.add_option('-l', '--file-list', dest='file_list',
+                help='file containing paths to process, one per line')
+        parser.add_option('-f', '--format', dest='format', choices=list(corpus.FORMATS.keys()),
+                help='input format (XMI or CAS); default is guessed from each file extension')
+        parser.add_option('-o', '--output-format', dest='output_format', choices=['jsonl', 'pickle'],
+                default='jsonl', help='output format (jsonl or pickle); default %default')
+        parser.add_option('-t', '--tokens', dest='tokens', action='store_true', default=False,
+                help='include tokens (with mentions) in the output')
+        parser.add_option('--pos', dest='get_POS_tags', action='store_true', default=False,
+                help='include POS tags with tokens')
+        parser.add_option('--words-only', dest='words_only', action='store_true', default=False,
+                help='skip symbol and punctuation tokens')
+        parser.add_option('--by-sentence', dest='by_sentence', action='store_true', default=False,
+                help='group tokens by sentence')
+        parser.add_option('--overlaps', dest='overlaps', choices=list(common.OVERLAP_POLICIES),
+                default='all', help='policy for overlapping mentions in tokens (%s); default %%default' % (
+                    ', '.join(common.OVERLAP_POLICIES)))
+        parser.add_option('-n', '--num-workers', dest='num_workers', type='int', default=None,
+                help='number of worker processes; default is the number of CPUs')
+        parser.add_option('-c', '--chunk-size', dest='chunk_size', type='int', default=16,
+                help='number of files sent to a worker at a time; default %default')
+        parser.add_option('-r', '--read-ahead', dest='read_ahead', type='int', default=0,
+                help='number of files each worker reads ahead of parsing, in background'
+                     ' threads (useful on slow or networked filesystems); default %default')
+        parser.add_option('--read-ahead-mb', dest='read_ahead_mb', type='float', default=256,
+                help='limit on MB each worker buffers ahead; default %default')
+        parser.add_option('-i', '--incremental', dest='incremental', action='store_true', default=False,
+                help='update OUTFILE, reprocessing only added and changed files')
+        parser.add_option('--manifest', dest='manifest',
+                help='manifest file for --incremental; default OUTFILE.manifest.json')
+        parser.add_option('--shard', dest='shard',
+                help='process only shard i/N (0 <= i < N) of the files, for merging with mergeShards.py')
+        parser.add_option('--shard-key', dest='shard_key', choices=list(shards.SHARD_KEYS), default='name',
+                help='assign files to shards by file name or DocumentID; default %default')
+        parser.add_option('-s', '--stats', dest='stats_file',
+                help='write per-stage parsing stats (as JSON) to this file')
+        parser.add_option('-q', '--quiet', dest='quiet', action='store_true', default=False,
+                help='do not report progress')
+        (options, args) = parser.parse_args()
+        if len(args) < 1 or (len(args) == 1 and options.file_list is None):
+            parser.print_help()
+            exit()
+        if options.shard != None:
+            try: options.shard = shards.parseShard(options.shard)
+            except ValueError as e: parser.error(str(e))
+        return options, args[0], args[1:]
+
+    options, outfile, paths = _cli()
+
+    fpaths = corpus.gatherFiles(paths, options.file_list)
+    if options.shard != None:
+        (shard, num_shards) = options.shard
+        fpaths = shards.selectShard(fpaths, shard, num_shards, key=options.shard_key, format=options.format)
+
+    process = functools.partial(corpus.parseFile, format=options.format, tokens=options.tokens,
+        get_POS_tags=options.get_POS_tags, words_only=options.words_only, by_sentence=options.by_sentence,
+        overlaps=options.overlaps)
+    # archives expand to an unknown number of documents (and with
+    # --incremental, only some files are processed)
+    if options.incremental or any([archives.isArchive(fpath) for fpath in fpaths]): total = None
+    else: total = len(fpaths)
+    progress = corpus.Progress(total=total, stream=None if options.quiet else sys.stderr)
+    parse_stats = stats.ParseStats() if options.stats_file != None else None
+    process_options = dict(num_workers=options.num_workers, chunk_size=options.chunk_size,
+        progress=progress, stats=parse_stats, read_ahead=options.read_ahead,
+        read_ahead_bytes=int(options.read_ahead_mb * 1024 * 1024))
+
+    settings = { 'format': options.format, 'tokens': options.tokens, 'get_POS_tags': options.get_POS_tags,
+        'words_only': options.words_only, 'by_sentence': options.by_sentence, 'overlaps': options.overlaps }
+
+    print("Processing %d files..." % len(fpaths))
+    if options.incremental:
+        changes = corpus.updateOutput(fpaths, outfile, output_format=options.output_format,
+            manifest_path=options.manifest, settings=settings, process=process, **process_options)
+        print("Files since last run: %s." % changes.summary())
+    elif options.output_format == 'jsonl':
+        with open(outfile, 'w') as outf:
+            corpus.writeJSONL(corpus.processCorpus(fpaths, process=process, **process_options), outf)
+    else:
+        with open(outfile, 'wb') as outf:
+            corpus.writePickle(corpus.processCorpus(fpaths, process=process, **process_options), outf)
+
+    print("Processed %d files (%d errors) in %.1f seconds; output saved to %s." % (
+        progress.docs, progress.errors, progress.elapsed(), outfile))
+
+    if options.shard != None:
+        settings['output_format'] = options.output_format
+        shards.writeResultsInfo(outfile, shard, num_shards, options.shard_key, settings, fpaths)
+        print("Shard %d/%d described in %s." % (shard, num_shards, outfile + shards.RESULTS_INFO_SUFFIX))
+
+    if parse_stats != None:
+        with open(options.stats_file, 'w') as outf:
+            json.dump(parse_stats.asDict(), outf, indent=2, sort_keys=True)
+        if not options.quiet: print(parse_stats.report())
+        print("Parsing stats saved to %s." % options.stats_file)
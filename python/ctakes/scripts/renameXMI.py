@@ -2,32 +2,93 @@
 Renames cTAKES XMI output files (named like doc%d.xmi) to use the original document name.
 
 E.g. Plaintext abc.txt -> cTAKES doc0.xmi -> renamed abc.xmi
+
+DocumentIDs are read in parallel, and name collisions are detected across the
+whole directory before any file is renamed.  With --dry-run, no files are
+renamed; the planned renames are only reported (and written to the manifest,
+if one is given).
 '''
 
 import os
+from ctakes import corpus
 from ctakes.format import XMI
 
+RENAME = 'rename'
+UNCHANGED = 'unchanged'
+COLLISION = 'collision'
+ERROR = 'error'
+
+def planRenames(xmidir, num_workers=None, chunk_size=64):
+    '''Return the list of (path, new_path, status) renames for the XMI files
+    in xmidir, in sorted path order.
+
+    A file is marked as a collision if its new name already exists on disk,
+    or if an earlier file in the batch is being renamed to the same name.
+    '''
+    fpaths = sorted([
+        os.path.join(xmidir, f) for f in os.listdir(xmidir)
+            if os.path.splitext(f)[1] == '.xmi'
+    ])
+    results = corpus.processCorpus(fpaths, process=XMI.getDocumentID,
+        num_workers=num_workers, chunk_size=chunk_size)
+
+    plan, claimed = [], set()
+    for result in results:
+        path = result.path
+        if result.error != None:
+            plan.append((path, None, ERROR))
+            continue
+        new_path = os.path.join(xmidir, '%s.xmi' % os.path.splitext(result.value)[0])
+        if path == new_path:
+            status = UNCHANGED
+        elif new_path in claimed or os.path.exists(new_path):
+            status = COLLISION
+        else:
+            status = RENAME
+        claimed.add(new_path)
+        plan.append((path, new_path, status))
+    return plan
+
+def writeManifest(plan, manifestf):
+    '''Write a rename plan as tab-separated (path, new path, status) lines.
+    '''
+    with open(manifestf, 'w') as stream:
+        for (path, new_path, status) in plan:
+            stream.write('%s\t%s\t%s\n' % (path, new_path if new_path != None else '', status))
+
 if __name__ == '__main__':
     def _cli():
         import optparse
-        parser = optparse.OptionParser(usage='Usage: %prog XMIDIR')
+        parser = optparse.OptionParser(usage='Usage: %prog [options] XMIDIR')
+        parser.add_option('-n', '--dry-run', dest='dry_run', action='store_true', default=False,
+                help='report planned renames without renaming any files')
+        parser.add_option('-m', '--manifest', dest='manifest',
+                help='write the planned renames (path, new path, status) to MANIFEST')
+        parser.add_option('-w', '--num-workers', dest='num_workers', type='int', default=None,
+                help='number of worker processes; default is the number of CPUs')
         (options, args) = parser.parse_args()
         if len(args) != 1:
             parser.print_help()
             exit()
         (xmidir,) = args
-        return xmidir
+        return options, xmidir
+
+    options, xmidir = _cli()
 
-    xmidir = _cli()
+    print("Reading DocumentIDs in %s..." % xmidir)
+    plan = planRenames(xmidir, num_workers=options.num_workers)
+    if options.manifest:
+        writeManifest(plan, options.manifest)
+        print("Rename manifest saved to %s." % options.manifest)
 
-    print("Renaming files in %s..." % xmidir)
-    for f in os.listdir(xmidir):
-        if os.path.splitext(f)[1] == '.xmi':
-            path = os.path.join(xmidir, f)
-            docID = XMI.getDocumentID(path)
-            new_path = os.path.join(xmidir, '%s.xmi' % os.path.splitext(docID)[0])
-            if not os.path.isfile(new_path):
+    for (path, new_path, status) in plan:
+        if status == RENAME:
+            if not options.dry_run:
                 os.rename(path, new_path)
                 print("  >> Renamed %s to %s" % (path, new_path))
-            elif path != new_path:
-                print("[NAME COLLISION] File %s already exists (skipping %s)" % (new_path, path))
+            else:
+                print("  >> Would rename %s to %s" % (path, new_path))
+        elif status == COLLISION:
+            print("[NAME COLLISION] File %s already exists (skipping %s)" % (new_path, path))
+        elif status == ERROR:
+            print("[ERROR] Could not read DocumentID from %s (skipping)" % path)
@@ -0,0 +1,278 @@
+'''
+Deterministic sharding of corpus processing across independent jobs
+(e.g. cluster nodes), and merging of their outputs.
+
+Files are assigned to shard i of N (0 <= i < N) by a stable hash of
+their name (without any directory, so nodes may mount the corpus at
+different paths) or of their DocumentID, so every job can select its own
+files from the same file list without coordination.  Archives are
+assigned whole, by the archive's name.
+
+Each shard's output is written with a shard description: a JSON file
+recording the shard, the processing settings, the files assigned to it
+and a SHA-256 checksum of every output file.  The merge functions check
+that they are given one complete, consistent set of shards with intact
+outputs, then combine them in canonical order (by source file path), so
+the merged result is the same whatever the number of shards.
+
+Usage (on node i of N):
+    processCorpus.py --shard i/N out.i.jsonl /data/xmi
+    buildIndex.py --shard i/N index.i /data/xmi
+then:
+    mergeShards.py results merged.jsonl out.*.jsonl
+    mergeShards.py index merged-index index.*
+'''
+
+import os
+import json
+import heapq
+import pickle
+import hashlib
+from .files import atomicWrite, writeJSON
+from . import corpus
+from . import archives
+from .index import CUIIndex
+
+SHARD_VERSION = 1
+SHARD_KEYS = ('name', 'document_id')
+RESULTS_INFO_SUFFIX = '.shard.json'
+INDEX_INFO_NAME = 'shard.json'
+
+_block_size = 1024 * 1024
+
+### Assigning files #####################
+
+def parseShard(spec):
+    '''Parse a shard specification "i/N" (0 <= i < N) into (i, N).
+    '''
+    try:
+        (shard, num_shards) = [int(part) for part in spec.split('/')]
+    except ValueError:
+        raise ValueError("Shard must be given as i/N, not '%s'" % spec)
+    if num_shards < 1 or shard < 0 or shard >= num_shards:
+        raise ValueError("Shard %d/%d is out of range (0 <= i < N)" % (shard, num_shards))
+    return (shard, num_shards)
+
+def shardKey(fpath, key='name', format=None):
+    '''Return the string that assigns fpath to a shard: its file name (the
+    member name, for an archive member), or with key='document_id' its
+    DocumentID (falling back to the file name for archives and files
+    without one).
+    '''
+    if not key in SHARD_KEYS:
+        raise ValueError("Unknown shard key '%s'" % key)
+    (archive_path, member) = archives.splitMember(fpath)
+    name = os.path.basename(member if member != None else archive_path)
+    if key == 'document_id' and not archives.isArchive(fpath):
+        try:
+            return corpus.getFormat(fpath, format).getDocumentID(fpath)
+        except KeyError:
+            pass
+    return name
+
+def shardOf(key_string, num_shards):
+    '''Return the shard (0 to num_shards-1) of a shard key string; stable
+    across machines and Python runs.
+    '''
+    digest = hashlib.sha1(key_string.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % num_shards
+
+def selectShard(fpaths, shard, num_shards, key='name', format=None):
+    '''Return the sorted, distinct paths in fpaths assigned to shard (of
+    num_shards).
+    '''
+    return [
+        fpath for fpath in sorted(set(fpaths))
+            if shardOf(shardKey(fpath, key=key, format=format), num_shards) == shard
+    ]
+
+
+### Shard descriptions ##################
+
+def checksum(fpath):
+    '''Return the SHA-256 hex digest of a file.
+    '''
+    digest = hashlib.sha256()
+    with open(fpath, 'rb') as stream:
+        while True:
+            block = stream.read(_block_size)
+            if not block: break
+            digest.update(block)
+    return digest.hexdigest()
+
+def writeInfo(info_path, kind, shard, num_shards, key, settings, files, outputs):
+    '''Write the description of a shard output of the given kind
+    ('results' or 'index'), with checksums of the output files (paths
+    are recorded relative to the description's directory).
+    '''
+    directory = os.path.dirname(os.path.abspath(info_path))
+    info = {
+        'version': SHARD_VERSION,
+        'kind': kind,
+        'shard': shard,
+        'num_shards': num_shards,
+        'key': key,
+        'settings': settings,
+        'files': sorted(files),
+        'checksums': {
+            os.path.relpath(os.path.abspath(output), directory): checksum(output)
+                for output in sorted(outputs)
+        },
+    }
+    writeJSON(info_path, info, indent=2, sort_keys=True)
+    return info
+
+def readInfo(info_path, verify=True):
+    '''Read a shard description; if verify, check that every output file
+    it lists is present and matches its checksum (raising IOError if not).
+    '''
+    with open(info_path, 'r') as stream:
+        info = json.load(stream)
+    if info.get('version') != SHARD_VERSION:
+        raise ValueError('%s: unsupported shard description version %s' % (info_path, info.get('version')))
+    if verify:
+        directory = os.path.dirname(os.path.abspath(info_path))
+        for (relpath, digest) in info['checksums'].items():
+            output = os.path.join(directory, relpath)
+            if not os.path.isfile(output):
+                raise IOError('%s: output file %s is missing' % (info_path, output))
+            if checksum(output) != digest:
+                raise IOError('%s: checksum mismatch for %s' % (info_path, output))
+    return info
+
+def checkShards(infos, kind):
+    '''Check that shard descriptions are one complete set of shards of
+    the same kind, key and settings (raising ValueError if not).
+    '''
+    if len(infos) == 0:
+        raise ValueError('No shards to merge')
+    first = infos[0]
+    for info in infos:
+        for field in ('kind', 'num_shards', 'key', 'settings'):
+            if info[field] != first[field]:
+                raise ValueError("Shards differ in %s: %r vs. %r" % (field, first[field], info[field]))
+    if first['kind'] != kind:
+        raise ValueError("Expected %s shards, got %s shards" % (kind, first['kind']))
+    shards = sorted([info['shard'] for info in infos])
+    if shards != list(range(first['num_shards'])):
+        missing = sorted(set(range(first['num_shards'])) - set(shards))
+        raise ValueError('Expected shards 0-%d exactly once; missing %s, given %s' % (
+            first['num_shards'] - 1, missing, shards))
+
+
+### Results (processCorpus.py output) ###
+
+def writeResultsInfo(outfile, shard, num_shards, key, settings, files):
+    '''Describe outfile (written by writeJSONL or writePickle; settings
+    must include its 'output_format') as a shard.
+    '''
+    return writeInfo(outfile + RESULTS_INFO_SUFFIX, 'results', shard, num_shards, key, settings, files, [outfile])
+
+def mergeResults(outfiles, merged_path, cui_counts_path=None):
+    '''Merge shard outputs of processCorpus.py (each with its shard
+    description) into merged_path, with results in order of source file
+    path; results are copied byte for byte.  The merged output is itself
+    described as the single shard 0/1.
+
+    If cui_counts_path is given, also write the number of mentions and of
+    documents of each CUI there (see writeCUICounts).
+    '''
+    infos = [readInfo(outfile + RESULTS_INFO_SUFFIX) for outfile in outfiles]
+    checkShards(infos, 'results')
+    output_format = infos[0]['settings']['output_format']
+    counts = {}
+
+    records = heapq.merge(*[_iterRecords(outfile, output_format) for outfile in outfiles],
+        key=lambda record: record[0])
+    with atomicWrite(merged_path) as outf:
+        for (_, path, mentions, data) in records:
+            outf.write(data)
+            _countCUIs(counts, [m['CUIs'] if type(m) == dict else m.CUIs for m in mentions])
+
+    files = [fpath for info in infos for fpath in info['files']]
+    writeResultsInfo(merged_path, 0, 1, infos[0]['key'], infos[0]['settings'], files)
+    if cui_counts_path != None: writeCUICounts(counts, cui_counts_path)
+    return counts
+
+def _iterRecords(outfile, output_format):
+    '''Yield (source path, path, mentions, record bytes) for each record
+    of a processCorpus.py output, checking that sources are in order.
+    '''
+    previous = None
+    with open(outfile, 'rb') as stream:
+        while True:
+            offset = stream.tell()
+            if output_format == 'jsonl':
+                line = stream.readline()
+                if not line: break
+                record = json.loads(line.decode('utf-8'))
+                (path, mentions) = (record['path'], record.get('mentions', []))
+            else:
+                try:
+                    (path, value, error) = pickle.load(stream)
+                except EOFError:
+                    break
+                mentions = value['mentions'] if error is None else []
+                end = stream.tell()
+                stream.seek(offset)
+                line = stream.read(end - offset)
+            source = archives.splitMember(path)[0]
+            if previous != None and source < previous:
+                raise ValueError('%s is not in order of source file path (%s after %s)' % (
+                    outfile, source, previous))
+            previous = source
+            yield (source, path, mentions, line)
+
+
+### Indexes (buildIndex.py output) ######
+
+def writeIndexInfo(index_dir, shard, num_shards, key, settings, files):
+    '''Describe the CUI index in index_dir as a shard.
+    '''
+    outputs = []
+    for (dirpath, _, fnames) in os.walk(index_dir):
+        outputs.extend([os.path.join(dirpath, fname) for fname in fnames
+            if os.path.relpath(dirpath, index_dir).startswith('segment-')])
+    return writeInfo(os.path.join(index_dir, INDEX_INFO_NAME), 'index', shard, num_shards, key,
+        settings, files, outputs)
+
+def mergeIndexes(index_dirs, merged_dir, cui_counts_path=None):
+    '''Merge shard CUI indexes (each with its shard description) into a
+    new index in merged_dir, as a single segment with documents numbered
+    in order of source file path (as in an unsharded index).  The merged index is itself described as the single
+    shard 0/1.
+
+    If cui_counts_path is given, also write the number of mentions and of
+    documents of each CUI there (see writeCUICounts).
+    '''
+    infos = [readInfo(os.path.join(index_dir, INDEX_INFO_NAME)) for index_dir in index_dirs]
+    checkShards(infos, 'index')
+    merged = CUIIndex(merged_dir)
+    if len(merged) > 0:
+        raise ValueError('%s already holds an index' % merged_dir)
+    merged.addIndexes([CUIIndex(index_dir) for index_dir in index_dirs])
+
+    files = [fpath for info in infos for fpath in info['files']]
+    writeIndexInfo(merged_dir, 0, 1, infos[0]['key'], infos[0]['settings'], files)
+    counts = { cui: [len(merged.postings(cui)), merged.documentFrequency(cui)] for cui in merged.CUIs() }
+    if cui_counts_path != None: writeCUICounts(counts, cui_counts_path)
+    return counts
+
+
+### CUI counts ##########################
+
+def writeCUICounts(counts, fpath):
+    '''Write counts (a dict of CUI -> [mentions, documents]) as sorted,
+    tab-separated lines of CUI, mention count and document count.
+    '''
+    with open(fpath, 'w') as stream:
+        for cui in sorted(counts.keys()):
+            stream.write('%s\t%d\t%d\n' % (cui, counts[cui][0], counts[cui][1]))
+
+def _countCUIs(counts, mention_CUIs):
+    # add one document's mentions (lists of CUIs) to the counts
+    for CUIs in mention_CUIs:
+        for cui in CUIs:
+            counts.setdefault(cui, [0, 0])[0] += 1
+    for cui in set([cui for CUIs in mention_CUIs for cui in CUIs]):
+        counts[cui][1] += 1
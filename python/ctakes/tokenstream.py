@@ -0,0 +1,371 @@
+'''
+Integer-encoded sentence streams of tokens and CUIs, for training
+embeddings without touching XML (or Python object graphs) at train time.
+
+exportCorpus parses a corpus with mentions and writes each sentence as a
+flat sequence of integer IDs, where mentions are replaced by the IDs of
+their CUIs.  Surface tokens and CUIs share one Vocabulary (an ID space
+with a kind and a corpus count per entry).  Overlapping mentions are
+resolved by an overlap policy: one of the Document policies that give a
+flat token list (longest, first or most_cuis; see
+ctakes.format.common.OVERLAP_POLICIES), or one of STREAM_OVERLAP_POLICIES,
+which start from every alternative of an overlap (overlaps='all'):
+
+    drop    :: no mentions; the overlapping span's surface tokens
+    expand  :: the sentence is written once per alternative of each
+               overlap (other overlaps take their first alternative)
+
+Output is a directory of shards, each holding flat .npy arrays (all
+sentences' IDs concatenated, sentence offsets, and the document number of
+each sentence), plus the vocabulary and metadata as JSON.  TokenStream
+memory-maps the shards for reading.
+
+Usage:
+    errors = exportCorpus(corpus.listFiles(['/path/to/xmi/dir']), '/path/to/stream',
+        overlaps='most_cuis', num_workers=8)
+    stream = TokenStream('/path/to/stream')
+    for (ids, offsets) in stream.iterShards():
+        ...
+
+@depends NumPy
+'''
+
+import os
+import json
+import bisect
+import functools
+import numpy as np
+from . import files
+from . import corpus
+from .format import common
+from .annotations import Mention, Sentence
+
+STREAM_VERSION = 1
+
+# policies resolved here, from every alternative of each overlap; the
+# others are passed on to Document.iterSentences
+STREAM_OVERLAP_POLICIES = ('drop', 'expand')
+OVERLAP_POLICIES = tuple([policy for policy in common.OVERLAP_POLICIES if policy != 'all']) \
+    + STREAM_OVERLAP_POLICIES
+CUI_POLICIES = ('first', 'all')
+
+DEFAULT_SHARD_TOKENS = 64 * 1024 * 1024
+
+_shard_prefix = 'shard-'
+_shard_arrays = ('tokens', 'offsets', 'docs')
+
+TOKEN = 0
+CUI = 1
+_kind_names = { TOKEN: 'token', CUI: 'CUI' }
+
+
+### Vocabulary ##########################
+
+class Vocabulary:
+    '''Shared mapping of surface tokens and CUIs to integer IDs, with the
+    corpus count of each entry.
+
+    IDs are assigned in order of first appearance.
+    '''
+    def __init__(self):
+        self.strings = []
+        self.kinds = []
+        self.counts = []
+        self._ids = {}
+
+    def add(self, kind, string, count=0):
+        '''Return the ID for (kind, string), assigning a new one if needed,
+        and add count to its corpus count.
+        '''
+        key = (kind, string)
+        ID = self._ids.get(key, None)
+        if ID is None:
+            ID = len(self.strings)
+            self.strings.append(string)
+            self.kinds.append(kind)
+            self.counts.append(0)
+            self._ids[key] = ID
+        self.counts[ID] += count
+        return ID
+
+    def get(self, kind, string, default=None):
+        '''Return the ID for (kind, string), or default if it is not in the
+        vocabulary.
+        '''
+        return self._ids.get((kind, string), default)
+
+    def tokenID(self, token, default=None):
+        return self.get(TOKEN, token, default)
+
+    def CUIID(self, cui, default=None):
+        return self.get(CUI, cui, default)
+
+    def isCUI(self, ID):
+        return self.kinds[ID] == CUI
+
+    def __getitem__(self, ID):
+        return self.strings[ID]
+
+    def __len__(self):
+        return len(self.strings)
+
+    def save(self, fpath):
+        files.writeJSON(fpath, {
+            'strings': self.strings,
+            'kinds': [_kind_names[kind] for kind in self.kinds],
+            'counts': self.counts,
+        })
+
+    @classmethod
+    def load(cls, fpath):
+        with open(fpath, 'r') as stream:
+            data = json.load(stream)
+        kinds_by_name = { name: kind for (kind, name) in _kind_names.items() }
+        vocabulary = cls()
+        for (string, kind_name, count) in zip(data['strings'], data['kinds'], data['counts']):
+            vocabulary.add(kinds_by_name[kind_name], string, count)
+        return vocabulary
+
+
+### Encoding ############################
+
+def expandSentence(tokens, overlaps='expand'):
+    '''Resolve the overlapping mention alternatives in a sentence's tokens
+    (strings, Mentions and lists of alternatives, as from iterSentences
+    with overlaps='all') by one of STREAM_OVERLAP_POLICIES.
+
+    Returns a list of flat lists of strings and Mentions: one, or with
+    overlaps='expand', one per alternative of each overlap.
+    '''
+    if not overlaps in STREAM_OVERLAP_POLICIES:
+        raise ValueError("Unknown overlap policy '%s'" % overlaps)
+    flat, clusters = [], []
+    for item in tokens:
+        if type(item) != list:
+            flat.append(item)
+        elif overlaps == 'drop':
+            # the first alternative starts where the overlap starts, so its
+            # mention text and following tokens cover the whole span
+            (mention, after) = _splitAlternative(item[0])
+            flat.extend(mention.text.split(' '))
+            flat.extend(after)
+        else:
+            clusters.append((len(flat), len(item[0]), item))
+            flat.extend(item[0])
+    variants = [flat]
+    for (start, length, alternatives) in clusters:
+        for alternative in alternatives[1:]:
+            variants.append(flat[:start] + alternative + flat[start+length:])
+    return variants
+
+def _splitAlternative(alternative):
+    for (i, item) in enumerate(alternative):
+        if isinstance(item, Mention):
+            return (item, alternative[i+1:])
+
+def encodeFile(fpath, format=None, overlaps='first', cuis='first', words_only=False, lowercase=False):
+    '''Parse a cTAKES output file and encode its sentences against a
+    document-local vocabulary.
+
+    Returns (entries, IDs, offsets), where entries is the list of (kind,
+    string) vocabulary entries, IDs the int32 array of all sentences'
+    local IDs, and offsets the int64 array of sentence start offsets in
+    IDs (plus its length).  Tokens outside of sentences are skipped.
+    '''
+    if not overlaps in OVERLAP_POLICIES:
+        raise ValueError("Unknown overlap policy '%s'" % overlaps)
+    if not cuis in CUI_POLICIES:
+        raise ValueError("Unknown CUI policy '%s'" % cuis)
+    expand = overlaps in STREAM_OVERLAP_POLICIES
+    doc = corpus.getFormat(fpath, format).Document(fpath)
+    entries, local_ids = [], {}
+    def localID(kind, string):
+        ID = local_ids.get((kind, string), None)
+        if ID is None:
+            ID = len(entries)
+            entries.append((kind, string))
+            local_ids[(kind, string)] = ID
+        return ID
+
+    IDs, offsets = [], [0]
+    for sentence in doc.iterSentences(mentions=doc.mentions, words_only=words_only,
+            overlaps='all' if expand else overlaps):
+        if not isinstance(sentence, Sentence): continue
+        variants = expandSentence(sentence.tokens, overlaps=overlaps) if expand else [sentence.tokens]
+        for variant in variants:
+            for item in variant:
+                if isinstance(item, Mention) and len(item.CUIs) > 0:
+                    for cui in (item.CUIs[:1] if cuis == 'first' else item.CUIs):
+                        IDs.append(localID(CUI, cui))
+                else:
+                    words = item.text.split(' ') if isinstance(item, Mention) else [item]
+                    for word in words:
+                        if lowercase: word = word.lower()
+                        IDs.append(localID(TOKEN, word))
+            offsets.append(len(IDs))
+    return (entries, np.array(IDs, dtype=np.int32), np.array(offsets, dtype=np.int64))
+
+
+### Writing #############################
+
+class TokenStreamWriter:
+    '''Writes integer-encoded sentences to a new token stream directory,
+    starting a new shard every (roughly) shard_tokens IDs.  Call close()
+    to write the vocabulary and metadata.
+    '''
+    def __init__(self, directory, shard_tokens=DEFAULT_SHARD_TOKENS, settings=None):
+        if os.path.exists(os.path.join(directory, 'meta.json')):
+            raise ValueError('%s already holds a token stream' % directory)
+        if not os.path.isdir(directory): os.makedirs(directory)
+        self.directory = directory
+        self.shard_tokens = shard_tokens
+        self.settings = settings or {}
+        self.vocabulary = Vocabulary()
+        self.documents = []
+        self.shards = []
+        self.num_sentences, self.num_tokens = 0, 0
+        self._pending = []          # (global IDs, offsets, doc) per document
+        self._pending_tokens = 0
+
+    def addDocument(self, path, entries, IDs, offsets):
+        '''Add a document's sentences, encoded against a local vocabulary of
+        entries (as returned by encodeFile).
+        '''
+        doc = len(self.documents)
+        self.documents.append(path)
+        counts = np.bincount(IDs, minlength=len(entries)).tolist()
+        remap = np.array([
+            self.vocabulary.add(kind, string, count)
+                for ((kind, string), count) in zip(entries, counts)
+        ], dtype=np.int32)
+        self._pending.append((remap[IDs] if len(IDs) > 0 else IDs, offsets, doc))
+        self._pending_tokens += len(IDs)
+        if self._pending_tokens >= self.shard_tokens: self.flush()
+
+    def flush(self):
+        '''Write all pending sentences as a new shard.
+        '''
+        if len(self._pending) == 0: return
+        tokens = np.concatenate([IDs for (IDs, _, _) in self._pending])
+        offsets, docs, base = [np.zeros(1, dtype=np.int64)], [], 0
+        for (IDs, doc_offsets, doc) in self._pending:
+            offsets.append(doc_offsets[1:] + base)
+            docs.append(np.full(len(doc_offsets) - 1, doc, dtype=np.int32))
+            base += len(IDs)
+        arrays = {
+            'tokens': tokens.astype(np.int32),
+            'offsets': np.concatenate(offsets),
+            'docs': np.concatenate(docs),
+        }
+        name = '%s%06d' % (_shard_prefix, len(self.shards))
+        with files.atomicDirectory(os.path.join(self.directory, name)) as tmp_path:
+            for (array_name, array) in arrays.items():
+                np.save(os.path.join(tmp_path, '%s.npy' % array_name), array)
+        self.shards.append({ 'name': name, 'sentences': len(arrays['docs']), 'tokens': len(tokens) })
+        self.num_sentences += len(arrays['docs'])
+        self.num_tokens += len(tokens)
+        self._pending, self._pending_tokens = [], 0
+
+    def close(self):
+        '''Flush pending sentences, and write the vocabulary and metadata
+        (whose presence marks the stream as complete).
+        '''
+        self.flush()
+        self.vocabulary.save(os.path.join(self.directory, 'vocabulary.json'))
+        files.writeJSON(os.path.join(self.directory, 'meta.json'), {
+            'version': STREAM_VERSION,
+            'settings': self.settings,
+            'documents': self.documents,
+            'shards': self.shards,
+            'sentences': self.num_sentences,
+            'tokens': self.num_tokens,
+        })
+
+def exportCorpus(fpaths, directory, format=None, overlaps='first', cuis='first', words_only=False,
+        lowercase=False, shard_tokens=DEFAULT_SHARD_TOKENS, num_workers=None, chunk_size=16,
+        progress=None):
+    '''Parse and encode cTAKES output files (in parallel) into a new token
+    stream in directory.  Encoding options are as for encodeFile.
+
+    Returns the FileResults of files that could not be parsed.
+    '''
+    settings = { 'overlaps': overlaps, 'cuis': cuis, 'words_only': words_only, 'lowercase': lowercase }
+    writer = TokenStreamWriter(directory, shard_tokens=shard_tokens, settings=settings)
+    process = functools.partial(encodeFile, format=format, **settings)
+    errors = []
+    for result in corpus.processCorpus(fpaths, process=process, num_workers=num_workers,
+            chunk_size=chunk_size, progress=progress):
+        if result.error != None:
+            errors.append(result)
+            continue
+        (entries, IDs, offsets) = result.value
+        writer.addDocument(result.path, entries, IDs, offsets)
+    writer.close()
+    return errors
+
+
+### Reading #############################
+
+class TokenStream:
+    '''A token stream written by exportCorpus, with its shards
+    memory-mapped.
+
+    Indexing and iterating give each sentence as an int32 array of IDs
+    (see the vocabulary attribute).
+    '''
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, 'meta.json'), 'r') as stream:
+            meta = json.load(stream)
+        self.settings = meta['settings']
+        self.documents = meta['documents']
+        self.num_tokens = meta['tokens']
+        self.vocabulary = Vocabulary.load(os.path.join(directory, 'vocabulary.json'))
+        self._shards = [
+            { array_name: files.mapArray(os.path.join(directory, shard['name'], '%s.npy' % array_name))
+                for array_name in _shard_arrays }
+                for shard in meta['shards']
+        ]
+        self._shard_starts = [0]
+        for shard in meta['shards']:
+            self._shard_starts.append(self._shard_starts[-1] + shard['sentences'])
+
+    def __len__(self):
+        '''Number of sentences.
+        '''
+        return self._shard_starts[-1]
+
+    def __getitem__(self, i):
+        (shard, j) = self._locate(i)
+        offsets = shard['offsets']
+        return shard['tokens'][offsets[j]:offsets[j+1]]
+
+    def __iter__(self):
+        for (tokens, offsets) in self.iterShards():
+            offsets = offsets.tolist()
+            for j in range(len(offsets) - 1):
+                yield tokens[offsets[j]:offsets[j+1]]
+
+    def iterShards(self):
+        '''Yield (IDs, offsets) arrays for each shard; sentence j of a shard
+        is IDs[offsets[j]:offsets[j+1]].
+        '''
+        for shard in self._shards:
+            yield (shard['tokens'], shard['offsets'])
+
+    def document(self, i):
+        '''Return the path of the document sentence i comes from.
+        '''
+        (shard, j) = self._locate(i)
+        return self.documents[int(shard['docs'][j])]
+
+    def decode(self, IDs):
+        '''Return the token and CUI strings for a sequence of IDs.
+        '''
+        return [self.vocabulary[ID] for ID in np.asarray(IDs).tolist()]
+
+    def _locate(self, i):
+        if i < 0: i += len(self)
+        if i < 0 or i >= len(self): raise IndexError('sentence index out of range')
+        s = bisect.bisect_right(self._shard_starts, i) - 1
+        return (self._shards[s], i - self._shard_starts[s])
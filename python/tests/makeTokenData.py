@@ -0,0 +1,103 @@
+'''
+Regenerates the fixture documents in tests/data and records the expected
+getTokens output for them from a checkout of the original (line-based)
+implementation, which test_tokens.py compares the current parser against.
+
+Usage: python makeTokenData.py BASELINE_PYTHON_DIR
+e.g.
+    git archive 949a449 python | tar -x -C /tmp/baseline
+    python tests/makeTokenData.py /tmp/baseline/python
+
+The baseline reads one element per line, so documents are written in
+clean layout; the expected output of each CAS file is that of the XMI
+file holding the same document.
+
+The baseline cannot combine get_POS_tags with mentions (it fails joining
+(token, POS) pairs into mention text), so those combinations are not
+recorded; test_tokens.py checks them against the recorded output without
+POS tags, and with POS tags but without mentions.
+'''
+
+import os
+import sys
+import json
+import itertools
+
+_here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(_here, '..', 'benchmarks'))
+import synthetic
+
+DATA_DIR = os.path.join(_here, 'data')
+EXPECTED_FILE = os.path.join(DATA_DIR, 'tokens_expected.json')
+
+# (name, generateDocument arguments)
+DOCUMENTS = [
+    ('sparse', dict(num_tokens=60, mention_density=0.05, overlap_rate=0.0, seed=1)),
+    ('dense', dict(num_tokens=300, mention_density=0.3, overlap_rate=0.6, seed=2)),
+    ('long_sentences', dict(num_tokens=200, num_sentences=3, mention_density=0.15, seed=3)),
+]
+
+FLAGS = ('get_POS_tags', 'words_only', 'by_sentence', 'mentions')
+
+def flagCombinations():
+    '''Yield a dict of every combination of FLAGS.
+    '''
+    for values in itertools.product([False, True], repeat=len(FLAGS)):
+        yield dict(zip(FLAGS, values))
+
+def flagKey(flags):
+    return ','.join(['%s=%d' % (flag, int(flags[flag])) for flag in FLAGS])
+
+def isRecorded(flags):
+    '''Return True if the baseline can produce output for flags.
+    '''
+    return not (flags['get_POS_tags'] and flags['mentions'])
+
+def serialize(obj, strip_POS=False):
+    '''Convert getTokens output (of either implementation) to plain JSON
+    values, comparing Mentions and Sentences by their contents.  If
+    strip_POS, (token, POS) pairs are replaced by their token.
+    '''
+    if type(obj).__name__ == 'Mention':
+        return { 'CUIs': list(obj.CUIs), 'begin': obj.begin, 'end': obj.end, 'text': obj.text }
+    elif type(obj).__name__ == 'Sentence':
+        return { 'begin': obj.begin, 'end': obj.end, 'tokens': serialize(obj.tokens, strip_POS) }
+    elif strip_POS and type(obj) == tuple:
+        return obj[0]
+    elif isinstance(obj, (list, tuple)):
+        return [serialize(item, strip_POS) for item in obj]
+    return obj
+
+def getTokens(module, fpath, flags):
+    '''Return the getTokens output for one flag combination.
+    '''
+    mentions = module.getMentions(fpath) if flags['mentions'] else None
+    return module.getTokens(fpath, mentions=mentions, get_POS_tags=flags['get_POS_tags'],
+        words_only=flags['words_only'], by_sentence=flags['by_sentence'])
+
+def runTokens(module, fpath, flags):
+    '''Return the serialized getTokens output for one flag combination.
+    '''
+    return serialize(getTokens(module, fpath, flags))
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print(__doc__)
+        exit()
+    sys.path.insert(0, sys.argv[1])
+    from ctakes.format import XMI
+
+    expected = {}
+    for (name, arguments) in DOCUMENTS:
+        doc = synthetic.generateDocument(**arguments)
+        xmi_path = os.path.join(DATA_DIR, '%s.xmi' % name)
+        synthetic.writeXMI(doc, xmi_path, clean=True)
+        synthetic.writeCAS(doc, os.path.join(DATA_DIR, '%s.xml' % name), clean=True)
+        expected[name] = {
+            flagKey(flags): runTokens(XMI, xmi_path, flags)
+                for flags in flagCombinations() if isRecorded(flags)
+        }
+
+    with open(EXPECTED_FILE, 'w') as stream:
+        json.dump(expected, stream, sort_keys=True)
+    print('Recorded %d documents to %s' % (len(expected), EXPECTED_FILE))
@@ -0,0 +1,136 @@
+'''
+Tests for reading compressed files and tar/zip archive members
+(ctakes.archives): compression is detected by magic bytes whatever the
+file name, archive::member paths read like plain files, and no file
+handles are left open.
+
+Run from the python directory:  python -m pytest -q tests
+'''
+
+import io
+import os
+import gc
+import bz2
+import gzip
+import lzma
+import shutil
+import tarfile
+import zipfile
+import tempfile
+import warnings
+import unittest
+from ctakes import archives, corpus
+from ctakes.format import XMI, CAS
+
+from makeTokenData import DATA_DIR, serialize
+
+_compressors = { 'gz': gzip.compress, 'bz2': bz2.compress, 'xz': lzma.compress }
+
+class TestArchives(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.mkdtemp(prefix='ctakes-test-')
+        cls.fpath = os.path.join(DATA_DIR, 'dense.xmi')
+        with open(cls.fpath, 'rb') as stream:
+            cls.data = stream.read()
+        cls.mentions = XMI.getMentions(cls.fpath)
+        cls.tokens = serialize(XMI.getTokens(cls.fpath, mentions=XMI.getMentions(cls.fpath), by_sentence=True))
+
+        cls.tar_path = os.path.join(cls.tmpdir, 'notes.tar.gz')
+        with tarfile.open(cls.tar_path, 'w:gz') as container:
+            container.add(cls.fpath, arcname='batch1/dense.xmi')
+            container.add(os.path.join(DATA_DIR, 'sparse.xml'), arcname='batch1/sparse.xml')
+            info = tarfile.TarInfo('batch2/dense.xmi.gz')
+            compressed = gzip.compress(cls.data)
+            info.size = len(compressed)
+            container.addfile(info, io.BytesIO(compressed))
+            container.add(os.path.join(DATA_DIR, 'tokens_expected.json'), arcname='README.json')
+        cls.zip_path = os.path.join(cls.tmpdir, 'notes.zip')
+        with zipfile.ZipFile(cls.zip_path, 'w') as container:
+            container.write(cls.fpath, arcname='dense.xmi')
+            container.write(os.path.join(DATA_DIR, 'sparse.xml'), arcname='sub/sparse.xml')
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmpdir, ignore_errors=True)
+
+    def _write(self, name, data):
+        fpath = os.path.join(self.tmpdir, name)
+        with open(fpath, 'wb') as stream:
+            stream.write(data)
+        return fpath
+
+    def testMagicBytes(self):
+        for (compression, compress) in _compressors.items():
+            # the extension does not matter, only the leading bytes
+            for name in ('dense.xmi.%s' % compression, 'dense-%s.xmi' % compression):
+                with self.subTest(name=name):
+                    fpath = self._write(name, compress(self.data))
+                    with archives.decompress(open(fpath, 'rb')) as stream:
+                        self.assertEqual(stream.read(), self.data)
+                    self.assertEqual(XMI.getMentions(fpath), self.mentions)
+                    self.assertEqual(serialize(XMI.getTokens(fpath, mentions=XMI.getMentions(fpath),
+                        by_sentence=True)), self.tokens)
+        # uncompressed data under a compression extension is read as is
+        fpath = self._write('plain.xmi.gz', self.data)
+        self.assertEqual(XMI.getMentions(fpath), self.mentions)
+
+    def testBaseName(self):
+        self.assertEqual(archives.baseName('/data/note.xmi.gz'), 'note.xmi')
+        self.assertEqual(archives.baseName('/data/notes.tar::batch1/note.xml.bz2'), 'note.xml')
+        self.assertEqual(corpus.getFormat('/data/note.xml.xz'), CAS)
+
+    def testMemberPaths(self):
+        member = archives.memberPath(self.tar_path, 'batch1/dense.xmi')
+        self.assertEqual(archives.splitMember(member), (self.tar_path, 'batch1/dense.xmi'))
+        self.assertEqual(archives.splitMember(self.fpath), (self.fpath, None))
+        self.assertTrue(archives.isArchive(self.tar_path))
+        self.assertFalse(archives.isArchive(member))
+
+    def testReadMembers(self):
+        for member in (archives.memberPath(self.tar_path, 'batch1/dense.xmi'),
+                archives.memberPath(self.tar_path, 'batch2/dense.xmi.gz'),
+                archives.memberPath(self.zip_path, 'dense.xmi')):
+            with self.subTest(member=member):
+                self.assertEqual(XMI.getMentions(member), self.mentions)
+                self.assertEqual(XMI.getDocumentID(member), XMI.getDocumentID(self.fpath))
+        member = archives.memberPath(self.zip_path, 'sub/sparse.xml')
+        self.assertEqual(CAS.getMentions(member), CAS.getMentions(os.path.join(DATA_DIR, 'sparse.xml')))
+        self.assertEqual(archives.getSize(archives.memberPath(self.zip_path, 'dense.xmi')), len(self.data))
+        self.assertEqual(archives.getSize(archives.memberPath(self.tar_path, 'batch1/dense.xmi')), len(self.data))
+        with self.assertRaises(KeyError):
+            archives.openRaw(archives.memberPath(self.tar_path, 'missing.xmi'))
+
+    def testIterMembers(self):
+        members = [path for (path, _) in archives.iterMembers(self.tar_path, extensions={'.xmi', '.xml'})]
+        self.assertEqual(members, [archives.memberPath(self.tar_path, name)
+            for name in ('batch1/dense.xmi', 'batch1/sparse.xml', 'batch2/dense.xmi.gz')])
+
+    def testProcessArchives(self):
+        results = list(corpus.processCorpus([self.zip_path, self.tar_path], num_workers=1))
+        self.assertEqual([result.error for result in results], [None] * 5)
+        self.assertEqual([result.path for result in results], [
+            archives.memberPath(self.zip_path, 'dense.xmi'),
+            archives.memberPath(self.zip_path, 'sub/sparse.xml'),
+            archives.memberPath(self.tar_path, 'batch1/dense.xmi'),
+            archives.memberPath(self.tar_path, 'batch1/sparse.xml'),
+            archives.memberPath(self.tar_path, 'batch2/dense.xmi.gz'),
+        ])
+        self.assertEqual(results[4].value['mentions'], self.mentions)
+
+    def testClosesFiles(self):
+        paths = [self._write('closed.xmi.%s' % compression, compress(self.data))
+            for (compression, compress) in _compressors.items()]
+        paths.append(archives.memberPath(self.tar_path, 'batch2/dense.xmi.gz'))
+        paths.append(archives.memberPath(self.zip_path, 'dense.xmi'))
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always', ResourceWarning)
+            for fpath in paths:
+                XMI.getMentions(fpath)
+                XMI.getDocumentID(fpath)
+            gc.collect()
+        self.assertEqual([str(w.message) for w in caught if issubclass(w.category, ResourceWarning)], [])
+
+if __name__ == '__main__':
+    unittest.main()
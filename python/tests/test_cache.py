@@ -0,0 +1,113 @@
+'''
+Tests for the persistent parse cache (ctakes.format.cache): keying on
+file modification time and PARSER_VERSION, corrupt entries, size
+accounting and LRU eviction down to the low-water mark.
+
+Run from the python directory:  python -m pytest -q tests
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from unittest import mock
+from ctakes.format import cache, XMI
+
+from makeTokenData import DATA_DIR
+
+class TestParseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='ctakes-test-')
+        self.cache_dir = os.path.join(self.tmpdir, 'cache')
+        self.fpath = os.path.join(self.tmpdir, 'dense.xmi')
+        shutil.copy(os.path.join(DATA_DIR, 'dense.xmi'), self.fpath)
+
+    def tearDown(self):
+        cache.disable()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _diskSize(self):
+        return sum([size for (_, size, _) in cache.ParseCache(self.cache_dir)._entries()])
+
+    def _store(self, parse_cache, name, num_bytes):
+        # store an entry of (roughly) num_bytes for a file that need not exist
+        fpath = os.path.join(self.tmpdir, name)
+        if not os.path.exists(fpath): open(fpath, 'w').close()
+        parse_cache.store(fpath, 'test', { 'data': np.zeros(num_bytes, dtype=np.uint8) })
+        return parse_cache._entryPath(parse_cache.key(fpath, 'test'))
+
+    def testHitAndMiss(self):
+        parse_cache = cache.enable(self.cache_dir)
+        expected = XMI.getMentions(self.fpath)
+        self.assertEqual((parse_cache.hits, parse_cache.misses), (0, 1))
+        self.assertEqual(XMI.getMentions(self.fpath), expected)
+        self.assertEqual((parse_cache.hits, parse_cache.misses), (1, 1))
+
+    def testModifiedFileMisses(self):
+        parse_cache = cache.enable(self.cache_dir)
+        XMI.getMentions(self.fpath)
+        stat = os.stat(self.fpath)
+        os.utime(self.fpath, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        XMI.getMentions(self.fpath)
+        self.assertEqual((parse_cache.hits, parse_cache.misses), (0, 2))
+
+    def testParserVersionMisses(self):
+        parse_cache = cache.enable(self.cache_dir)
+        XMI.getMentions(self.fpath)
+        with mock.patch.object(cache, 'PARSER_VERSION', cache.PARSER_VERSION + 1):
+            XMI.getMentions(self.fpath)
+        self.assertEqual((parse_cache.hits, parse_cache.misses), (0, 2))
+        # entries of the current version are still there
+        XMI.getMentions(self.fpath)
+        self.assertEqual(parse_cache.hits, 1)
+
+    def testCorruptEntryMisses(self):
+        parse_cache = cache.enable(self.cache_dir)
+        expected = XMI.getMentions(self.fpath)
+        (entry, _) = list(parse_cache._index.items())[0]
+        with open(entry, 'rb') as stream:
+            data = stream.read()
+        for corrupt in (b'', b'not an npz file', data[:len(data) // 2]):
+            with self.subTest(size=len(corrupt)):
+                with open(entry, 'wb') as stream:
+                    stream.write(corrupt)
+                hits = parse_cache.hits
+                self.assertEqual(XMI.getMentions(self.fpath), expected)
+                self.assertEqual(parse_cache.hits, hits)
+        # the last miss stored a good entry again
+        XMI.getMentions(self.fpath)
+        self.assertEqual(parse_cache.hits, 1)
+
+    def testOverwriteCountsOnce(self):
+        parse_cache = cache.ParseCache(self.cache_dir)
+        self._store(parse_cache, 'a', 1000)
+        self._store(parse_cache, 'a', 2000)
+        self.assertEqual(len(parse_cache._index), 1)
+        self.assertEqual(parse_cache._size, self._diskSize())
+
+    def testEvictToLowWater(self):
+        parse_cache = cache.ParseCache(self.cache_dir, max_bytes=10000)
+        entries = [self._store(parse_cache, name, 2000) for name in 'abcd']
+        # loading a makes it the most recently used
+        self.assertIsNotNone(parse_cache.load(os.path.join(self.tmpdir, 'a'), 'test'))
+        self._store(parse_cache, 'e', 2000)
+        self.assertLessEqual(self._diskSize(), parse_cache.max_bytes * parse_cache.low_water)
+        self.assertEqual(parse_cache._size, self._diskSize())
+        remaining = [os.path.exists(entry) for entry in entries]
+        self.assertEqual(remaining, [True, False, False, True])
+
+    def testEvictCountsOtherProcesses(self):
+        # two caches on one directory, as in forked worker processes
+        caches = [cache.ParseCache(self.cache_dir, max_bytes=10000) for _ in range(2)]
+        for i in range(20):
+            self._store(caches[i % 2], 'file%d' % i, 2000)
+            self.assertLessEqual(self._diskSize(), len(caches) * caches[0].max_bytes)
+        # eviction counts the entries of both, not just its own
+        caches[0].evict()
+        self.assertLessEqual(self._diskSize(), caches[0].max_bytes * caches[0].low_water)
+        self.assertEqual(caches[0]._size, self._diskSize())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+'''
+Tests for cleaning XMI files (ctakes/scripts/cleanXMI.py): streamed
+output matches unchunked output wherever the chunks split a tag end, an
+entity or an attribute value, and cleanFile writes atomically, keeping
+permissions and compression, and leaving nothing behind on errors.
+
+Run from the python directory:  python -m pytest -q tests
+'''
+
+import os
+import io
+import gzip
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from ctakes.scripts import cleanXMI
+
+from makeTokenData import DATA_DIR
+
+# tag ends inside quoted attribute values (including at either end of one,
+# and around entities), existing newlines and a tag end at the very end
+_SAMPLE = (b'<?xml version="1.0" encoding="UTF-8"?><xmi:XMI xmlns:xmi="http://www.omg.org/XMI">'
+    b'<cas:Sofa xmi:id="1" sofaString="a/&gt; &quot;b/>&quot; &amp;c &#10;/>"/>'
+    b'<x:T a="/>" b=""/><x:T a="&lt;/>&gt;"/>\n<x:T/>\r\n<x:T c="\'/>\'" />'
+    b'<x:Empty/><x:Text>d/e &apos;f&apos;</x:Text><x:T a="x"/>')
+
+def _clean(data, chunk_size=cleanXMI.CHUNK_SIZE):
+    outstream = io.BytesIO()
+    cleanXMI.cleanStream(io.BytesIO(data), outstream, chunk_size=chunk_size)
+    return outstream.getvalue()
+
+class TestCleanXMI(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='ctakes-test-')
+        self.fpath = os.path.join(self.tmpdir, 'dense.xmi')
+        shutil.copy(os.path.join(DATA_DIR, 'dense.xmi'), self.fpath)
+        with open(self.fpath, 'rb') as stream:
+            self.data = stream.read()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def testUnchunked(self):
+        expected = (b'<?xml version="1.0" encoding="UTF-8"?><xmi:XMI xmlns:xmi="http://www.omg.org/XMI">'
+            b'<cas:Sofa xmi:id="1" sofaString="a/&gt; &quot;b/>&quot; &amp;c &#10;/>"/>\n'
+            b'<x:T a="/>" b=""/>\n<x:T a="&lt;/>&gt;"/>\n<x:T/>\r\n<x:T c="\'/>\'" />\n'
+            b'<x:Empty/>\n<x:Text>d/e &apos;f&apos;</x:Text><x:T a="x"/>\n')
+        self.assertEqual(_clean(_SAMPLE), expected)
+        # cleaning is idempotent
+        self.assertEqual(_clean(expected), expected)
+
+    def testChunkBoundaries(self):
+        # every split of a tag end, entity or attribute value falls on a
+        # boundary for some chunk size (and offset, with a prefix)
+        for data in (_SAMPLE, self.data[:4000]):
+            expected = _clean(data)
+            for chunk_size in range(1, 8):
+                for prefix in (b'', b' ', b'  '):
+                    with self.subTest(chunk_size=chunk_size, prefix=prefix, length=len(data)):
+                        self.assertEqual(_clean(prefix + data, chunk_size=chunk_size), prefix + expected)
+
+    def testCleanStreamReads(self):
+        # no more than chunk_size bytes are requested at a time
+        class Reader(io.BytesIO):
+            def read(stream, size=-1):
+                self.assertTrue(0 < size <= 5)
+                return io.BytesIO.read(stream, size)
+        outstream = io.BytesIO()
+        cleanXMI.cleanStream(Reader(_SAMPLE), outstream, chunk_size=5)
+        self.assertEqual(outstream.getvalue(), _clean(_SAMPLE))
+
+    def testCleanFile(self):
+        os.chmod(self.fpath, 0o640)
+        outfile = cleanXMI.cleanFile(self.fpath, chunk_size=1000)
+        self.assertEqual(outfile, self.fpath + '.clean')
+        with open(outfile, 'rb') as stream:
+            self.assertEqual(stream.read(), _clean(self.data))
+        self.assertEqual(os.stat(outfile).st_mode & 0o777, 0o640)
+
+    def testCompressed(self):
+        gz_path = os.path.join(self.tmpdir, 'dense.xmi.gz')
+        with open(gz_path, 'wb') as stream:
+            stream.write(gzip.compress(_SAMPLE))
+        self.assertEqual(cleanXMI.cleanPath(gz_path), os.path.join(self.tmpdir, 'dense.xmi.clean.gz'))
+        outfile = cleanXMI.cleanFile(gz_path)
+        with gzip.open(outfile, 'rb') as stream:
+            self.assertEqual(stream.read(), _clean(_SAMPLE))
+        # in place, the file stays compressed
+        cleanXMI.cleanFile(gz_path, gz_path, chunk_size=7)
+        with gzip.open(gz_path, 'rb') as stream:
+            self.assertEqual(stream.read(), _clean(_SAMPLE))
+
+    def _checkFailure(self, fpath, outfile, error):
+        before = sorted(os.listdir(self.tmpdir))
+        with self.assertRaises(error):
+            cleanXMI.cleanFile(fpath, outfile, chunk_size=64)
+        self.assertEqual(sorted(os.listdir(self.tmpdir)), before)
+
+    def testReadError(self):
+        # a truncated gzip file fails partway through reading
+        gz_path = os.path.join(self.tmpdir, 'truncated.xmi.gz')
+        compressed = gzip.compress(self.data)
+        with open(gz_path, 'wb') as stream:
+            stream.write(compressed[:len(compressed) // 2])
+        self._checkFailure(gz_path, None, EOFError)
+        # editing in place leaves the original untouched
+        self._checkFailure(gz_path, gz_path, EOFError)
+        with open(gz_path, 'rb') as stream:
+            self.assertEqual(stream.read(), compressed[:len(compressed) // 2])
+
+    def testCleanupErrorKeepsOriginal(self):
+        # failing to remove the temporary file does not mask the read error
+        gz_path = os.path.join(self.tmpdir, 'truncated.xmi.gz')
+        with open(gz_path, 'wb') as stream:
+            stream.write(gzip.compress(self.data)[:1000])
+        unlink = os.unlink
+        def failingUnlink(path, *args, **kwargs):
+            unlink(path, *args, **kwargs)
+            raise PermissionError(path)
+        with mock.patch('os.unlink', failingUnlink):
+            self._checkFailure(gz_path, None, EOFError)
+
+    def testCleanDirectory(self):
+        outdir = os.path.join(self.tmpdir, 'out')
+        os.makedirs(os.path.join(self.tmpdir, 'in', 'sub'))
+        for name in ('a.xmi', os.path.join('sub', 'b.xmi')):
+            shutil.copy(self.fpath, os.path.join(self.tmpdir, 'in', name))
+        results = list(cleanXMI.cleanDirectory(os.path.join(self.tmpdir, 'in'), outdir,
+            num_workers=1, chunk_size=100))
+        self.assertEqual([result.error for result in results], [None, None])
+        for name in ('a.xmi', os.path.join('sub', 'b.xmi')):
+            with open(os.path.join(outdir, name), 'rb') as stream:
+                self.assertEqual(stream.read(), _clean(self.data))
+
+if __name__ == '__main__':
+    unittest.main()
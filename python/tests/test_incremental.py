@@ -0,0 +1,147 @@
+'''
+Tests for incremental corpus processing (ctakes.corpus.updateOutput and
+ctakes.manifest): after files (and archive members) are added, changed
+and deleted, an incremental rerun writes the same output as a full
+rebuild, reprocessing only what changed.
+
+Run from the python directory:  python -m pytest -q tests
+'''
+
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+from ctakes import corpus
+from ctakes.manifest import Manifest
+
+from makeTokenData import DATA_DIR
+
+_sources = ('dense.xmi', 'sparse.xmi', 'long_sentences.xmi')
+
+class TestIncremental(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='ctakes-test-')
+        self.corpus_dir = os.path.join(self.tmpdir, 'corpus')
+        os.makedirs(self.corpus_dir)
+        for i in range(6):
+            self._copy(_sources[i % len(_sources)], 'note%d.xmi' % i)
+        self._archive('notes.tar', ['dense.xmi', 'sparse.xmi'])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _touch(self, fpath):
+        # make sure a changed file looks changed, however coarse the clock
+        stat = os.stat(fpath)
+        os.utime(fpath, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    def _copy(self, source, name):
+        fpath = os.path.join(self.corpus_dir, name)
+        shutil.copy(os.path.join(DATA_DIR, source), fpath)
+        self._touch(fpath)
+        return fpath
+
+    def _archive(self, name, sources):
+        fpath = os.path.join(self.corpus_dir, name)
+        with tarfile.open(fpath, 'w') as container:
+            for source in sources:
+                container.add(os.path.join(DATA_DIR, source), arcname=source)
+        self._touch(fpath)
+        return fpath
+
+    def _fpaths(self):
+        return corpus.listFiles([self.corpus_dir])
+
+    def _full(self, output_format):
+        fpath = os.path.join(self.tmpdir, 'full.%s' % output_format)
+        results = corpus.processCorpus(self._fpaths(), num_workers=1)
+        if output_format == 'jsonl':
+            with open(fpath, 'w') as outf:
+                corpus.writeJSONL(results, outf)
+        else:
+            with open(fpath, 'wb') as outf:
+                corpus.writePickle(results, outf)
+        return self._read(fpath)
+
+    def _read(self, fpath):
+        with open(fpath, 'rb') as stream:
+            return stream.read()
+
+    def _update(self, outfile, output_format, settings=None):
+        return corpus.updateOutput(self._fpaths(), outfile, output_format=output_format,
+            settings=settings, num_workers=1)
+
+    def _processed(self, changes):
+        return sorted([os.path.basename(fpath) for fpath in changes.process])
+
+    def _checkRebuild(self, output_format):
+        outfile = os.path.join(self.tmpdir, 'out.%s' % output_format)
+        changes = self._update(outfile, output_format)
+        self.assertEqual(len(changes.process), 7)
+        self.assertEqual(self._read(outfile), self._full(output_format))
+
+        self._copy('dense.xmi', 'added.xmi')
+        self._copy('sparse.xmi', 'note0.xmi')
+        os.unlink(os.path.join(self.corpus_dir, 'note4.xmi'))
+        # an archive that lost a member and gained another
+        self._archive('notes.tar', ['sparse.xmi', 'long_sentences.xmi'])
+        changes = self._update(outfile, output_format)
+        self.assertEqual(self._processed(changes), ['added.xmi', 'note0.xmi', 'notes.tar'])
+        self.assertEqual([os.path.basename(fpath) for fpath in changes.removed], ['note4.xmi'])
+        self.assertEqual(self._read(outfile), self._full(output_format))
+
+        # nothing to reprocess on an unchanged corpus
+        changes = self._update(outfile, output_format)
+        self.assertEqual(changes.process, [])
+        self.assertEqual(self._read(outfile), self._full(output_format))
+
+    def testMatchesRebuildJSONL(self):
+        self._checkRebuild('jsonl')
+
+    def testMatchesRebuildPickle(self):
+        self._checkRebuild('pickle')
+
+    def testTouchedFileUnchanged(self):
+        outfile = os.path.join(self.tmpdir, 'out.jsonl')
+        self._update(outfile, 'jsonl')
+        self._touch(os.path.join(self.corpus_dir, 'note1.xmi'))
+        changes = self._update(outfile, 'jsonl')
+        self.assertEqual((changes.process, len(changes.unchanged)), ([], 7))
+        # the new modification time is recorded, so it is not hashed again
+        changes = Manifest(outfile + '.manifest.json', settings={ 'output_format': 'jsonl', 'settings': None }) \
+            .diff(self._fpaths())
+        self.assertEqual([state[2] for state in changes.states.values()], [None] * 7)
+        self.assertEqual(self._read(outfile), self._full('jsonl'))
+
+    def testRebuildWhenInvalid(self):
+        outfile = os.path.join(self.tmpdir, 'out.jsonl')
+        self._update(outfile, 'jsonl', settings={ 'tokens': False })
+        # other settings
+        changes = self._update(outfile, 'jsonl', settings={ 'tokens': True })
+        self.assertEqual(len(changes.process), 7)
+        # an output that is not the one the manifest was saved with
+        with open(outfile, 'ab') as stream:
+            stream.write(b'\n')
+        changes = self._update(outfile, 'jsonl', settings={ 'tokens': True })
+        self.assertEqual(len(changes.process), 7)
+        self.assertEqual(self._read(outfile), self._full('jsonl'))
+
+    def testFailedFilesRetried(self):
+        outfile = os.path.join(self.tmpdir, 'out.jsonl')
+        broken = os.path.join(self.corpus_dir, 'note3.xmi')
+        with open(broken, 'wb') as stream:
+            stream.write(b'<xmi:XMI')
+        self.assertEqual(len(self._update(outfile, 'jsonl').process), 7)
+        self.assertIn(b'"error"', self._read(outfile))
+        # still broken, so it is retried, and only it
+        self.assertEqual(self._processed(self._update(outfile, 'jsonl')), ['note3.xmi'])
+        self.assertEqual(self._read(outfile), self._full('jsonl'))
+        self._copy('dense.xmi', 'note3.xmi')
+        self.assertEqual(self._processed(self._update(outfile, 'jsonl')), ['note3.xmi'])
+        self.assertEqual(self._read(outfile), self._full('jsonl'))
+        self.assertNotIn(b'"error"', self._read(outfile))
+
+if __name__ == '__main__':
+    unittest.main()
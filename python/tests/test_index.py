@@ -0,0 +1,116 @@
+'''
+Tests for the on-disk CUI index (ctakes.index.CUIIndex): postings match
+the parsed mentions, compact() leaves every posting unchanged, and an
+incremental updateFiles() after files are added, changed and deleted
+gives the same index as a full rebuild.
+
+Run from the python directory:  python -m pytest -q tests
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+from ctakes import corpus
+from ctakes.index import CUIIndex
+
+from makeTokenData import DATA_DIR
+
+_sources = ('dense.xmi', 'sparse.xmi', 'long_sentences.xmi')
+
+def snapshot(index):
+    '''Everything a query can see, independent of document numbering and
+    segment layout: {CUI: sorted [(path, begin, end, type)]} and
+    {path: document ID}.
+    '''
+    postings = { cui: sorted(index.postings(cui)) for cui in index.CUIs() }
+    documents = { index.path(doc): index.documentID(doc) for doc in index._doc_by_path.values() }
+    return (postings, documents)
+
+class TestCUIIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='ctakes-test-')
+        self.corpus_dir = os.path.join(self.tmpdir, 'corpus')
+        os.makedirs(self.corpus_dir)
+        for i in range(6):
+            self._copy(_sources[i % len(_sources)], 'note%d.xmi' % i)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _copy(self, source, name):
+        fpath = os.path.join(self.corpus_dir, name)
+        shutil.copy(os.path.join(DATA_DIR, source), fpath)
+        # make sure a changed file looks changed, however coarse the clock
+        stat = os.stat(fpath)
+        os.utime(fpath, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        return fpath
+
+    def _fpaths(self):
+        return corpus.listFiles([self.corpus_dir])
+
+    def _rebuild(self, name):
+        index = CUIIndex(os.path.join(self.tmpdir, name))
+        self.assertEqual(index.addFiles(self._fpaths(), num_workers=1), [])
+        return index
+
+    def testPostings(self):
+        index = self._rebuild('index')
+        self.assertEqual(len(index), 6)
+        fpath = os.path.join(self.corpus_dir, 'note0.xmi')
+        expected = {}
+        for m in corpus.parseFile(fpath)['mentions']:
+            for cui in m.CUIs:
+                expected.setdefault(cui, []).append((fpath, m.begin, m.end, m.type))
+        for (cui, postings) in expected.items():
+            with self.subTest(cui=cui):
+                self.assertEqual([posting for posting in index.postings(cui) if posting[0] == fpath],
+                    sorted(postings, key=lambda posting: posting[1:3]))
+                self.assertIn(fpath, index.documents(cui))
+        self.assertEqual(len(index.postings('C0000000')), 0)
+
+    def testCompactKeepsPostings(self):
+        index = CUIIndex(os.path.join(self.tmpdir, 'index'))
+        # several segments, with replaced and removed documents
+        index.addFiles(self._fpaths(), num_workers=1, batch_size=2)
+        self._copy('sparse.xmi', 'note0.xmi')
+        index.addFiles([os.path.join(self.corpus_dir, 'note0.xmi')], num_workers=1)
+        index.removeFiles([os.path.join(self.corpus_dir, 'note4.xmi')])
+        self.assertGreater(len(index._segments), 2)
+        self.assertGreater(index._num_replaced, 0)
+        expected = snapshot(index)
+        cooccurrences = [index.cooccurrences(cui, cui, window=50) for cui in index.CUIs()[:20]]
+
+        index.compact()
+        self.assertEqual(len(index._segments), 1)
+        self.assertEqual(index._num_replaced, 0)
+        self.assertEqual(snapshot(index), expected)
+        self.assertEqual([index.cooccurrences(cui, cui, window=50) for cui in index.CUIs()[:20]], cooccurrences)
+        # and as reopened from disk
+        self.assertEqual(snapshot(CUIIndex(index.directory)), expected)
+        self.assertEqual(len(os.listdir(index.directory)), 1)
+
+    def testUpdateMatchesRebuild(self):
+        index = CUIIndex(os.path.join(self.tmpdir, 'index'))
+        (changes, errors) = index.updateFiles(self._fpaths(), num_workers=1)
+        self.assertEqual((len(changes.process), errors), (6, []))
+        self.assertEqual(snapshot(index), snapshot(self._rebuild('full0')))
+
+        self._copy('dense.xmi', 'added.xmi')
+        self._copy('long_sentences.xmi', 'note1.xmi')
+        os.unlink(os.path.join(self.corpus_dir, 'note2.xmi'))
+        (changes, errors) = index.updateFiles(self._fpaths(), num_workers=1)
+        self.assertEqual(sorted([os.path.basename(fpath) for fpath in changes.process]), ['added.xmi', 'note1.xmi'])
+        self.assertEqual([os.path.basename(fpath) for fpath in changes.removed], ['note2.xmi'])
+        self.assertEqual(snapshot(index), snapshot(self._rebuild('full1')))
+        self.assertEqual(snapshot(CUIIndex(index.directory)), snapshot(index))
+
+        # nothing to do on an unchanged corpus
+        (changes, errors) = index.updateFiles(self._fpaths(), num_workers=1)
+        self.assertEqual((changes.process, changes.removed), ([], []))
+        index.compact()
+        self.assertEqual(snapshot(index), snapshot(self._rebuild('full2')))
+
+if __name__ == '__main__':
+    unittest.main()
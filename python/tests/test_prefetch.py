@@ -0,0 +1,136 @@
+'''
+Tests for read-ahead (ctakes.prefetch.Prefetcher, and processCorpus with
+read_ahead): reading in order, closing or abandoning partway through with
+reads still in flight, and failing reads.  None of them may hang.
+
+Run from the python directory:  python -m pytest -q tests
+'''
+
+import os
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+from ctakes import corpus, prefetch
+from ctakes.prefetch import Prefetcher
+
+from makeTokenData import DATA_DIR
+
+TIMEOUT = 30
+
+def _slowReader(fpath):
+    time.sleep(0.01)
+    return prefetch.readFile(fpath)
+
+def _failingReader(fpath):
+    # (module level, so processCorpus can send it to worker processes)
+    if os.path.basename(fpath).startswith('bad'):
+        raise IOError('cannot read %s' % fpath)
+    return prefetch.readFile(fpath)
+
+class TestPrefetch(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='ctakes-test-')
+        self.fpaths = []
+        for i in range(12):
+            name = ('bad%02d.xmi' if i == 5 else 'note%02d.xmi') % i
+            self.fpaths.append(os.path.join(self.tmpdir, name))
+            shutil.copy(os.path.join(DATA_DIR, 'sparse.xmi'), self.fpaths[-1])
+        with open(self.fpaths[0], 'rb') as stream:
+            self.data = stream.read()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _finishes(self, function, timeout=TIMEOUT):
+        '''Run function in a thread, failing if it does not finish within
+        timeout seconds; returns its value (or raises its exception).
+        '''
+        outcome = {}
+        def run():
+            try: outcome['value'] = function()
+            except BaseException as e: outcome['error'] = e
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        thread.join(timeout)
+        self.assertFalse(thread.is_alive(), 'did not finish within %d seconds' % timeout)
+        if 'error' in outcome: raise outcome['error']
+        return outcome.get('value', None)
+
+    def testReadsInOrder(self):
+        def run():
+            with Prefetcher(self.fpaths, window=3, num_threads=2, reader=_slowReader) as prefetcher:
+                return [prefetcher.get(fpath) for fpath in self.fpaths]
+        self.assertEqual(self._finishes(run), [self.data] * len(self.fpaths))
+
+    def testCloseWithReadsInFlight(self):
+        release = threading.Event()
+        def blockingReader(fpath):
+            if fpath != self.fpaths[0]: release.wait(TIMEOUT)
+            return prefetch.readFile(fpath)
+        prefetcher = Prefetcher(self.fpaths, window=4, num_threads=2, reader=blockingReader)
+        try:
+            self.assertEqual(self._finishes(lambda: prefetcher.get(self.fpaths[0])), self.data)
+            # the other reads are still blocked; closing must not wait for them
+            self._finishes(prefetcher.close, timeout=5)
+            # files requested after closing are read directly
+            release.set()
+            self.assertEqual(self._finishes(lambda: prefetcher.get(self.fpaths[-1])), self.data)
+        finally:
+            release.set()
+
+    def testAbandonPartway(self):
+        def run():
+            with Prefetcher(self.fpaths, window=4, num_threads=2, reader=_slowReader) as prefetcher:
+                for fpath in self.fpaths[:3]: prefetcher.get(fpath)
+            return prefetch.getActive()
+        self.assertIsNone(self._finishes(run))
+
+    def testReadError(self):
+        def run():
+            results = []
+            with Prefetcher(self.fpaths, window=3, num_threads=2, reader=_failingReader) as prefetcher:
+                for fpath in self.fpaths:
+                    try: results.append(prefetcher.get(fpath) == self.data)
+                    except IOError: results.append(None)
+            return results
+        expected = [True] * len(self.fpaths)
+        expected[5] = None
+        self.assertEqual(self._finishes(run), expected)
+
+    def testEveryReadFails(self):
+        def failing(fpath):
+            raise IOError('cannot read %s' % fpath)
+        def run():
+            with Prefetcher(self.fpaths, window=2, reader=failing) as prefetcher:
+                for fpath in self.fpaths:
+                    with self.assertRaises(IOError): prefetcher.get(fpath)
+        self._finishes(run)
+
+    def testProcessCorpusAbandoned(self):
+        for num_workers in (1, 2):
+            with self.subTest(num_workers=num_workers):
+                def run():
+                    results = corpus.processCorpus(self.fpaths, num_workers=num_workers, chunk_size=3,
+                        read_ahead=2, reader=_slowReader)
+                    taken = [next(results), next(results)]
+                    results.close()
+                    return [result.path for result in taken]
+                self.assertEqual(self._finishes(run), self.fpaths[:2])
+
+    def testProcessCorpusReadError(self):
+        for num_workers in (1, 2):
+            with self.subTest(num_workers=num_workers):
+                def run():
+                    return list(corpus.processCorpus(self.fpaths, num_workers=num_workers, chunk_size=3,
+                        read_ahead=2, reader=_failingReader))
+                results = self._finishes(run)
+                self.assertEqual([result.path for result in results], self.fpaths)
+                self.assertEqual([result.error != None for result in results],
+                    [i == 5 for i in range(len(self.fpaths))])
+                self.assertIn('OSError', results[5].error)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+'''
+Tests for projections (ctakes.format.common.TypeRegistry): unknown type
+names are refused rather than silently selecting nothing, and
+corpus.parseFile only parses the nodes its output needs.
+
+Run from the python directory:  python -m pytest -q tests
+'''
+
+import os
+import unittest
+from unittest import mock
+from ctakes import corpus
+from ctakes.format import XMI, CAS
+
+from makeTokenData import DATA_DIR, serialize
+
+class TestProjection(unittest.TestCase):
+
+    def testUnknownNames(self):
+        for (fmt, fpath) in ((XMI, 'dense.xmi'), (CAS, 'dense.xml')):
+            fpath = os.path.join(DATA_DIR, fpath)
+            with self.subTest(format=fmt.__name__):
+                with self.assertRaises(ValueError) as context:
+                    fmt.getMentions(fpath, types=['DiseaseDisorderMentoin'])
+                self.assertIn("'DiseaseDisorderMentoin'", str(context.exception))
+                self.assertIn('DiseaseDisorderMention', str(context.exception))
+                with self.assertRaises(ValueError):
+                    fmt.Document(fpath, projection=['tokens', 'sentence'])
+                # known names are fine
+                fmt.Document(fpath, projection=['tokens', 'sentences', 'document_id', 'text', 'mentions',
+                    'SignSymptomMention'])
+
+    def testFallbackAndCustomNames(self):
+        fpath = os.path.join(DATA_DIR, 'dense.xml')
+        # CAS parses any textsem *Mention type, registered or not
+        self.assertEqual(CAS.getMentions(fpath, types=['LabMention']), [])
+        with self.assertRaises(ValueError):
+            CAS.getMentions(fpath, types=['Lab'])
+        XMI.registerType('Dates', ('textsem', 'DateAnnotation'), lambda node: node.attrib['begin'])
+        try:
+            XMI.Document(os.path.join(DATA_DIR, 'dense.xmi'), projection=['Dates'])
+        finally:
+            XMI.registry.unregister(('textsem', 'DateAnnotation'))
+        with self.assertRaises(ValueError):
+            XMI.Document(os.path.join(DATA_DIR, 'dense.xmi'), projection=['Dates'])
+
+    def _parsed(self, fmt, fpath, **kwargs):
+        # the Document parseFile used, and its output
+        docs = []
+        class Recording(fmt.Document):
+            def __init__(self, *args, **kwargs):
+                super(Recording, self).__init__(*args, **kwargs)
+                docs.append(self)
+        with mock.patch.object(corpus, 'getFormat', lambda fpath, format=None: mock.Mock(Document=Recording)):
+            parsed = corpus.parseFile(fpath, **kwargs)
+        return (docs[0], parsed)
+
+    def testParseFileProjection(self):
+        for (fmt, fpath) in ((XMI, 'dense.xmi'), (CAS, 'dense.xml')):
+            fpath = os.path.join(DATA_DIR, fpath)
+            with self.subTest(format=fmt.__name__):
+                full = fmt.Document(fpath)
+                (doc, parsed) = self._parsed(fmt, fpath)
+                self.assertEqual(parsed, { 'document_id': full.document_id, 'mentions': full.mentions })
+                self.assertEqual([len(records) for records in doc._typed_tokens.values()],
+                    [0] * len(doc._typed_tokens))
+                self.assertEqual(doc._sentence_bounds, [])
+
+                (doc, parsed) = self._parsed(fmt, fpath, tokens=True, by_sentence=True)
+                self.assertEqual(serialize(parsed['tokens']),
+                    serialize(full.tokens(mentions=full.mentions, by_sentence=True)))
+                (doc, parsed) = self._parsed(fmt, fpath, tokens=True, get_POS_tags=True, words_only=True)
+                self.assertEqual(serialize(parsed['tokens']), serialize(full.tokens(mentions=full.mentions,
+                    get_POS_tags=True, words_only=True)))
+                self.assertEqual(doc._sentence_bounds, [])
+
+if __name__ == '__main__':
+    unittest.main()
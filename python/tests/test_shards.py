@@ -0,0 +1,153 @@
+'''
+Tests for shard mode (ctakes.shards): shards partition the corpus, and
+merging the results or indexes of N shards gives the same output as an
+unsharded run, whatever N; incomplete or damaged shard sets are refused.
+
+Run from the python directory:  python -m pytest -q tests
+'''
+
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+from ctakes import corpus, shards
+from ctakes.index import CUIIndex
+
+from makeTokenData import DATA_DIR
+
+_sources = ('dense.xmi', 'sparse.xmi', 'long_sentences.xmi')
+_settings = { 'tokens': False }
+
+def _queries(index):
+    # everything a query can see, in query order
+    documents = [(index.path(doc), index.documentID(doc)) for doc in sorted(index._doc_by_path.values())]
+    return (documents, { cui: list(index.postings(cui)) for cui in index.CUIs() })
+
+class TestShards(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.mkdtemp(prefix='ctakes-test-')
+        corpus_dir = os.path.join(cls.tmpdir, 'corpus')
+        os.makedirs(corpus_dir)
+        for i in range(10):
+            shutil.copy(os.path.join(DATA_DIR, _sources[i % len(_sources)]),
+                os.path.join(corpus_dir, 'note%02d.xmi' % i))
+        with tarfile.open(os.path.join(corpus_dir, 'notes.tar'), 'w') as container:
+            for source in _sources:
+                container.add(os.path.join(DATA_DIR, source), arcname=source)
+        cls.fpaths = corpus.listFiles([corpus_dir])
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmpdir, ignore_errors=True)
+
+    def setUp(self):
+        self.outdir = tempfile.mkdtemp(dir=self.tmpdir)
+
+    def _writeResults(self, fpath, fpaths, output_format):
+        results = corpus.processCorpus(fpaths, num_workers=1)
+        if output_format == 'jsonl':
+            with open(fpath, 'w') as outf:
+                corpus.writeJSONL(results, outf)
+        else:
+            with open(fpath, 'wb') as outf:
+                corpus.writePickle(results, outf)
+        with open(fpath, 'rb') as stream:
+            return stream.read()
+
+    def _shardResults(self, num_shards, output_format='jsonl'):
+        # as processCorpus.py --shard i/N does
+        outfiles = []
+        settings = dict(_settings, output_format=output_format)
+        for shard in range(num_shards):
+            fpaths = shards.selectShard(self.fpaths, shard, num_shards)
+            outfiles.append(os.path.join(self.outdir, 'out.%d.%s' % (shard, output_format)))
+            self._writeResults(outfiles[-1], fpaths, output_format)
+            shards.writeResultsInfo(outfiles[-1], shard, num_shards, 'name', settings, fpaths)
+        return outfiles
+
+    def _shardIndexes(self, num_shards):
+        # as buildIndex.py --shard i/N does
+        index_dirs = []
+        for shard in range(num_shards):
+            fpaths = shards.selectShard(self.fpaths, shard, num_shards)
+            index_dirs.append(os.path.join(self.outdir, 'index.%d' % shard))
+            CUIIndex(index_dirs[-1]).addFiles(fpaths, num_workers=1, batch_size=3)
+            shards.writeIndexInfo(index_dirs[-1], shard, num_shards, 'name', { 'format': None }, fpaths)
+        return index_dirs
+
+    def _readCounts(self, fpath):
+        with open(fpath, 'r') as stream:
+            return { cui: [int(mentions), int(docs)]
+                for (cui, mentions, docs) in [line.split('\t') for line in stream] }
+
+    def testSelectShard(self):
+        for num_shards in (1, 2, 3, 5):
+            with self.subTest(num_shards=num_shards):
+                selected = [shards.selectShard(self.fpaths, shard, num_shards) for shard in range(num_shards)]
+                self.assertEqual(sorted([fpath for fpaths in selected for fpath in fpaths]), sorted(self.fpaths))
+                # by name only, so wherever the corpus is mounted
+                moved = [fpath.replace(self.tmpdir, '/elsewhere') for fpath in self.fpaths]
+                self.assertEqual([shards.selectShard(moved, shard, num_shards) for shard in range(num_shards)],
+                    [[fpath.replace(self.tmpdir, '/elsewhere') for fpath in fpaths] for fpaths in selected])
+
+    def testMergeResults(self):
+        for output_format in ('jsonl', 'pickle'):
+            expected = self._writeResults(os.path.join(self.outdir, 'full.%s' % output_format),
+                self.fpaths, output_format)
+            unsharded_counts = None
+            for num_shards in (1, 2, 3, 5):
+                with self.subTest(output_format=output_format, num_shards=num_shards):
+                    outfiles = self._shardResults(num_shards, output_format)
+                    merged_path = os.path.join(self.outdir, 'merged.%d.%s' % (num_shards, output_format))
+                    counts_path = merged_path + '.counts'
+                    counts = shards.mergeResults(outfiles, merged_path, cui_counts_path=counts_path)
+                    with open(merged_path, 'rb') as stream:
+                        self.assertEqual(stream.read(), expected)
+                    self.assertEqual(self._readCounts(counts_path), counts)
+                    if unsharded_counts is None: unsharded_counts = counts
+                    self.assertEqual(counts, unsharded_counts)
+                    # the merged output is itself a complete set of one shard
+                    info = shards.readInfo(merged_path + shards.RESULTS_INFO_SUFFIX)
+                    self.assertEqual((info['shard'], info['num_shards']), (0, 1))
+                    self.assertEqual(sorted(info['files']), sorted(self.fpaths))
+
+    def testMergeIndexes(self):
+        full = CUIIndex(os.path.join(self.outdir, 'full'))
+        full.addFiles(self.fpaths, num_workers=1)
+        expected = _queries(full)
+        for num_shards in (1, 2, 3, 5):
+            with self.subTest(num_shards=num_shards):
+                merged_dir = os.path.join(self.outdir, 'merged.%d' % num_shards)
+                index_dirs = self._shardIndexes(num_shards)
+                counts = shards.mergeIndexes(index_dirs, merged_dir)
+                merged = CUIIndex(merged_dir)
+                self.assertEqual(_queries(merged), expected)
+                self.assertEqual(counts, { cui: [len(full.postings(cui)), full.documentFrequency(cui)]
+                    for cui in full.CUIs() })
+                shards.readInfo(os.path.join(merged_dir, shards.INDEX_INFO_NAME))
+                for index_dir in index_dirs: shutil.rmtree(index_dir)
+
+    def testRefusesBadShards(self):
+        outfiles = self._shardResults(3)
+        merged_path = os.path.join(self.outdir, 'merged.jsonl')
+        with self.assertRaises(ValueError):
+            shards.mergeResults(outfiles[:2], merged_path)
+        with self.assertRaises(ValueError):
+            shards.mergeResults(outfiles + outfiles[:1], merged_path)
+        with open(outfiles[1], 'ab') as stream:
+            stream.write(b'\n')
+        with self.assertRaises(IOError):
+            shards.mergeResults(outfiles, merged_path)
+        self.assertFalse(os.path.exists(merged_path))
+
+        # shards made with other settings
+        settings = dict(_settings, tokens=True, output_format='jsonl')
+        shards.writeResultsInfo(outfiles[1], 1, 3, 'name', settings, shards.selectShard(self.fpaths, 1, 3))
+        with self.assertRaises(ValueError):
+            shards.mergeResults(outfiles, merged_path)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+'''
+Tests for document text access (ctakes.annotations.Sofa): UTF-16
+annotation offsets map to the right text around characters outside the
+Basic Multilingual Plane, and out-of-range offsets are clamped the same
+way whatever characters the text holds.
+
+Run from the python directory:  python -m pytest -q tests
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+from ctakes.annotations import Sofa, Mention
+from ctakes.format import XMI
+
+# offsets in UTF-16 code units: each emoji takes two
+_text = 'pain \U0001F600 in chest \U0001F494.'
+_spans = {
+    'pain': (0, 4),
+    '\U0001F600': (5, 7),
+    'in': (8, 10),
+    'chest \U0001F494': (11, 19),
+    '.': (19, 20),
+}
+_length = 20
+
+_xmi = '''<?xml version="1.0" encoding="UTF-8"?><xmi:XMI xmlns:xmi="http://www.omg.org/XMI" xmlns:cas="http:///uima/cas.ecore" xmlns:syntax="http:///org/apache/ctakes/typesystem/type/syntax.ecore" xmlns:textsem="http:///org/apache/ctakes/typesystem/type/textsem.ecore" xmlns:refsem="http:///org/apache/ctakes/typesystem/type/refsem.ecore" xmi:version="2.0">
+<cas:Sofa xmi:id="1" sofaNum="1" sofaID="_InitialView" mimeType="text" sofaString="%s"/>
+<syntax:WordToken xmi:id="2" sofa="1" begin="0" end="4" normalizedForm="pain"/>
+<syntax:SymbolToken xmi:id="3" sofa="1" begin="5" end="7" normalizedForm="\U0001F600"/>
+<syntax:WordToken xmi:id="4" sofa="1" begin="8" end="10" normalizedForm="in"/>
+<syntax:WordToken xmi:id="5" sofa="1" begin="11" end="16" normalizedForm="chest"/>
+<syntax:SymbolToken xmi:id="6" sofa="1" begin="17" end="19" normalizedForm="\U0001F494"/>
+<syntax:PunctuationToken xmi:id="7" sofa="1" begin="19" end="20" normalizedForm="."/>
+<textsem:SignSymptomMention xmi:id="8" sofa="1" begin="11" end="19" ontologyConceptArr="9"/>
+<refsem:UmlsConcept xmi:id="9" cui="C0008031"/>
+<textsem:SignSymptomMention xmi:id="10" sofa="1" begin="17" end="25" ontologyConceptArr="11"/>
+<refsem:UmlsConcept xmi:id="11" cui="C0030193"/>
+</xmi:XMI>
+''' % _text
+
+class TestSofa(unittest.TestCase):
+
+    def testSurrogatePairs(self):
+        sofa = Sofa(_text)
+        for (expected, (begin, end)) in _spans.items():
+            with self.subTest(span=expected):
+                self.assertEqual(sofa.slice(begin, end), expected)
+        self.assertEqual(sofa.slice(0, _length), _text)
+        self.assertEqual(sofa.context(8, 10, width=3), (' \U0001F600 ', 'in', ' ch'))
+
+    def testOutOfRange(self):
+        # the same clamping with and without characters outside the BMP
+        # (and of length _length in UTF-16 either way)
+        for text in (_text, _text.replace('\U0001F600', 'ab').replace('\U0001F494', 'cd'),
+                _text.replace('\U0001F600', 'éé').replace('\U0001F494', 'éé')):
+            sofa = Sofa(text)
+            with self.subTest(text=text):
+                self.assertEqual(sofa.slice(19, 25), '.')
+                self.assertEqual(sofa.slice(_length, _length + 5), '')
+                self.assertEqual(sofa.slice(100, 200), '')
+                self.assertEqual(sofa.slice(-3, 4), 'pain')
+                self.assertEqual(sofa.position(_length + 10), len(text))
+                self.assertEqual(sofa.context(17, 30, width=2)[2], '')
+                self.assertEqual(Mention(bounds=(_length - 1, _length + 3), sofa=sofa).surface, '.')
+        self.assertIsNone(Sofa().slice(0, 5))
+
+    def testDocument(self):
+        tmpdir = tempfile.mkdtemp(prefix='ctakes-test-')
+        try:
+            fpath = os.path.join(tmpdir, 'emoji.xmi')
+            with open(fpath, 'w', encoding='utf-8') as stream:
+                stream.write(_xmi)
+            doc = XMI.Document(fpath)
+            self.assertEqual(doc.text, _text)
+            self.assertEqual([m.surface for m in doc.mentions], ['chest \U0001F494', '\U0001F494.'])
+            self.assertEqual(doc.tokens(surface=True), ['pain', '\U0001F600', 'in', 'chest', '\U0001F494', '.'])
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+if __name__ == '__main__':
+    unittest.main()
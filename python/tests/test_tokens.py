@@ -0,0 +1,88 @@
+'''
+Regression tests for getTokens: the output of the streaming, heap-merged
+parser must match the output of the original line-based implementation
+(recorded by makeTokenData.py) for every combination of get_POS_tags,
+words_only, by_sentence and mentions, for XMI and CAS files in either
+line layout.  (The baseline cannot combine get_POS_tags with mentions;
+see _checkPOSWithMentions.)
+
+Run from the python directory:  python -m pytest -q tests
+'''
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from ctakes.format import XMI, CAS
+
+from makeTokenData import DATA_DIR, EXPECTED_FILE, DOCUMENTS, flagCombinations, flagKey, isRecorded, \
+    serialize, getTokens, runTokens
+
+class TestTokens(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        with open(EXPECTED_FILE, 'r') as stream:
+            cls.expected = json.load(stream)
+        # single-line copies of the (clean) fixtures, as cTAKES writes them
+        cls.tmpdir = tempfile.mkdtemp(prefix='ctakes-test-')
+        for (name, _) in DOCUMENTS:
+            for ext in ('.xmi', '.xml'):
+                with open(os.path.join(DATA_DIR, name + ext), 'r', encoding='utf-8') as stream:
+                    lines = stream.read().split('\n')
+                with open(os.path.join(cls.tmpdir, name + ext), 'w', encoding='utf-8') as stream:
+                    stream.write(''.join(lines) + '\n')
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmpdir, ignore_errors=True)
+
+    def _check(self, module, directory, ext):
+        for (name, _) in DOCUMENTS:
+            fpath = os.path.join(directory, name + ext)
+            for flags in flagCombinations():
+                with self.subTest(file=fpath, flags=flagKey(flags)):
+                    if isRecorded(flags):
+                        self.assertEqual(runTokens(module, fpath, flags), self.expected[name][flagKey(flags)])
+                    else:
+                        self._checkPOSWithMentions(module, fpath, name, flags)
+
+    def _checkPOSWithMentions(self, module, fpath, name, flags):
+        '''Check output with both get_POS_tags and mentions: without its
+        POS tags, it must match the recorded output with mentions; and its
+        (token, POS) pairs outside of mentions must appear, in order, in
+        the recorded output with POS tags.
+        '''
+        output = getTokens(module, fpath, flags)
+        self.assertEqual(serialize(output, strip_POS=True),
+            self.expected[name][flagKey(dict(flags, get_POS_tags=False))])
+        tagged = _taggedTokens(self.expected[name][flagKey(dict(flags, mentions=False))])
+        position = 0
+        for token in _taggedTokens(serialize(output)):
+            self.assertIn(token, tagged[position:])
+            position = tagged.index(token, position) + 1
+
+    def testXMI(self):
+        self._check(XMI, DATA_DIR, '.xmi')
+
+    def testCAS(self):
+        self._check(CAS, DATA_DIR, '.xml')
+
+    def testXMISingleLine(self):
+        self._check(XMI, self.tmpdir, '.xmi')
+
+    def testCASSingleLine(self):
+        self._check(CAS, self.tmpdir, '.xml')
+
+def _taggedTokens(items):
+    # the top-level (token, POS) pairs of serialized output, in order
+    tokens = []
+    for item in items:
+        if type(item) == dict and 'tokens' in item: tokens.extend(_taggedTokens(item['tokens']))
+        elif type(item) == list and len(item) == 2 and all([type(part) == str for part in item]):
+            tokens.append(tuple(item))
+    return tokens
+
+if __name__ == '__main__':
+    unittest.main()